@@ -22,5 +22,17 @@ import os
 # Ensure all file_formats are registered with Arcana
 from .file_format import registered_file_formats
 
-# Should be set explicitly in all FSL interfaces, but this squashes the warning
-os.environ['FSLOUTPUTTYPE'] = 'NIFTI_GZ'
+# Should be set explicitly in all FSL interfaces, but this squashes the
+# warning and sets the default for those that aren't
+from .output_policy import fsl_output_type  # @IgnorePep8
+os.environ['FSLOUTPUTTYPE'] = fsl_output_type()
+
+# Record the number of threads nodes are created with, so the nianalysis
+# runners can pass them on to the tools they run
+from . import runner  # @IgnorePep8 @UnusedImport
+
+# Opt-in profiling of the resources used by nianalysis interfaces, enabled by
+# environment variable so that it is inherited by worker processes
+from .profiling import PROFILE_DIR_ENV, enable_profiling  # @IgnorePep8
+if os.environ.get(PROFILE_DIR_ENV):
+    enable_profiling()
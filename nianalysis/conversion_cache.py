@@ -0,0 +1,279 @@
+"""
+A local cache of the images converted from DICOM series, so that repeated
+conversions of the same series (e.g. by the sub-studies of a multi-modal
+study, or with the 'mrconvert' variants of the NIfTI formats) are only
+performed once.
+
+Entries are keyed by a hash of the contents of the input series, the
+converter and its options, and the cached images are hardlinked into the
+working directories of the nodes that request them (so a cache hit costs
+next to nothing). As the hardlinks share their contents with the cache
+entry, the cached files are made read-only so that downstream interfaces
+can't modify them in place. The least recently used entries are evicted
+once the cache grows beyond its maximum size.
+
+The cache is enabled by setting the NIANALYSIS_CONVERSION_CACHE_DIR
+environment variable to the directory to store it in, and its maximum size
+(in GB, default 50) can be set with NIANALYSIS_CONVERSION_CACHE_SIZE.
+"""
+import os.path
+import json
+import stat
+import uuid
+import shutil
+import hashlib
+import logging
+from nipype.interfaces.base import isdefined
+from nianalysis.utils import link_or_copy
+
+logger = logging.getLogger('nianalysis')
+
+CACHE_DIR_ENV = 'NIANALYSIS_CONVERSION_CACHE_DIR'
+CACHE_SIZE_ENV = 'NIANALYSIS_CONVERSION_CACHE_SIZE'
+
+DEFAULT_CACHE_SIZE = 50  # GB
+
+HASH_BLOCK_SIZE = 2 ** 20
+
+WRITE_BITS = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+
+
+class ConversionCache(object):
+    """
+    A directory of cached conversion outputs, with an entry (sub-directory)
+    per key
+
+    Parameters
+    ----------
+    cache_dir : str
+        The directory to store the cache in
+    max_size : int
+        The maximum total size of the cached files in bytes
+    """
+
+    TMP_PREFIX = '.tmp_'
+
+    def __init__(self, cache_dir, max_size=DEFAULT_CACHE_SIZE * 1024 ** 3):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_size = max_size
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    @classmethod
+    def key(cls, in_path, converter, options):
+        """
+        Returns the cache key of a conversion
+
+        Parameters
+        ----------
+        in_path : str
+            Path to the input file or (DICOM series) directory. The names
+            and contents of the files are hashed so the key doesn't depend
+            on where the series has been copied to.
+        converter : str
+            Name of the converter
+        options : dict
+            The options the converter is run with (JSON serialisable)
+        """
+        sha = hashlib.sha1()
+        sha.update(json.dumps([converter, options],
+                              sort_keys=True).encode())
+        if os.path.isdir(in_path):
+            fpaths = []
+            for dpath, dnames, fnames in os.walk(in_path):
+                dnames.sort()
+                fpaths.extend(os.path.join(dpath, f) for f in sorted(fnames))
+        else:
+            fpaths = [in_path]
+        for fpath in fpaths:
+            sha.update(os.path.relpath(fpath, in_path).encode())
+            with open(fpath, 'rb') as f:
+                for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+                    sha.update(block)
+        return sha.hexdigest()
+
+    def fetch(self, key, out_dir, prefix=''):
+        """
+        Links the files cached under the key into the output directory,
+        prepending 'prefix' to their names
+
+        Returns
+        -------
+        fnames : list(str) | None
+            The names of the linked files or None if the key isn't cached
+        """
+        entry_dir = os.path.join(self.cache_dir, key)
+        try:
+            fnames = sorted(os.listdir(entry_dir))
+            for fname in fnames:
+                dst = os.path.join(out_dir, prefix + fname)
+                if os.path.lexists(dst):
+                    os.remove(dst)
+                link_or_copy(os.path.join(entry_dir, fname), dst)
+            # Mark the entry as recently used
+            os.utime(entry_dir, None)
+        except OSError:
+            # Not cached (or evicted while it was being linked)
+            return None
+        return [prefix + f for f in fnames]
+
+    def store(self, key, paths, names=None):
+        """
+        Stores the files under the key (with the given names or their
+        basenames). The files are linked into a temporary directory that is
+        renamed to the entry in one step, so that concurrent processes never
+        see partial entries. The stored files are made read-only (along with
+        the files they are hardlinked to).
+        """
+        if names is None:
+            names = [os.path.basename(p) for p in paths]
+        entry_dir = os.path.join(self.cache_dir, key)
+        if os.path.exists(entry_dir):
+            return
+        tmp_dir = os.path.join(self.cache_dir,
+                               self.TMP_PREFIX + uuid.uuid4().hex)
+        os.mkdir(tmp_dir)
+        try:
+            for path, name in zip(paths, names):
+                dst = os.path.join(tmp_dir, name)
+                link_or_copy(path, dst)
+                self._make_read_only(dst)
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # Most likely stored by another process in the meantime
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.evict()
+
+    @classmethod
+    def _make_read_only(cls, path):
+        if os.path.isdir(path):
+            fpaths = [os.path.join(dpath, f)
+                      for dpath, _, fnames in os.walk(path) for f in fnames]
+        else:
+            fpaths = [path]
+        for fpath in fpaths:
+            os.chmod(fpath, stat.S_IMODE(os.stat(fpath).st_mode) &
+                     ~WRITE_BITS)
+
+    def entries(self):
+        """
+        Returns the key, last access time and size of each entry, least
+        recently used first
+        """
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            if key.startswith(self.TMP_PREFIX):
+                continue
+            entry_dir = os.path.join(self.cache_dir, key)
+            try:
+                size = sum(
+                    os.path.getsize(os.path.join(dpath, f))
+                    for dpath, _, fnames in os.walk(entry_dir)
+                    for f in fnames)
+                entries.append((key, os.path.getmtime(entry_dir), size))
+            except OSError:
+                continue  # Evicted by another process
+        return sorted(entries, key=lambda e: e[1])
+
+    def size(self):
+        return sum(e[2] for e in self.entries())
+
+    def evict(self):
+        "Removes the least recently used entries until under the max size"
+        entries = self.entries()
+        total = sum(e[2] for e in entries)
+        for key, _, size in entries:
+            if total <= self.max_size:
+                break
+            shutil.rmtree(os.path.join(self.cache_dir, key),
+                          ignore_errors=True)
+            total -= size
+
+
+def cache_from_env(dir_env, size_env):
+    """
+    Returns the cache stored in the directory named by the 'dir_env'
+    environment variable, with the maximum size (in GB) named by 'size_env',
+    or None if 'dir_env' isn't set
+    """
+    cache_dir = os.environ.get(dir_env)
+    if not cache_dir:
+        return None
+    max_size = float(os.environ.get(size_env, DEFAULT_CACHE_SIZE))
+    return ConversionCache(cache_dir, max_size=int(max_size * 1024 ** 3))
+
+
+def conversion_cache():
+    """
+    Returns the conversion cache configured by the environment, or None if
+    it isn't enabled
+    """
+    return cache_from_env(CACHE_DIR_ENV, CACHE_SIZE_ENV)
+
+
+def interface_options(inputs, ignore=(), hash_files=False):
+    """
+    Returns the defined inputs of an interface that affect its outputs, to
+    key its entries in a cache
+
+    Parameters
+    ----------
+    inputs : nipype inputs
+        The inputs of the interface
+    ignore : list(str)
+        Names of the inputs that don't affect the outputs (the environment
+        is always ignored)
+    hash_files : bool
+        Whether input files are replaced by hashes of their contents, so
+        the key doesn't depend on where they are stored
+    """
+    options = {}
+    for name, value in inputs.get().items():
+        if name in ignore or name == 'environ' or not isdefined(value):
+            continue
+        if hash_files and isinstance(value, str) and os.path.isfile(value):
+            value = ConversionCache.key(value, '', {})
+        options[name] = value
+    return options
+
+
+class CachedConversionMixin(object):
+    """
+    Mixin for converter interfaces that looks up their outputs in the
+    conversion cache before running them, and stores them afterwards.
+    Classes using it need to define the names of the input trait holding
+    the input path ('cache_input') and of the traits that don't affect the
+    output image ('cache_ignore'), and override `_cache_output_dir` if they
+    don't write their outputs to the working directory.
+    """
+
+    cache_input = 'in_file'
+    cache_ignore = ()
+
+    def _cache_output_dir(self):
+        return os.getcwd()
+
+    def _cache_options(self):
+        return interface_options(
+            self.inputs, ignore=(self.cache_input,) + tuple(self.cache_ignore))
+
+    def _run_interface(self, runtime):
+        cache = conversion_cache()
+        in_path = getattr(self.inputs, self.cache_input)
+        if cache is None or not os.path.isdir(in_path):
+            # Only DICOM series (directories) are cached
+            return super(CachedConversionMixin, self)._run_interface(runtime)
+        key = cache.key(in_path, type(self).__name__, self._cache_options())
+        out_dir = self._cache_output_dir()
+        if cache.fetch(key, out_dir) is not None:
+            logger.info("Linked cached conversion of '{}' ({})".format(
+                in_path, key))
+            runtime.returncode = 0
+            return runtime
+        before = set(os.listdir(out_dir))
+        runtime = super(CachedConversionMixin, self)._run_interface(runtime)
+        if runtime.returncode == 0:
+            cache.store(key, [os.path.join(out_dir, f)
+                              for f in sorted(os.listdir(out_dir))
+                              if f not in before])
+        return runtime
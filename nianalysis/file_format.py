@@ -1,6 +1,10 @@
+import heapq
 from copy import deepcopy, copy
+from nipype.pipeline import engine as pe
+from nipype.interfaces.utility import IdentityInterface
 from arcana.node import Node
 from arcana.file_format import FileFormat, Converter
+from arcana.exception import ArcanaNoConverterError
 from nianalysis.interfaces.mrtrix import MRConvert
 from nianalysis.requirement import (
     dcm2niix_req, mrtrix3_req)
@@ -33,6 +37,140 @@ class MrtrixConverter(Converter):
         return convert_node, 'in_file', 'out_file'
 
 
+# Relative cost of a conversion step by each converter, used to pick the
+# cheapest path between two formats. Consecutive MRtrix steps are collapsed
+# into a single mrconvert invocation so only the first of them is counted
+CONVERTER_COSTS = {Dcm2niixConverter: 3.0,
+                   MrtrixConverter: 1.0}
+
+# Formats whose images are gzipped on write, which is only done for the
+# final step of a conversion (i.e. never for intermediate images)
+GZIPPED_FORMATS = ('nifti_gz',)
+GZIP_COST = 2.0
+
+
+def conversion_plan(input_format, output_format):
+    """
+    Plans the cheapest conversion from one format to another through the
+    converters registered with the formats (see CONVERTER_COSTS), unless
+    there is a converter registered directly between them, without
+    gzipping any intermediate images. Consecutive MRtrix conversions are
+    collapsed into a single mrconvert step.
+
+    Parameters
+    ----------
+    input_format : FileFormat
+        The format to convert from
+    output_format : FileFormat
+        The format to convert to
+
+    Returns
+    -------
+    plan : list(tuple(FileFormat, FileFormat, type))
+        The input format, output format and converter class of each step
+    """
+    if input_format == output_format:
+        return []
+    # Directly registered converters are always used as is, as the choice
+    # between them can matter (e.g. Dcm2niix vs mrconvert for DICOMs)
+    try:
+        converter_cls = output_format._converters[input_format.name]
+    except KeyError:
+        pass
+    else:
+        if converter_cls is not PlannedConverter:
+            return [(input_format, output_format, converter_cls)]
+    # Converters available to convert from each format. Planned converters
+    # are excluded, as they would resolve to themselves
+    edges = {}
+    for fmt in set(FileFormat.by_names.values()):
+        for from_name, converter_cls in fmt._converters.items():
+            if not issubclass(converter_cls, PlannedConverter):
+                edges.setdefault(from_name, []).append((fmt, converter_cls))
+    # Dijkstra's search over (format, whether the last step was MRtrix)
+    # states, with hop count to break ties in favour of shorter paths
+    queue = [(0.0, 0, 0, input_format.name, False, [])]
+    visited = set()
+    counter = 1  # Avoids comparing the plans in the heap
+    while queue:
+        cost, num_steps, _, name, after_mrtrix, path = heapq.heappop(queue)
+        if name == output_format.name:
+            plan = _collapse_plan(path)
+            assert not any(issubclass(c, PlannedConverter)
+                           for _, _, c in plan)
+            return plan
+        if (name, after_mrtrix) in visited:
+            continue
+        visited.add((name, after_mrtrix))
+        for fmt, converter_cls in edges.get(name, []):
+            is_final = fmt.name == output_format.name
+            if fmt.name in GZIPPED_FORMATS and not is_final:
+                continue
+            is_mrtrix = issubclass(converter_cls, MrtrixConverter)
+            step_cost = (0.0 if is_mrtrix and after_mrtrix
+                         else CONVERTER_COSTS.get(converter_cls, 1.0))
+            if is_final and fmt.name in GZIPPED_FORMATS:
+                step_cost += GZIP_COST
+            from_fmt = FileFormat.by_name(name)
+            heapq.heappush(queue, (
+                cost + step_cost, num_steps + 1, counter, fmt.name,
+                is_mrtrix, path + [(from_fmt, fmt, converter_cls)]))
+            counter += 1
+    raise ArcanaNoConverterError(
+        "There is no sequence of converters to convert {} to {}".format(
+            input_format, output_format))
+
+
+def _collapse_plan(plan):
+    collapsed = []
+    for in_fmt, out_fmt, converter_cls in plan:
+        if (collapsed and issubclass(converter_cls, MrtrixConverter) and
+                issubclass(collapsed[-1][2], MrtrixConverter)):
+            collapsed[-1] = (collapsed[-1][0], out_fmt, collapsed[-1][2])
+        else:
+            collapsed.append((in_fmt, out_fmt, converter_cls))
+    return collapsed
+
+
+class PlannedConverter(Converter):
+    """
+    Converts between formats that have no direct converter registered by
+    chaining the cheapest sequence of registered converters (see
+    `conversion_plan`). It is registered explicitly in the converters of
+    formats that can only be reached through other formats, e.g.
+    converters={'nifti_gz': PlannedConverter}
+    """
+
+    requirements = []
+
+    def __init__(self, input_format, output_format):
+        self._plan = conversion_plan(input_format, output_format)
+        self.requirements = [r for _, _, c in self._plan
+                             for r in c.requirements]
+        super(PlannedConverter, self).__init__(input_format, output_format)
+
+    @property
+    def plan(self):
+        return self._plan
+
+    def get_node(self, name):
+        converters = [c(i, o) for i, o, c in self._plan]
+        if len(converters) == 1:
+            return converters[0].get_node(name)
+        workflow = pe.Workflow(name=name)
+        inputnode = pe.Node(IdentityInterface(['in_file']), name='inputnode')
+        outputnode = pe.Node(IdentityInterface(['out_file']),
+                             name='outputnode')
+        prev_node, prev_field = inputnode, 'in_file'
+        for i, converter in enumerate(converters):
+            node, in_field, out_field = converter.get_node(
+                '{}_step{}'.format(name, i))
+            workflow.connect(prev_node, prev_field, node, in_field)
+            prev_node, prev_field = node, out_field
+        workflow.connect(prev_node, prev_field, outputnode, 'out_file')
+        return workflow, 'inputnode.in_file', 'outputnode.out_file'
+
+
 # =====================================================================
 # All Data Formats
 # =====================================================================
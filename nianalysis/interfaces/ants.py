@@ -2,6 +2,7 @@ from nipype.interfaces.base import (
     TraitedSpec, traits, File, CommandLineInputSpec, CommandLine)
 import os
 from nipype.interfaces.base import isdefined
+from nianalysis.registration_cache import CachedRegistrationMixin
 
 ants_reg_path = os.path.abspath(
     os.path.join(os.path.dirname(__file__), 'resources', 'bash',
@@ -50,9 +51,10 @@ class AntsRegSynOutputSpec(TraitedSpec):
     inv_warp = File(desc='invert of the warp file')
 
 
-class AntsRegSyn(CommandLine):
+class AntsRegSyn(CachedRegistrationMixin, CommandLine):
 
     _cmd = ants_reg_path
+    cache_ignore = ('num_threads',)
     input_spec = AntsRegSynInputSpec
     output_spec = AntsRegSynOutputSpec
     mat_ext = '.mat'
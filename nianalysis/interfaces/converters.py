@@ -3,13 +3,14 @@ import os.path
 from nipype.interfaces.base import (
     TraitedSpec, BaseInterface, File, Directory, traits, isdefined,
     CommandLineInputSpec, CommandLine)
-import pydicom
 import nibabel as nib
 from arcana.utils import split_extension
 import re
 from arcana.exception import ArcanaError
 import numpy as np
 from nipype.utils.filemanip import split_filename
+from nianalysis.conversion_cache import CachedConversionMixin
+from nianalysis.output_policy import save_nifti
 
 
 class Dcm2niixInputSpec(CommandLineInputSpec):
@@ -26,12 +27,27 @@ class Dcm2niixOutputSpec(TraitedSpec):
     converted = File(exists=True, desc="The converted file")
 
 
-class Dcm2niix(CommandLine):
-    """Convert a DICOM folder to a nifti_gz file"""
+class Dcm2niix(CachedConversionMixin, CommandLine):
+    """
+    Convert a DICOM folder to a nifti_gz file. Conversions are looked up in
+    (and saved to) the conversion cache if it is enabled (see
+    nianalysis.conversion_cache)
+    """
 
     _cmd = 'dcm2niix'
     input_spec = Dcm2niixInputSpec
     output_spec = Dcm2niixOutputSpec
+    cache_input = 'input_dir'
+    cache_ignore = ('out_dir', 'filename')
+
+    def _cache_options(self):
+        options = super(Dcm2niix, self)._cache_options()
+        # The cached files are linked under their original names
+        options['filename'] = self._gen_filename('filename')
+        return options
+
+    def _cache_output_dir(self):
+        return self._gen_filename('out_dir')
 
     def _list_outputs(self):
         if (not isdefined(self.inputs.compression) or
@@ -62,7 +78,7 @@ class Dcm2niix(CommandLine):
                 f = nib.load(el)
                 merged_file[:, :, :, i] = f.get_data()
             im2save = nib.Nifti1Image(merged_file, ex_file.affine)
-            nib.save(im2save, out_dir + fname)
+            save_nifti(im2save, out_dir + fname)
             converted = out_dir + fname
         elif len(products) > 1 and not self.inputs.multifile_concat:
             converted = products[-1]
@@ -120,6 +136,7 @@ class Nii2Dicom(BaseInterface):
     output_spec = Nii2DicomOutputSpec
 
     def _run_interface(self, runtime):
+        import pydicom
         dcms = self.inputs.reference_dicom
         to_remove = [x for x in dcms if '.dcm' not in x]
         if to_remove:
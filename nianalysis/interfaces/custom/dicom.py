@@ -3,9 +3,10 @@
 from nipype.interfaces.base import (BaseInterface, BaseInterfaceInputSpec,
                                     traits, TraitedSpec, Directory, File,
                                     isdefined)
+import io
+import re
 import numpy as np
 import glob
-import pydicom
 from nipype.utils.filemanip import split_filename
 import datetime as dt
 import os.path
@@ -16,6 +17,12 @@ import nibabel.nicom.csareader as csareader
 
 PEDP_TO_SIGN = {0: '-1', 1: '+1'}
 
+# Delimiters of the Interfile header embedded in Siemens list-mode headers
+INTERFILE_START = b'!INTERFILE'
+INTERFILE_END = b'!END OF INTERFILE'
+INTERFILE_DURATION_RE = re.compile(
+    br'image duration[^\r\n]*:=[ \t]*(\d+)')
+
 
 class DicomHeaderInfoExtractionInputSpec(BaseInterfaceInputSpec):
 
@@ -47,6 +54,7 @@ class DicomHeaderInfoExtraction(BaseInterface):
     output_spec = DicomHeaderInfoExtractionOutputSpec
 
     def _run_interface(self, runtime):
+        import pydicom
 
         list_dicom = sorted(glob.glob(self.inputs.dicom_folder + '/*'))
         multivol = self.inputs.multivol
@@ -143,6 +151,7 @@ class DicomHeaderInfoExtraction(BaseInterface):
         return outputs
 
     def get_phase_encoding_direction(self, dicom_path):
+        import pydicom
 
         dcm = pydicom.read_file(dicom_path)
         inplane_pe_dir = dcm[int('00181312', 16)].value
@@ -208,6 +217,76 @@ class ScanTimesInfo(BaseInterface):
         return outputs
 
 
+def list_mode_files(pet_data_dir):
+    """
+    Indexes the list-mode ('.bf') files in a directory tree in a single
+    pass, skipping hidden files and directories. The headers are paired by
+    name with the entries of the same directory, and only the list-mode
+    files that have a header are stat'ed for their size (the directory
+    entries only provide it on Windows).
+
+    Parameters
+    ----------
+    pet_data_dir : str
+        The root of the directory tree
+
+    Returns
+    -------
+    list_mode : list(tuple(str, int, str))
+        The path of each list-mode file, its size and the path of its
+        DICOM header ('<name>.dcm'), or None for both the size and the
+        header if it doesn't have one
+    """
+    list_mode = []
+    to_scan = [pet_data_dir]
+    while to_scan:
+        dpath = to_scan.pop()
+        bf_entries = []
+        names = set()
+        for entry in os.scandir(dpath):
+            if entry.name.startswith('.'):
+                continue
+            if entry.is_dir():
+                to_scan.append(entry.path)
+                continue
+            names.add(entry.name)
+            if '.bf' in entry.name:
+                bf_entries.append(entry)
+        for entry in bf_entries:
+            header = entry.name.split('.bf')[0] + '.dcm'
+            if header in names:
+                list_mode.append((entry.path, entry.stat().st_size,
+                                  os.path.join(dpath, header)))
+            else:
+                list_mode.append((entry.path, None, None))
+    return list_mode
+
+
+def interfile_duration(header):
+    """
+    Returns the 'image duration' (in seconds) from the Interfile header
+    embedded in a list-mode DICOM header, or None if it isn't present. Only
+    the Interfile block is searched if its delimiters are found (falling
+    back to the whole header if it doesn't contain the duration).
+
+    Parameters
+    ----------
+    header : bytes
+        The contents of the DICOM header
+    """
+    matches = []
+    start = header.find(INTERFILE_START)
+    if start >= 0:
+        end = header.find(INTERFILE_END, start)
+        matches = INTERFILE_DURATION_RE.findall(
+            header[start:(end if end >= 0 else None)])
+    if not matches:
+        matches = INTERFILE_DURATION_RE.findall(header)
+    if not matches:
+        return None
+    return int(matches[-1])
+
+
 class PetTimeInfoInputSpec(BaseInterfaceInputSpec):
     pet_data_dir = Directory(exists=True,
                              desc='Directory the the list-mode data.')
@@ -226,41 +305,29 @@ class PetTimeInfo(BaseInterface):
     output_spec = PetTimeInfoOutputSpec
 
     def _run_interface(self, runtime):
+        import pydicom
         pet_data_dir = self.inputs.pet_data_dir
         self.dict_output = {}
         pet_duration = None
-        for root, dirs, files in os.walk(pet_data_dir):
-            bf_files = [f for f in files if not f[0] == '.' and '.bf' in f]
-            dirs[:] = [d for d in dirs if not d[0] == '.']
-
-        if not bf_files:
+        # Largest list-mode file that has a header
+        list_mode = sorted(
+            (f for f in list_mode_files(pet_data_dir) if f[2] is not None),
+            key=lambda f: f[1])
+        if not list_mode:
             pet_start_time = None
             pet_endtime = None
             print ('No .bf file found in {}. If you want to perform motion '
                    'correction please provide the right pet data. ')
         else:
-            max_size = 0
-            for bf in bf_files:
-                size = os.path.getsize(os.path.join(root, bf))
-                if size > max_size:
-                    max_size = size
-                    list_mode_file = os.path.join(root, bf)
-
-            pet_image = list_mode_file.split('.bf')[0] + '.dcm'
+            pet_image = list_mode[-1][2]
+            with open(pet_image, 'rb') as f:
+                header = f.read()
             try:
-                hd = pydicom.read_file(pet_image)
+                hd = pydicom.read_file(io.BytesIO(header))
                 pet_start_time = hd.AcquisitionTime
             except AttributeError:
                 pet_start_time = None
-            with open(pet_image, 'rb') as f:
-                for line in f:
-                    try:
-                        line = line[:-1].decode('utf-8')
-                    except UnicodeDecodeError:
-                        continue
-                    if 'image duration' in line:
-                        pet_duration = line.strip()
-                        pet_duration = int(pet_duration.split(':=')[-1])
+            pet_duration = interfile_duration(header)
             if pet_duration:
                 pet_endtime = ((
                     dt.datetime.strptime(pet_start_time, '%H%M%S.%f') +
@@ -309,6 +376,7 @@ class Nii2Dicom(BaseInterface):
     output_spec = Nii2DicomOutputSpec
 
     def _run_interface(self, runtime):
+        import pydicom
         dcms = self.inputs.reference_dicom
         to_remove = [x for x in dcms if '.dcm' not in x]
         if to_remove:
@@ -0,0 +1,107 @@
+import os.path
+from nipype.interfaces.base import (
+    BaseInterface, BaseInterfaceInputSpec, TraitedSpec, File, traits,
+    isdefined)
+import nibabel as nib
+import numpy as np
+from nipype.utils.filemanip import split_filename
+from nianalysis.output_policy import save_nifti, nifti_ext, COMPRESS_DESC
+
+# The b-value below which volumes are treated as b=0 (as in MRtrix)
+B0_THRESHOLD = 10.0
+
+
+def b0_indices(bvals, threshold=B0_THRESHOLD):
+    "Returns the indices of the b=0 volumes given the b-values"
+    return [i for i, b in enumerate(np.ravel(bvals)) if b <= threshold]
+
+
+def mean_of_volumes(in_file, indices, out_file):
+    """
+    Averages the selected volumes of a 4D image into a 3D image. The
+    volumes are read one at a time, in file order, through the image's
+    array proxy (so the rest of the series is never loaded into memory) and
+    accumulated in single precision. The file is kept open between the
+    volumes so that a gzipped series is only decompressed once.
+
+    Parameters
+    ----------
+    in_file : str
+        Path to the 4D image
+    indices : list(int)
+        The indices of the volumes to average
+    out_file : str
+        Path to save the mean to (gzipped if it ends in '.gz')
+
+    Returns
+    -------
+    out_file : str
+        The path the mean was saved to
+    """
+    if not indices:
+        raise ValueError("No volumes selected from '{}'".format(in_file))
+    img = nib.load(in_file, keep_file_open=True)
+    if len(img.shape) == 3:
+        if list(indices) != [0]:
+            raise ValueError("Cannot select volumes {} from 3D image '{}'"
+                             .format(indices, in_file))
+        mean = np.asanyarray(img.dataobj, dtype=np.float32)
+    else:
+        mean = np.zeros(img.shape[:3], dtype=np.float32)
+        for i in sorted(indices):
+            mean += np.asanyarray(img.dataobj[..., i], dtype=np.float32)
+        mean /= len(indices)
+    return save_nifti(nib.Nifti1Image(mean, img.affine), out_file)
+
+
+class ExtractMeanB0InputSpec(BaseInterfaceInputSpec):
+
+    in_file = File(exists=True, mandatory=True, desc='4D DWI series')
+    bvals = File(exists=True, desc=('b-values in FSL format. If not '
+                                    'provided the first volume is taken'))
+    b0_threshold = traits.Float(
+        B0_THRESHOLD, usedefault=True,
+        desc='The b-value below which volumes are treated as b=0')
+    out_file = File(genfile=True, desc='Name of the output image')
+    compress = traits.Bool(True, usedefault=True, desc=COMPRESS_DESC)
+
+
+class ExtractMeanB0OutputSpec(TraitedSpec):
+
+    out_file = File(exists=True, desc='The mean of the b=0 volumes')
+
+
+class ExtractMeanB0(BaseInterface):
+    """
+    Extracts the b=0 volumes of a DWI series and averages them in a single
+    pass, without writing the intermediate b=0 series
+    """
+
+    input_spec = ExtractMeanB0InputSpec
+    output_spec = ExtractMeanB0OutputSpec
+
+    def _run_interface(self, runtime):
+        if isdefined(self.inputs.bvals):
+            indices = b0_indices(np.loadtxt(self.inputs.bvals),
+                                 self.inputs.b0_threshold)
+        else:
+            indices = [0]
+        mean_of_volumes(self.inputs.in_file, indices, self._gen_outname())
+        return runtime
+
+    def _list_outputs(self):
+        outputs = self._outputs().get()
+        outputs['out_file'] = self._gen_outname()
+        return outputs
+
+    def _gen_filename(self, name):
+        if name == 'out_file':
+            return self._gen_outname()
+        return None
+
+    def _gen_outname(self):
+        if isdefined(self.inputs.out_file):
+            return os.path.abspath(self.inputs.out_file)
+        _, base, _ = split_filename(self.inputs.in_file)
+        return os.path.abspath(base + '_b0' +
+                               nifti_ext(self.inputs.compress))
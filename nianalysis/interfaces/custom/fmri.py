@@ -1,12 +1,14 @@
 
 from nipype.interfaces.base import (
     BaseInterface, BaseInterfaceInputSpec, TraitedSpec, Directory, File,
-    traits)
+    traits, isdefined)
 import os
-import shutil
-import pydicom
 import numpy as np
+import nibabel as nib
 import glob
+from nianalysis.utils import link_or_copy
+from nianalysis.output_policy import save_nifti
+from nianalysis.temporal_filtering import tproject_regressors, project_out
 
 
 class PrepareFIXInputSpec(BaseInterfaceInputSpec):
@@ -22,6 +24,10 @@ class PrepareFIXInputSpec(BaseInterfaceInputSpec):
     t12MNI_mat = File(exists=True)
     MNI2t1_mat = File(exists=True)
     epi_mean = File(exists=True)
+    link_method = traits.Enum(
+        'hardlink', 'symlink', 'copy', usedefault=True,
+        desc=("How the inputs are placed in the FIX directory. Files that "
+              "can't be linked are copied"))
 
 
 class PrepareFIXOutputSpec(TraitedSpec):
@@ -49,20 +55,25 @@ class PrepareFIX(BaseInterface):
         MNI2t1_mat = self.inputs.MNI2t1_mat
         epi_mean = self.inputs.epi_mean
 
-        shutil.copytree(melodic_dir, 'melodic_ica')
+        # Build the directory structure FIX expects out of links to the
+        # inputs (falling back to copies) instead of duplicating them
+        def link(src, dst):
+            link_or_copy(src, dst, method=self.inputs.link_method)
+
+        link(melodic_dir, 'melodic_ica')
         os.mkdir('melodic_ica/reg')
-        shutil.copy2(t12MNI_mat, 'melodic_ica/reg/highres2std.mat')
-        shutil.copy2(MNI2t1_mat, 'melodic_ica/reg/std2highres.mat')
-        shutil.copy2(epi2t1_mat, 'melodic_ica/reg/example_func2highres.mat')
-        shutil.copy2(t1_brain, 'melodic_ica/reg/highres.nii.gz')
-        shutil.copy2(epi_preproc, 'melodic_ica/reg/example_func.nii.gz')
-        shutil.copy2(t12epi_mat, 'melodic_ica/reg/highres2example_func.mat')
+        link(t12MNI_mat, 'melodic_ica/reg/highres2std.mat')
+        link(MNI2t1_mat, 'melodic_ica/reg/std2highres.mat')
+        link(epi2t1_mat, 'melodic_ica/reg/example_func2highres.mat')
+        link(t1_brain, 'melodic_ica/reg/highres.nii.gz')
+        link(epi_preproc, 'melodic_ica/reg/example_func.nii.gz')
+        link(t12epi_mat, 'melodic_ica/reg/highres2example_func.mat')
         os.mkdir('melodic_ica/mc')
-        shutil.copy2(mc_par, 'melodic_ica/mc/prefiltered_func_data_mcf.par')
-        shutil.copy2(epi_brain_mask, 'melodic_ica/mask.nii.gz')
-        shutil.copy2(epi_mean, 'melodic_ica/mean_func.nii.gz')
-        shutil.copytree(melodic_dir, 'melodic_ica/filtered_func_data.ica')
-        shutil.copy2(filtered_epi, 'melodic_ica/filtered_func_data.nii.gz')
+        link(mc_par, 'melodic_ica/mc/prefiltered_func_data_mcf.par')
+        link(epi_brain_mask, 'melodic_ica/mask.nii.gz')
+        link(epi_mean, 'melodic_ica/mean_func.nii.gz')
+        link(melodic_dir, 'melodic_ica/filtered_func_data.ica')
+        link(filtered_epi, 'melodic_ica/filtered_func_data.nii.gz')
 
         with open('hand_label_file.txt', 'w') as f:
             f.write('not_provided')
@@ -94,6 +105,7 @@ class FieldMapTimeInfo(BaseInterface):
     output_spec = FieldMapTimeInfoOutputSpec
 
     def _run_interface(self, runtime):
+        import pydicom
 
         fm_mag = sorted(glob.glob(self.inputs.fm_mag+'/*'))
         tes = [pydicom.read_file(x).EchoTime for x in fm_mag]
@@ -116,3 +128,213 @@ class FieldMapTimeInfo(BaseInterface):
         outputs["delta_te"] = self.delta_te
 
         return outputs
+
+
+def migp(in_files, dim, mask=None, dtype=np.float32):
+    """
+    MELODIC's Incremental Group-PCA (MIGP, Smith et al. 2014, NeuroImage
+    101). Approximates the top 'dim' principal components of the temporal
+    concatenation of the subjects' time-series by adding the subjects one
+    at a time to a running reduced eigenspace, so that no more than
+    2 * 'dim' components plus one subject's time-series are held in
+    memory.
+
+    Parameters
+    ----------
+    in_files : list(str)
+        Paths to the 4D time-series of the subjects (in the same space)
+    dim : int
+        The number of components kept in the reduced eigenspace
+    mask : np.ndarray(bool)
+        Mask of the voxels to include. If None, all voxels that are
+        non-zero in the first subject are included
+
+    Returns
+    -------
+    reduced : np.ndarray (n_components, n_voxels)
+        The reduced eigenspace (weighted by the singular values)
+    mask : np.ndarray(bool)
+        The mask of the included voxels
+    """
+    reduced = None
+    for in_file in in_files:
+        data = np.asanyarray(nib.load(in_file).dataobj)
+        if mask is None:
+            mask = np.any(data != 0, axis=3)
+        ts = data[mask].T.astype(dtype)
+        del data
+        # Demean and variance-normalise each voxel's time-series
+        ts -= ts.mean(axis=0)
+        std = ts.std(axis=0)
+        ts /= np.where(std > 0, std, 1)
+        reduced = ts if reduced is None else np.vstack((reduced, ts))
+        del ts
+        # Only reduce once the buffer has doubled, to amortise the cost of
+        # the eigen-decompositions
+        if reduced.shape[0] > 2 * dim:
+            reduced = _reduce(reduced, dim)
+    if reduced.shape[0] > dim:
+        reduced = _reduce(reduced, dim)
+    return reduced, mask
+
+
+def _reduce(data, dim):
+    "Projects the rows of data onto its top 'dim' principal components"
+    # The eigen-decomposition of the (small) temporal covariance matrix
+    # gives the left singular vectors of the data
+    evals, evecs = np.linalg.eigh(np.dot(data, data.T))
+    evecs = evecs[:, np.argsort(evals)[::-1][:dim]]
+    return np.dot(evecs.T, data)
+
+
+class MIGPInputSpec(BaseInterfaceInputSpec):
+
+    in_files = traits.List(File(exists=True), mandatory=True,
+                           desc="The 4D time-series of the subjects")
+    mask = File(exists=True, desc="Mask of the voxels to include")
+    dim = traits.Int(500, usedefault=True,
+                     desc="The number of components of the reduced data")
+    out_file = File('migp.nii.gz', usedefault=True,
+                    desc="Name of the reduced data image")
+
+
+class MIGPOutputSpec(TraitedSpec):
+
+    out_file = File(exists=True,
+                    desc=("The reduced group data, with a volume per "
+                          "component, to be passed to MELODIC"))
+
+
+class MIGP(BaseInterface):
+    """
+    Reduces the time-series of a group of subjects to a fixed number of
+    principal components with MIGP, so that group ICA can be run on the
+    reduced data in bounded memory however many subjects there are
+    """
+
+    input_spec = MIGPInputSpec
+    output_spec = MIGPOutputSpec
+
+    def _run_interface(self, runtime):
+        ref = nib.load(self.inputs.in_files[0])
+        if isdefined(self.inputs.mask):
+            mask = np.asanyarray(nib.load(self.inputs.mask).dataobj) > 0
+        else:
+            mask = None
+        reduced, mask = migp(self.inputs.in_files, self.inputs.dim,
+                             mask=mask)
+        out = np.zeros(mask.shape + (reduced.shape[0],), dtype=np.float32)
+        out[mask] = reduced.T
+        save_nifti(nib.Nifti1Image(out, ref.affine), self.inputs.out_file)
+        return runtime
+
+    def _list_outputs(self):
+        outputs = self._outputs().get()
+        outputs["out_file"] = os.path.abspath(self.inputs.out_file)
+        return outputs
+
+
+class FusedTemporalFilterInputSpec(BaseInterfaceInputSpec):
+
+    in_file = File(exists=True, mandatory=True, desc="4D time-series")
+    mask = File(exists=True, mandatory=True,
+                desc="Mask of the voxels to filter")
+    tr = traits.Float(mandatory=True, desc="The repetition time (s)")
+    polort = traits.Int(2, usedefault=True,
+                        desc="Remove polynomials up to this degree")
+    stopband = traits.Tuple(
+        (traits.Float(), traits.Float()),
+        desc="Remove all the frequencies in the range provided (Hz)")
+    blur_fwhm = traits.Float(
+        desc=("FWHM (mm) of the Gaussian blur applied within the mask after "
+              "the filtering"))
+    chunk_size = traits.Int(
+        20000, usedefault=True,
+        desc=("Number of voxels filtered at a time (including those outside "
+              "the mask)"))
+    out_file = File('filtered_func_data.nii.gz', usedefault=True,
+                    desc="Name of the filtered image")
+
+
+class FusedTemporalFilterOutputSpec(TraitedSpec):
+
+    out_file = File(exists=True, desc="The filtered time-series")
+
+
+class FusedTemporalFilter(BaseInterface):
+    """
+    In-process equivalent of running AFNI's 3dTproject (with '-polort',
+    '-stopband', '-mask' and '-blur') and then adding back the temporal
+    mean of the input with fslmaths, which reads the time-series once and
+    writes the filtered image once.
+
+    The blur is a Gaussian kernel normalised within the mask, which
+    approximates 3dTproject's in-mask blur.
+    """
+
+    input_spec = FusedTemporalFilterInputSpec
+    output_spec = FusedTemporalFilterOutputSpec
+
+    def _run_interface(self, runtime):
+        # Kept open so that reading the volumes one at a time (in file
+        # order) only decompresses the image once
+        img = nib.load(self.inputs.in_file, keep_file_open=True)
+        mask = np.asanyarray(nib.load(self.inputs.mask).dataobj) > 0
+        shape = mask.shape
+        n_times = img.shape[3]
+        n_voxels = mask.size
+        mask = np.ravel(mask, order='F')
+        # The time-series are read a volume at a time into the output buffer
+        # (time x voxels), which is then filtered in place a chunk of voxels
+        # at a time, so the output is the only full-size array
+        out = np.empty((n_times, n_voxels), dtype=np.float32)
+        for t in range(n_times):
+            out[t] = np.ravel(img.dataobj[..., t], order='F')
+        stopband = (self.inputs.stopband
+                    if isdefined(self.inputs.stopband) else None)
+        regressors = tproject_regressors(n_times, self.inputs.tr,
+                                         polort=self.inputs.polort,
+                                         stopband=stopband)
+        pinv = np.linalg.pinv(regressors)
+        blur = isdefined(self.inputs.blur_fwhm) and self.inputs.blur_fwhm > 0
+        if blur:
+            # The means are added back after the residuals are blurred
+            means = np.empty(n_voxels, dtype=np.float32)
+        for start in range(0, n_voxels, self.inputs.chunk_size):
+            end = start + self.inputs.chunk_size
+            chunk = out[:, start:end]
+            chunk_mask = mask[start:end]
+            filtered = project_out(chunk[:, chunk_mask], regressors,
+                                   pinv=pinv)
+            # The mean is restored everywhere, as with 'fslmaths -Tmean' and
+            # '-add'
+            mean = np.mean(chunk, axis=0, dtype=np.float32)
+            chunk[...] = mean
+            if blur:
+                means[start:end] = mean
+                chunk[:, chunk_mask] = filtered
+            else:
+                chunk[:, chunk_mask] += filtered
+        if blur:
+            from scipy.ndimage import gaussian_filter
+            sigma = [self.inputs.blur_fwhm / (np.sqrt(8 * np.log(2)) * z)
+                     for z in img.header.get_zooms()[:3]]
+            mask_vol = mask.reshape(shape, order='F').astype(np.float32)
+            norm = np.ravel(gaussian_filter(mask_vol, sigma), order='F')[mask]
+            vol = np.zeros(n_voxels, dtype=np.float32)
+            for t in range(n_times):
+                vol[mask] = out[t, mask]
+                blurred = np.ravel(gaussian_filter(
+                    vol.reshape(shape, order='F'), sigma), order='F')
+                out[t, mask] = means[mask] + blurred[mask] / norm
+        # The transpose of the buffer is in Fortran order so it can be
+        # reshaped to the image dimensions without copying
+        save_nifti(nib.Nifti1Image(
+            np.reshape(out.T, shape + (n_times,), order='F'), img.affine),
+            self.inputs.out_file)
+        return runtime
+
+    def _list_outputs(self):
+        outputs = self._outputs().get()
+        outputs["out_file"] = os.path.abspath(self.inputs.out_file)
+        return outputs
@@ -4,22 +4,19 @@ from nipype.interfaces.base import (BaseInterface, BaseInterfaceInputSpec,
 import numpy as np
 from nipype.utils.filemanip import split_filename
 import os
+import re
 import glob
+import json
 import shutil
 import nibabel as nib
 from nipype.interfaces.base import isdefined
-import scipy.ndimage.measurements as snm
 import datetime as dt
-try:
-    import matplotlib 
-    matplotlib.use('Agg') 
-    import matplotlib.pyplot as plot
-except ImportError:
-    pass
-from nipype.interfaces import fsl
-import pydicom
 import math
 import subprocess as sp
+from nianalysis.output_policy import (
+    nifti_ext, fsl_output_type, gzip_file, COMPRESS_DESC)
+from nianalysis.utils import pyplot, gather
+from nianalysis.interfaces.custom.dwi import mean_of_volumes
 
 
 class MotionMatCalculationInputSpec(BaseInterfaceInputSpec):
@@ -78,10 +75,7 @@ class MotionMatCalculation(BaseInterface):
                 concat = reg_mat[:]
                 self.gen_motion_mat(concat, qform_mat, out_name)
                 mm = glob.glob('*motion_mat*.mat')
-        os.mkdir(out_name)
-
-        for f in mm:
-            shutil.move(f, out_name)
+        gather(mm, out_name, move=True)
 
         return runtime
 
@@ -131,10 +125,7 @@ class MergeListMotionMat(BaseInterface):
 
         file_list = self.inputs.file_list
         pth, _, _ = split_filename(file_list[0])
-        if os.path.isdir(pth+'/motion_mats') is False:
-            os.mkdir(pth+'/motion_mats')
-        for f in file_list:
-            shutil.copy(f, pth+'/motion_mats')
+        gather(file_list, pth+'/motion_mats')
 
         return runtime
 
@@ -160,6 +151,7 @@ class PrepareDWIInputSpec(BaseInterfaceInputSpec):
                 ' be with multiple directions or b0.')
     topup = traits.Bool(desc='Specify whether the PrepareDWI output will be'
                         'used for TOPUP distortion correction.')
+    compress = traits.Bool(True, usedefault=True, desc=COMPRESS_DESC)
 
 
 class PrepareDWIOutputSpec(TraitedSpec):
@@ -185,10 +177,9 @@ class PrepareDWI(BaseInterface):
         ped_polarity = float(self.inputs.ped_polarity)
         topup = self.inputs.topup
         if isdefined(self.inputs.dwi) and isdefined(self.inputs.dwi1):
+            # Only the shapes are needed, which are read from the headers
             dwi = nib.load(self.inputs.dwi)
-            dwi = dwi.get_data()
             dwi1 = nib.load(self.inputs.dwi1)
-            dwi1 = dwi1.get_data()
             if len(dwi.shape) == 4 and len(dwi1.shape) == 3:
                 self.dict_output['main'] = self.inputs.dwi
                 self.dict_output['secondary'] = self.inputs.dwi1
@@ -199,12 +190,10 @@ class PrepareDWI(BaseInterface):
                 self.dict_output['main'] = self.inputs.dwi
                 self.dict_output['secondary'] = self.inputs.dwi1
             elif topup and len(dwi1.shape) == 4:
-                ref = nib.load(self.inputs.dwi1)
-                dwi1_b0 = dwi1[:, :, :, 0]
-                im2save = nib.Nifti1Image(dwi1_b0, affine=ref.affine)
-                nib.save(im2save, 'b0.nii.gz')
+                b0_fname = 'b0' + nifti_ext(self.inputs.compress)
+                mean_of_volumes(self.inputs.dwi1, [0], b0_fname)
                 self.dict_output['main'] = self.inputs.dwi
-                self.dict_output['secondary'] = os.getcwd()+'/b0.nii.gz'
+                self.dict_output['secondary'] = os.getcwd()+'/'+b0_fname
 
         if np.sign(ped_polarity) == 1:
             if pe_dir == 'ROW':
@@ -366,6 +355,7 @@ class AffineMatrixGeneration(BaseInterface):
     output_spec = AffineMatrixGenerationOutputSpec
 
     def _run_interface(self, runtime):
+        import scipy.ndimage.measurements as snm
 
         _, out_name, _ = split_filename(self.inputs.motion_parameters)
         motion_par = np.loadtxt(self.inputs.motion_parameters)
@@ -387,9 +377,7 @@ class AffineMatrixGeneration(BaseInterface):
                 'affine_mat_{}.mat'.format(str(i).zfill(4)), mat, fmt='%f')
 
         affines = glob.glob('affine_mat*.mat')
-        os.mkdir(out_name)
-        for f in affines:
-            shutil.move(f, out_name)
+        gather(affines, out_name, move=True)
 
         return runtime
 
@@ -462,6 +450,10 @@ class MeanDisplacementCalculationInputSpec(BaseInterfaceInputSpec):
                               'by the user. This is used for the severe motion'
                               'report in order to provide the real names of '
                               'possibly corrupted images.')
+    records_dir = Directory(desc='Directory to persist the results of each '
+                            'scan in between runs, so that only scans that '
+                            'are new (or whose motion mats have changed) are '
+                            'processed when the calculation is rerun.')
 
 
 class MeanDisplacementCalculationOutputSpec(TraitedSpec):
@@ -502,28 +494,45 @@ class MeanDisplacementCalculation(BaseInterface):
     output_spec = MeanDisplacementCalculationOutputSpec
 
     def _run_interface(self, runtime):
+        import scipy.ndimage.measurements as snm
 
-        list_inputs = list(zip(
-            self.inputs.motion_mats, self.inputs.start_times,
-            self.inputs.real_durations, self.inputs.trs,
-            self.inputs.input_names))
         ref = nib.load(self.inputs.reference)
         ref_data = ref.get_data()
         # centre of gravity
         ref_cog = np.asarray(snm.center_of_mass(ref_data))
-        list_inputs = sorted(list_inputs, key=lambda k: k[1])
-        study_start_time = list_inputs[0][1]
-        list_inputs = [
-            (x[0], (dt.datetime.strptime(x[1], '%H%M%S.%f') -
-                    dt.datetime.strptime(list_inputs[0][1], '%H%M%S.%f'))
-             .total_seconds(), x[2], x[3], x[4]) for x in list_inputs]
-        study_len = int((list_inputs[-1][1]+float(list_inputs[-1][2]))*1000)
+        records = []
+        for mats_dir, start_time, real_duration, tr, name in zip(
+                self.inputs.motion_mats, self.inputs.start_times,
+                self.inputs.real_durations, self.inputs.trs,
+                self.inputs.input_names):
+            mats = sorted(glob.glob(mats_dir+'/*inv.mat'))
+            fingerprint = [
+                start_time, float(real_duration), float(tr),
+                ref_cog.tolist(),
+                [[os.path.basename(m), os.path.getmtime(m)] for m in mats]]
+            record = self._load_record(name)
+            if record is None or record['fingerprint'] != fingerprint:
+                record = self._scan_record(name, mats, ref_cog)
+                record['fingerprint'] = fingerprint
+                self._save_record(name, record)
+            record.update(
+                name=name, start_time=start_time,
+                real_duration=float(real_duration), tr=float(tr),
+                mats4average=sorted(glob.glob(mats_dir+'/*mat.mat')))
+            records.append(record)
+        records = sorted(records, key=lambda r: r['start_time'])
+        study_start_time = dt.datetime.strptime(records[0]['start_time'],
+                                                '%H%M%S.%f')
+        for r in records:
+            r['start'] = (dt.datetime.strptime(r['start_time'], '%H%M%S.%f') -
+                          study_start_time).total_seconds()
+        study_len = int((records[-1]['start'] +
+                         records[-1]['real_duration'])*1000)
         mean_displacement_rc = np.zeros(study_len)-1
         motion_par_rc = np.zeros((6, study_len))-1
         mean_displacement = []
+        mean_displacement_consecutive = []
         motion_par = []
-        idt_mat = np.eye(4)
-        all_mats = []
         all_mats4average = []
         start_times = []
         volume_names = []
@@ -534,62 +543,41 @@ class MeanDisplacementCalculation(BaseInterface):
             ' are scans with very different mean displacement with respect '
             'to the others.\nIn that case please check the registration of '
             'that particular scan.']
-        for f in list_inputs:
-            mats = sorted(glob.glob(f[0]+'/*inv.mat'))
-            mats4averge = sorted(glob.glob(f[0]+'/*mat.mat'))
-            all_mats = all_mats+mats
-            all_mats4average = all_mats4average+mats4averge
-            start_scan = f[1]
-            tr = f[3]
-            if len(mats) > 1:  # for 4D files
-                for i, mat in enumerate(mats):
-                    volume_names.append(f[-1]+'_vol_{}'
-                                        .format(str(i+1).zfill(4)))
-                    start_times.append((
-                        dt.datetime.strptime(
-                            study_start_time, '%H%M%S.%f') +
-                        dt.timedelta(seconds=start_scan))
-                                       .strftime('%H%M%S.%f'))
-                    end_scan = start_scan+tr
-                    m = np.loadtxt(mat)
-                    md = self.rmsdiff(ref_cog, m, idt_mat)
-                    mean_displacement_rc[
-                        int(start_scan*1000):int(end_scan*1000)] = md
-                    mean_displacement.append(md)
-                    mp = self.avscale(m, ref_cog)
-                    motion_par.append(mp)
-                    duration = int(end_scan*1000)-int(start_scan*1000)
-                    motion_par_rc[:, int(start_scan*1000):
-                                  int(end_scan*1000)] = np.array(
-                                      [mp, ]*duration).T
-                    start_scan = end_scan
-            elif len(mats) == 1:  # for 3D files
-                volume_names.append(f[-1])
+        last_mat = None
+        for r in records:
+            all_mats4average = all_mats4average+r['mats4average']
+            if not r['mean_displacement']:
+                continue
+            start_scan = r['start']
+            if len(r['mean_displacement']) > 1:  # for 4D files
+                durations = [r['tr']]*len(r['mean_displacement'])
+                volume_names.extend(
+                    r['name']+'_vol_{}'.format(str(i+1).zfill(4))
+                    for i in range(len(durations)))
+            else:  # for 3D files
+                durations = [r['real_duration']]
+                volume_names.append(r['name'])
+            for md, mp, duration in zip(r['mean_displacement'],
+                                        r['motion_par'], durations):
                 start_times.append((
-                    dt.datetime.strptime(study_start_time,
-                                         '%H%M%S.%f') +
+                    study_start_time +
                     dt.timedelta(seconds=start_scan)).strftime('%H%M%S.%f'))
-                end_scan = start_scan+float(f[2])
-                m = np.loadtxt(mats[0])
-                md = self.rmsdiff(ref_cog, m, idt_mat)
+                end_scan = start_scan+duration
                 mean_displacement_rc[
                     int(start_scan*1000):int(end_scan*1000)] = md
-                mean_displacement.append(md)
-                mp = self.avscale(m, ref_cog)
-                motion_par.append(mp)
-                duration = int(end_scan*1000)-int(start_scan*1000)
                 motion_par_rc[:, int(start_scan*1000):
-                              int(end_scan*1000)] = np.array(
-                                  [mp, ]*duration).T
+                              int(end_scan*1000)] = np.asarray(mp)[:, None]
+                start_scan = end_scan
+            mean_displacement.extend(r['mean_displacement'])
+            motion_par.extend(r['motion_par'])
+            if last_mat is not None:
+                mean_displacement_consecutive.append(self.rmsdiff(
+                    ref_cog, last_mat, np.asarray(r['first_mat'])))
+            mean_displacement_consecutive.extend(r['consecutive'])
+            last_mat = np.asarray(r['last_mat'])
         start_times.append((
-            dt.datetime.strptime(study_start_time, '%H%M%S.%f') +
+            study_start_time +
             dt.timedelta(seconds=end_scan)).strftime('%H%M%S.%f'))
-        mean_displacement_consecutive = []
-        for i in range(len(all_mats)-1):
-            m1 = np.loadtxt(all_mats[i])
-            m2 = np.loadtxt(all_mats[i+1])
-            md_consecutive = self.rmsdiff(ref_cog, m1, m2)
-            mean_displacement_consecutive.append(md_consecutive)
 
         corrupted_volumes = self.check_max_motion(motion_par)
         if corrupted_volumes:
@@ -603,13 +591,11 @@ class MeanDisplacementCalculation(BaseInterface):
                 corrupted_volume_names+[volume_names[x]
                                         for x in corrupted_volumes])
         offset_indexes = np.where(mean_displacement_rc == -1)
-        for i in range(len(mean_displacement_rc)):
-            if (mean_displacement_rc[i] == -1 and
-                    mean_displacement_rc[i-1] != -1):
-                mean_displacement_rc[i] = mean_displacement_rc[i-1]
-        for i in range(motion_par_rc.shape[1]):
-            if (motion_par_rc[0, i] == -1 and motion_par_rc[0, i-1] != -1):
-                motion_par_rc[:, i] = motion_par_rc[:, i-1]
+        # Fill the MR idling times with the values of the preceding scan
+        mean_displacement_rc = mean_displacement_rc[
+            self._fill_forward_index(mean_displacement_rc == -1)]
+        motion_par_rc = motion_par_rc[
+            :, self._fill_forward_index(motion_par_rc[0] == -1)]
 
         to_save = [mean_displacement, mean_displacement_consecutive,
                    mean_displacement_rc, motion_par_rc, start_times,
@@ -625,6 +611,59 @@ class MeanDisplacementCalculation(BaseInterface):
 
         return runtime
 
+    def _scan_record(self, name, mats, ref_cog):
+        """
+        Calculates the mean displacement and motion parameters of the
+        volumes of a scan, which depend only on its motion mats and the
+        reference
+        """
+        idt_mat = np.eye(4)
+        loaded = [np.loadtxt(m) for m in mats]
+        record = {
+            'mean_displacement': [
+                float(self.rmsdiff(ref_cog, m, idt_mat)) for m in loaded],
+            'motion_par': [
+                [float(p) for p in self.avscale(m, ref_cog)] for m in loaded],
+            'consecutive': [
+                float(self.rmsdiff(ref_cog, loaded[i], loaded[i+1]))
+                for i in range(len(loaded)-1)]}
+        if loaded:
+            record['first_mat'] = loaded[0].tolist()
+            record['last_mat'] = loaded[-1].tolist()
+        return record
+
+    def _record_path(self, name):
+        return os.path.join(self.inputs.records_dir,
+                            re.sub(r'[^\w\-.]', '_', name)+'.json')
+
+    def _load_record(self, name):
+        if not isdefined(self.inputs.records_dir):
+            return None
+        try:
+            with open(self._record_path(name)) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def _save_record(self, name, record):
+        if not isdefined(self.inputs.records_dir):
+            return
+        if not os.path.exists(self.inputs.records_dir):
+            os.makedirs(self.inputs.records_dir)
+        path = self._record_path(name)
+        with open(path+'.tmp', 'w') as f:
+            json.dump(record, f)
+        os.rename(path+'.tmp', path)
+
+    @classmethod
+    def _fill_forward_index(cls, missing):
+        """
+        Returns the index of the last preceding non-missing value for every
+        position, leaving leading missing values in place
+        """
+        index = np.where(missing, 0, np.arange(len(missing)))
+        return np.maximum.accumulate(index)
+
     def rmsdiff(self, cog, T1, T2):
         """Python implementation of the rmsdiff function in fsl"""
         R = 80
@@ -988,7 +1027,8 @@ class PlotMeanDisplacementRC(BaseInterface):
         frame_start_times = np.loadtxt(self.inputs.frame_start_times)
         framing = self.inputs.framing
         font = {'weight': 'bold', 'size': 30}
-        matplotlib.rc('font', **font)
+        plot = pyplot()
+        plot.rc('font', **font)
         fig, ax = plot.subplots()
         fig.set_size_inches(21, 9)
         ax.set_xlim(0, dates[-1])
@@ -1212,6 +1252,7 @@ class UmapAlign2ReferenceInputSpec(BaseInterfaceInputSpec):
                       'provided umap is continuos values, as the pseudo CT '
                       'umap. Otherwise, it will assume that the values are '
                       'discrete. Default is False.')
+    compress = traits.Bool(True, usedefault=True, desc=COMPRESS_DESC)
 
 
 class UmapAlign2ReferenceOutputSpec(TraitedSpec):
@@ -1238,7 +1279,7 @@ class UmapAlign2Reference(BaseInterface):
             self.UmapAlign2Reference_calc(mat, i, ute_regmat, ute_qform_mat,
                                           outname, umap, pct=pct)
 
-        umaps = glob.glob('Frame_*_umap.nii.gz')
+        umaps = glob.glob('Frame_*_umap' + nifti_ext(self.inputs.compress))
         if os.path.isdir('umaps_align2ref') is False:
             os.mkdir('umaps_align2ref')
         for u in umaps:
@@ -1248,6 +1289,7 @@ class UmapAlign2Reference(BaseInterface):
 
     def UmapAlign2Reference_calc(self, mat, i, ute_regmat, ute_qform_mat,
                                  outname, umap, pct=False):
+        from nipype.interfaces import fsl
 
         mat = np.loadtxt(mat)
         utemat = np.loadtxt(ute_regmat)
@@ -1273,10 +1315,13 @@ class UmapAlign2Reference(BaseInterface):
         flt.inputs.interp = interp
         flt.inputs.in_matrix_file = ('Frame_{0}_ref_to_ute.mat'
                                      .format(str(i).zfill(3)))
-        flt.inputs.out_file = 'Frame_{0}_umap.nii.gz'.format(
-            str(i).zfill(3))
+        flt.inputs.output_type = fsl_output_type(compress=False)
+        flt.inputs.out_file = 'Frame_{0}_umap{1}'.format(
+            str(i).zfill(3), nifti_ext(compress=False))
         flt.inputs.apply_xfm = True
         flt.run()
+        if self.inputs.compress:
+            gzip_file(flt.inputs.out_file)
 
     def _list_outputs(self):
         outputs = self._outputs().get()
@@ -1313,6 +1358,7 @@ class CreateMocoSeries(BaseInterface):
     output_spec = CreateMocoSeriesOutputSpec
 
     def _run_interface(self, runtime):
+        import pydicom
 
         moco_template = self.inputs.moco_template
         motion_par = np.loadtxt(self.inputs.motion_par)
@@ -5,14 +5,17 @@ import nibabel as nib
 import numpy as np
 from nipype.utils.filemanip import split_filename
 import os
-import matplotlib.pyplot as plot
-from sklearn.decomposition import PCA
 import subprocess as sp
 from nipype.interfaces.base.traits_extension import Directory, isdefined
-import shutil
 import glob
-import pydicom
-from nipype.interfaces import fsl
+from nianalysis.output_policy import (
+    save_nifti, nifti_ext, fsl_output_type, gzip_file, COMPRESS_DESC)
+from nianalysis.utils import pyplot, gather
+
+
+def _uncompressed_fsl_env():
+    "Environment for FSL commands run directly, writing uncompressed NIfTI"
+    return dict(os.environ, FSLOUTPUTTYPE=fsl_output_type(compress=False))
 
 
 list_mode_framing_path = os.path.abspath(
@@ -34,6 +37,7 @@ class PETdrInputSpec(BaseInterfaceInputSpec):
     binarize = traits.Bool(desc='If True, all the voxels greater than '
                            'threshold will be set to 1 (default False)',
                            default=False)
+    compress = traits.Bool(True, usedefault=True, desc=COMPRESS_DESC)
 
 
 class PETdrOutputSpec(TraitedSpec):
@@ -82,9 +86,11 @@ class PETdr(BaseInterface):
 
         im2save = nib.Nifti1Image(
             sm_zscore.reshape(spatial_regressor.shape), affine=img.affine)
-        nib.save(
-            im2save, '{0}_{1}_GLM_fit_zscore.nii.gz'.format(base, base_map))
+        save_nifti(
+            im2save, '{0}_{1}_GLM_fit_zscore{2}'.format(
+                base, base_map, nifti_ext(self.inputs.compress)))
 
+        plot = pyplot()
         plot.plot(timecourse)
         plot.savefig('{0}_{1}_timecourse.png'.format(base, base_map))
         plot.close()
@@ -106,7 +112,8 @@ class PETdr(BaseInterface):
             base = base+'_bin_th_{}'.format(str(th))
 
         outputs["spatial_map"] = os.path.abspath(
-            '{0}_{1}_GLM_fit_zscore.nii.gz'.format(base, base_map))
+            '{0}_{1}_GLM_fit_zscore{2}'.format(
+                base, base_map, nifti_ext(self.inputs.compress)))
         outputs["timecourse"] = os.path.abspath(
             '{0}_{1}_timecourse.png'.format(base, base_map))
 
@@ -117,6 +124,7 @@ class GlobalTrendRemovalInputSpec(BaseInterfaceInputSpec):
 
     volume = File(exists=True, desc='4D input file',
                   mandatory=True)
+    compress = traits.Bool(True, usedefault=True, desc=COMPRESS_DESC)
 
 
 class GlobalTrendRemovalOutputSpec(TraitedSpec):
@@ -141,6 +149,7 @@ class GlobalTrendRemoval(BaseInterface):
 
         n_voxels = data.shape[0]*data.shape[1]*data.shape[2]
         ts = data.reshape(n_voxels, data.shape[3])
+        from sklearn.decomposition import PCA
         pca = PCA(50)
         pca.fit(ts)
         baseline = np.reshape(
@@ -148,8 +157,9 @@ class GlobalTrendRemoval(BaseInterface):
         new_ts = ts.T-np.dot(baseline, np.dot(np.linalg.pinv(baseline), ts.T))
         im2save = nib.Nifti1Image(
             new_ts.T.reshape(data.shape), affine=img.affine)
-        nib.save(
-            im2save, '{}_baseline_removed.nii.gz'.format(base))
+        save_nifti(
+            im2save, '{}_baseline_removed{}'.format(
+                base, nifti_ext(self.inputs.compress)))
 
         return runtime
 
@@ -160,7 +170,8 @@ class GlobalTrendRemoval(BaseInterface):
         _, base, _ = split_filename(fname)
 
         outputs["detrended_file"] = os.path.abspath(
-            '{}_baseline_removed.nii.gz'.format(base))
+            '{}_baseline_removed{}'.format(
+                base, nifti_ext(self.inputs.compress)))
 
         return outputs
 
@@ -171,6 +182,7 @@ class SUVRCalculationInputSpec(BaseInterfaceInputSpec):
                   mandatory=True)
     base_mask = File(exists=True, desc='3D baseline mask',
                      mandatory=True)
+    compress = traits.Bool(True, usedefault=True, desc=COMPRESS_DESC)
 
 
 class SUVRCalculationOutputSpec(TraitedSpec):
@@ -200,7 +212,8 @@ class SUVRCalculation(BaseInterface):
         mean_uptake = np.mean(data[x[ii], y[ii], z[ii]])
         new_data = data / mean_uptake
         im2save = nib.Nifti1Image(new_data, affine=img.affine)
-        nib.save(im2save, '{}_SUVR.nii.gz'.format(base))
+        save_nifti(im2save, '{}_SUVR{}'.format(
+            base, nifti_ext(self.inputs.compress)))
 
         return runtime
 
@@ -211,7 +224,7 @@ class SUVRCalculation(BaseInterface):
         _, base, _ = split_filename(fname)
 
         outputs["SUVR_file"] = os.path.abspath(
-            '{}_SUVR.nii.gz'.format(base))
+            '{}_SUVR{}'.format(base, nifti_ext(self.inputs.compress)))
 
         return outputs
 
@@ -389,11 +402,7 @@ class MergeUnlistingOutputs(BaseInterface):
 
     def _run_interface(self, runtime):
 
-        sinograms = self.inputs.sinograms
-        if os.path.isdir('PET_sinograms_for_PCA') is False:
-            os.mkdir('PET_sinograms_for_PCA')
-        for s in sinograms:
-            shutil.move(s, 'PET_sinograms_for_PCA')
+        gather(self.inputs.sinograms, 'PET_sinograms_for_PCA')
 
         return runtime
 
@@ -433,6 +442,7 @@ class PreparePetDir(BaseInterface):
     output_spec = PreparePetDirOutputSpec
 
     def _run_interface(self, runtime):
+        import pydicom
 
         pet_dir = self.inputs.pet_dir
         image_orientation_check = self.inputs.image_orientation_check
@@ -478,7 +488,7 @@ class PreparePetDir(BaseInterface):
                                 pet_dir, basename, str(frame_num).zfill(3)))
                         hd = im.header
                         hd['db_name'] = 'New_e7tools'
-                        nib.save(
+                        save_nifti(
                             im, '{0}/{1}{2}.nii.gz'.format(
                                 pet_dir, basename, str(frame_num).zfill(3)))
                 pet_images = sorted(glob.glob(
@@ -492,9 +502,7 @@ class PreparePetDir(BaseInterface):
                 "have correct orientation then specify image_orientation_check"
                 "=True. Otherwise reconstruct your images with the new version"
                 ". This software does not support the old e7tools version.")
-        os.mkdir('pet_data')
-        for f in pet_images:
-            shutil.move(f, 'pet_data')
+        gather(pet_images, 'pet_data')
 
         return runtime
 
@@ -518,6 +526,9 @@ class PETFovCroppingInputSpec(BaseInterfaceInputSpec):
     y_size = traits.Int()
     z_min = traits.Int()
     z_size = traits.Int()
+    compress = traits.Bool(
+        desc=(COMPRESS_DESC + ". By default the output is compressed if the "
+              "input is"))
 
 
 class PETFovCroppingOutputSpec(TraitedSpec):
@@ -540,8 +551,7 @@ class PETFovCropping(BaseInterface):
         y_size = self.inputs.y_size
         z_min = self.inputs.z_min
         z_size = self.inputs.z_size
-        _, basename, ext = split_filename(pet_image)
-        outname = basename+'_crop'+ext
+        outname = self._gen_outname()
         pet = nib.load(pet_image)
         new_affine = np.copy(pet.affine)
         new_affine[:3, -1] = (pet.affine[:3, -1]-np.multiply(
@@ -560,20 +570,22 @@ class PETFovCropping(BaseInterface):
         im2save = nib.Nifti1Image(pet_cropped, affine=new_affine)
         im2save.set_qform(new_affine, code='scanner')
         im2save.set_sform(new_affine, code='scanner')
-        nib.save(im2save, outname)
+        save_nifti(im2save, outname)
 
         return runtime
 
     def _list_outputs(self):
         outputs = self._outputs().get()
-        pet_image = self.inputs.pet_image
-        _, basename, ext = split_filename(pet_image)
-        outname = basename+'_crop'+ext
-
-        outputs["pet_cropped"] = os.getcwd()+'/'+outname
+        outputs["pet_cropped"] = os.getcwd()+'/'+self._gen_outname()
 
         return outputs
 
+    def _gen_outname(self):
+        _, basename, ext = split_filename(self.inputs.pet_image)
+        if isdefined(self.inputs.compress):
+            ext = nifti_ext(self.inputs.compress)
+        return basename+'_crop'+ext
+
 
 class CheckPetMCInputsInputSpec(BaseInterfaceInputSpec):
 
@@ -682,6 +694,7 @@ class PetImageMotionCorrectionInputSpec(BaseInterfaceInputSpec):
     corr_factor = traits.Float()
     pet2ref_mat = File(exists=True)
     structural2ref_regmat = File(default=None)
+    compress = traits.Bool(True, usedefault=True, desc=COMPRESS_DESC)
 
 
 class PetImageMotionCorrectionOutputSpec(TraitedSpec):
@@ -732,24 +745,29 @@ class PetImageMotionCorrection(BaseInterface):
                                        outname+'_mc_corr')
         self.apply_temporal_correction(pet_image, corr_factor,
                                        outname+'_no_mc_corr')
+        if self.inputs.compress:
+            for suffix in ('_mc_corr', '_no_mc_corr'):
+                gzip_file(outname + suffix + nifti_ext(compress=False))
         self.out_basename = out_basename
 
         return runtime
 
     def apply_temporal_correction(self, image, corr_factor, out_name):
 
-        cmd = ('fslmaths {0}.nii.gz -mul {1} {2}'
+        cmd = ('fslmaths {0} -mul {1} {2}'
                .format(image, corr_factor, out_name))
-        sp.check_output(cmd, shell=True)
+        sp.check_output(cmd, shell=True, env=_uncompressed_fsl_env())
 
     def applyxfm(self, in_file, ref, mat, outname):
+        from nipype.interfaces import fsl
 
         applyxfm = fsl.FLIRT()
         applyxfm.inputs.in_file = in_file
         applyxfm.inputs.reference = ref
         applyxfm.inputs.apply_xfm = True
         applyxfm.inputs.in_matrix_file = mat
-        applyxfm.inputs.out_file = outname + '.nii.gz'
+        applyxfm.inputs.output_type = fsl_output_type(compress=False)
+        applyxfm.inputs.out_file = outname + nifti_ext(compress=False)
         applyxfm.run()
 
     def extract_qform(self, image):
@@ -773,11 +791,12 @@ class PetImageMotionCorrection(BaseInterface):
     def _list_outputs(self):
         outputs = self._outputs().get()
 
+        ext = nifti_ext(self.inputs.compress)
         outputs["pet_mc_image"] = glob.glob(
-            os.getcwd()+'/*{}_mc_corr.nii.gz'
-            .format(self.out_basename))[0]
+            os.getcwd()+'/*{}_mc_corr{}'
+            .format(self.out_basename, ext))[0]
         outputs["pet_no_mc_image"] = glob.glob(
-            os.getcwd()+'/*no_mc_corr.nii.gz')[0]
+            os.getcwd()+'/*no_mc_corr{}'.format(ext))[0]
         return outputs
 
 
@@ -785,6 +804,7 @@ class StaticPETImageGenerationInputSpec(BaseInterfaceInputSpec):
 
     pet_mc_images = traits.List()
     pet_no_mc_images = traits.List()
+    compress = traits.Bool(True, usedefault=True, desc=COMPRESS_DESC)
 
 
 class StaticPETImageGenerationOutputSpec(TraitedSpec):
@@ -816,11 +836,15 @@ class StaticPETImageGeneration(BaseInterface):
                 cmd = cmd + '{0} -add '.format(frame)
             else:
                 cmd = (cmd+'{0} static_PET_{1}'.format(frame, outname))
-        sp.check_output(cmd, shell=True)
+        sp.check_output(cmd, shell=True, env=_uncompressed_fsl_env())
+        if self.inputs.compress:
+            gzip_file('static_PET_{}{}'.format(
+                outname, nifti_ext(compress=False)))
 
     def _list_outputs(self):
         outputs = self._outputs().get()
 
-        outputs["static_mc"] = os.getcwd()+'/static_PET_mc_corr.nii.gz'
-        outputs["static_no_mc"] = os.getcwd()+'/static_PET_no_mc_corr.nii.gz'
+        ext = nifti_ext(self.inputs.compress)
+        outputs["static_mc"] = os.getcwd()+'/static_PET_mc_corr'+ext
+        outputs["static_no_mc"] = os.getcwd()+'/static_PET_no_mc_corr'+ext
         return outputs
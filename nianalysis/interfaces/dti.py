@@ -0,0 +1,225 @@
+"""
+An in-process diffusion tensor (DT) fit, which fits the log-linear tensor
+model to the masked voxels of a DWI series in batches using NumPy and
+derives the FA and ADC maps from the fitted tensors in the same pass. The
+tensors are fitted in the scanner frame, as by MRtrix's dwi2tensor, so the
+two fits produce interchangeable tensor images.
+"""
+import os.path
+from concurrent.futures import ThreadPoolExecutor
+from nipype.interfaces.base import (
+    BaseInterface, BaseInterfaceInputSpec, TraitedSpec, File, traits,
+    isdefined)
+import nibabel as nib
+import numpy as np
+from nianalysis.output_policy import save_nifti
+
+# The lowest signal intensity used in the log transform
+MIN_SIGNAL = 1e-6
+
+
+def bvecs_to_scanner(bvecs, affine):
+    """
+    Rotates gradient directions in FSL format, which are given relative to
+    the voxel axes of the image (with the x-axis flipped if the image
+    isn't stored in radiological order), into the scanner frame
+
+    Parameters
+    ----------
+    bvecs : np.ndarray (n_vols, 3)
+        The gradient directions in FSL format
+    affine : np.ndarray (4, 4)
+        The voxel to scanner transform of the image
+    """
+    linear = np.asarray(affine, dtype=float)[:3, :3]
+    bvecs = np.array(bvecs, dtype=float)
+    if np.linalg.det(linear) > 0:
+        bvecs[:, 0] = -bvecs[:, 0]
+    # Rotation part of the transform (i.e. without the voxel sizes/shears)
+    u, _, vt = np.linalg.svd(linear)
+    return np.dot(bvecs, np.dot(u, vt).T)
+
+
+def design_matrix(bvals, bvecs):
+    """
+    Returns the design matrix of the log-linear tensor model, with columns
+    for ln(S0), Dxx, Dyy, Dzz, Dxy, Dxz and Dyz
+
+    Parameters
+    ----------
+    bvals : np.ndarray (n_vols,)
+        The b-values of the volumes (s/mm^2)
+    bvecs : np.ndarray (n_vols, 3)
+        The gradient directions of the volumes
+    """
+    bvecs = np.asarray(bvecs, dtype=float)
+    norms = np.linalg.norm(bvecs, axis=1)
+    bvecs = bvecs / np.where(norms > 0, norms, 1)[:, None]
+    gx, gy, gz = bvecs.T
+    b = np.asarray(bvals, dtype=float)
+    return np.column_stack((np.ones_like(b),
+                            -b * gx ** 2, -b * gy ** 2, -b * gz ** 2,
+                            -2 * b * gx * gy, -2 * b * gx * gz,
+                            -2 * b * gy * gz))
+
+
+def fit_tensors(signal, design, method='wls', pinv=None):
+    """
+    Fits the log-linear tensor model to a batch of voxels
+
+    Parameters
+    ----------
+    signal : np.ndarray (n_voxels, n_vols)
+        The signal intensities of the voxels
+    design : np.ndarray (n_vols, 7)
+        The design matrix returned by `design_matrix`
+    method : str
+        Either 'ols' (ordinary least squares) or 'wls' (weighted least
+        squares, weighted by the squares of the signal predicted by the OLS
+        fit)
+    pinv : np.ndarray (7, n_vols)
+        The pseudo-inverse of the design matrix, which can be passed to
+        avoid recomputing it for every batch
+
+    Returns
+    -------
+    params : np.ndarray (n_voxels, 7)
+        The fitted ln(S0) and tensor components of the voxels
+    """
+    dtype = signal.dtype
+    design = design.astype(dtype, copy=False)
+    if pinv is None:
+        pinv = np.linalg.pinv(design)
+    log_signal = np.log(np.maximum(signal, MIN_SIGNAL))
+    params = np.dot(log_signal, pinv.astype(dtype, copy=False).T)
+    if method == 'ols':
+        return params
+    # Weights normalised per voxel to keep the normal equations well
+    # conditioned in single precision
+    log_pred = np.dot(params, design.T)
+    weights = np.exp(2 * (log_pred - log_pred.max(axis=1)[:, None]))
+    lhs = np.einsum('vn,ni,nj->vij', weights, design, design)
+    rhs = np.einsum('vn,ni->vi', weights * log_signal, design)
+    try:
+        return np.linalg.solve(lhs, rhs[:, :, None])[:, :, 0]
+    except np.linalg.LinAlgError:
+        # Fall back to solving voxel by voxel, keeping the OLS estimates of
+        # the voxels the weighted fit is singular for
+        for i in range(len(params)):
+            try:
+                params[i] = np.linalg.solve(lhs[i], rhs[i])
+            except np.linalg.LinAlgError:
+                pass
+        return params
+
+
+def tensor_metrics(tensors):
+    """
+    Returns the fractional anisotropy (FA) and mean apparent diffusion
+    coefficient (ADC) of tensors, computed from their invariants rather
+    than their eigenvalues
+
+    Parameters
+    ----------
+    tensors : np.ndarray (n_voxels, 6)
+        The Dxx, Dyy, Dzz, Dxy, Dxz and Dyz components of the tensors
+    """
+    diag = tensors[:, :3]
+    off_diag = tensors[:, 3:]
+    adc = diag.mean(axis=1)
+    norm_sq = (diag ** 2).sum(axis=1) + 2 * (off_diag ** 2).sum(axis=1)
+    dev_sq = (((diag - adc[:, None]) ** 2).sum(axis=1) +
+              2 * (off_diag ** 2).sum(axis=1))
+    fa = np.sqrt(1.5 * dev_sq / np.where(norm_sq > 0, norm_sq, 1))
+    return np.clip(fa, 0, 1), adc
+
+
+class FitDTIInputSpec(BaseInterfaceInputSpec):
+
+    in_file = File(exists=True, mandatory=True, desc="The DWI series")
+    bvecs = File(exists=True, mandatory=True,
+                 desc="Gradient directions in FSL format")
+    bvals = File(exists=True, mandatory=True, desc="b-values in FSL format")
+    in_mask = File(exists=True, desc="Mask of the voxels to fit")
+    method = traits.Enum('wls', 'ols', usedefault=True,
+                         desc="The least-squares method used in the fit")
+    chunk_size = traits.Int(
+        50000, usedefault=True,
+        desc="The number of voxels fitted at a time by each thread")
+    nthreads = traits.Int(1, usedefault=True,
+                          desc="The number of threads to fit chunks on")
+
+
+class FitDTIOutputSpec(TraitedSpec):
+
+    tensor = File(exists=True,
+                  desc=("The fitted tensor (Dxx, Dyy, Dzz, Dxy, Dxz and Dyz, "
+                        "in the scanner frame as output by dwi2tensor)"))
+    fa = File(exists=True, desc="Fractional anisotropy map")
+    adc = File(exists=True, desc="Mean apparent diffusion coefficient map")
+
+
+class FitDTI(BaseInterface):
+    """
+    Fits the diffusion tensor to each voxel with a batched log-linear least
+    squares fit, in single precision and in chunks of voxels that are
+    fitted in parallel, and writes the tensor, FA and ADC images
+    """
+
+    input_spec = FitDTIInputSpec
+    output_spec = FitDTIOutputSpec
+
+    def _run_interface(self, runtime):
+        img = nib.load(self.inputs.in_file)
+        data = np.asanyarray(img.dataobj)
+        vol_shape = data.shape[:3]
+        if isdefined(self.inputs.in_mask):
+            mask = np.asanyarray(nib.load(self.inputs.in_mask).dataobj) > 0
+        else:
+            mask = np.ones(vol_shape, dtype=bool)
+        signal = data[mask]
+        del data
+        bvals = np.loadtxt(self.inputs.bvals).ravel()
+        bvecs = np.loadtxt(self.inputs.bvecs)
+        if bvecs.shape[0] == 3 and bvecs.shape[1] != 3:
+            bvecs = bvecs.T
+        bvecs = bvecs_to_scanner(bvecs, img.affine)
+        design = design_matrix(bvals, bvecs).astype(np.float32)
+        pinv = np.linalg.pinv(design)
+
+        def fit_chunk(start):
+            chunk = signal[start:start + self.inputs.chunk_size].astype(
+                np.float32)
+            params = fit_tensors(chunk, design, method=self.inputs.method,
+                                 pinv=pinv)
+            tensors = params[:, 1:]
+            fa, adc = tensor_metrics(tensors)
+            return tensors, fa, adc
+
+        starts = range(0, len(signal), self.inputs.chunk_size)
+        if self.inputs.nthreads > 1:
+            # NumPy releases the GIL in the BLAS/LAPACK routines
+            with ThreadPoolExecutor(self.inputs.nthreads) as executor:
+                results = list(executor.map(fit_chunk, starts))
+        else:
+            results = [fit_chunk(s) for s in starts]
+        for i, (name, n_vols) in enumerate((('tensor', 6), ('fa', 1),
+                                            ('adc', 1))):
+            out = np.zeros(vol_shape + (n_vols,), dtype=np.float32)
+            if results:
+                out[mask] = np.concatenate(
+                    [r[i] for r in results]).reshape(-1, n_vols)
+            if n_vols == 1:
+                out = out[..., 0]
+            save_nifti(nib.Nifti1Image(out, img.affine),
+                       self._gen_filename(name))
+        return runtime
+
+    def _list_outputs(self):
+        outputs = self._outputs().get()
+        for name in ('tensor', 'fa', 'adc'):
+            outputs[name] = self._gen_filename(name)
+        return outputs
+
+    def _gen_filename(self, name):
+        return os.path.abspath(name + '.nii.gz')
@@ -13,10 +13,10 @@ from nipype.interfaces.base import isdefined
 import nibabel as nib
 import numpy as np
 import ast
-import subprocess as sp
-import scipy
 from random import shuffle
 import shutil
+from nianalysis.temporal_filtering import bptf_highpass
+from nianalysis.output_policy import save_nifti, nifti_ext, COMPRESS_DESC
 
 
 warn = warnings.warn
@@ -117,6 +117,11 @@ class SignalRegressionInputSpec(BaseInterfaceInputSpec):
         desc='Whether or not to high pass the motion parameters', default=None)
     customRegressors = File(exists=True, default=None,
                             desc='File containing custom regressors.')
+    chunk_size = traits.Int(
+        100000, usedefault=True,
+        desc=('Number of voxels to regress at a time. Lower to reduce the '
+              'size of the temporary arrays.'))
+    compress = traits.Bool(True, usedefault=True, desc=COMPRESS_DESC)
 
 
 class SignalRegressionOutputSpec(TraitedSpec):
@@ -132,14 +137,15 @@ class SignalRegression(BaseInterface):
     def _run_interface(self, runtime):
 
         im2filt = self.inputs.fix_dir+'/filtered_func_data.nii.gz'
-        ref = nib.load(im2filt)
         components = []
         with open(self.inputs.labelled_components, 'r') as f:
             for line in f:
                 components.append(line)
         bad_components = ast.literal_eval(components[-1].strip())
         bad_components = [x-1 for x in bad_components]
-        im2filt = nib.load(im2filt)
+        # Kept open so that reading the volumes one at a time (in file
+        # order) only decompresses the image once
+        im2filt = nib.load(im2filt, keep_file_open=True)
         if self.inputs.highpass:
             hdr = im2filt.header
             sa = hdr.structarr
@@ -147,19 +153,19 @@ class SignalRegression(BaseInterface):
             print('Repetition time from the header: {} sec'.format(str(TR)))
         else:
             TR = None
-        im2filt = im2filt.get_data()
         [x, y, z, t] = im2filt.shape
-        im2filt = np.reshape(im2filt, (x*y*z, t), order='F').T
+        # The confound and ICA matrices are only t x n, so all the
+        # projections are factored once here (in float64) and then applied
+        # to the image a chunk of voxels at a time in float32.
+        nuisance_bases = []
         ICA = self.normalise(np.loadtxt(self.inputs.fix_dir+'/melodic_mix'))
         if self.inputs.motion_regression:
             mp = self.inputs.fix_dir+'/mc/prefiltered_func_data_mcf.par'
             motion_confounds = self.create_motion_confounds(
                 mp, self.inputs.highpass, TR=TR)
-            ICA = ICA - (np.dot(motion_confounds,
-                                np.dot(np.linalg.pinv(motion_confounds), ICA)))
-            im2filt = (im2filt-np.dot(
-                motion_confounds, np.dot(np.linalg.pinv(motion_confounds),
-                                         im2filt)))
+            motion_basis = self.orthonormal_basis(motion_confounds)
+            ICA = ICA - np.dot(motion_basis, np.dot(motion_basis.T, ICA))
+            nuisance_bases.append(motion_basis)
         if self.inputs.customRegressors:
             cr = np.loadtxt(self.inputs.customRegressors)
             if cr.shape[0] != t:
@@ -167,20 +173,44 @@ class SignalRegression(BaseInterface):
                     'custom regressors and input image have a different '
                     'time lenght. They will not be used for the regression.')
             else:
-                cr = self.normalise(cr)
-                im2filt = im2filt - np.dot(cr, np.dot(np.linalg.pinv(cr),
-                                                      im2filt))
-
-        betaICA = np.dot(np.linalg.pinv(ICA), im2filt)
-        im2filt = im2filt - np.dot(ICA[:, bad_components],
-                                   betaICA[bad_components, :])
-        im_filt = np.reshape(im2filt.T, (x, y, z, t), order='F')
-        im2save = nib.Nifti1Image(im_filt, affine=ref.get_affine())
-        nib.save(
-            im2save, self.inputs.fix_dir+'/filtered_func_data_clean.nii.gz')
+                nuisance_bases.append(
+                    self.orthonormal_basis(self.normalise(cr)))
+        nuisance_bases = [b.astype(np.float32) for b in nuisance_bases]
+        bad_ICA = ICA[:, bad_components].astype(np.float32)
+        bad_betas = np.linalg.pinv(ICA)[bad_components, :].astype(np.float32)
+
+        # The image is read into a time x voxels buffer a volume at a time,
+        # then regressed in place a chunk of voxels at a time
+        n_voxels = x * y * z
+        im_filt = np.empty((t, n_voxels), dtype=np.float32)
+        for i in range(t):
+            im_filt[i] = np.ravel(im2filt.dataobj[..., i], order='F')
+        for v0 in range(0, n_voxels, self.inputs.chunk_size):
+            chunk = im_filt[:, v0:v0 + self.inputs.chunk_size]
+            for basis in nuisance_bases:
+                chunk -= np.dot(basis, np.dot(basis.T, chunk))
+            chunk -= np.dot(bad_ICA, np.dot(bad_betas, chunk))
+        # The transpose of the buffer is in Fortran order so it can be
+        # reshaped to the image dimensions without copying
+        im2save = nib.Nifti1Image(
+            np.reshape(im_filt.T, (x, y, z, t), order='F'),
+            affine=im2filt.affine)
+        # Saved in the working directory rather than the FIX directory, as
+        # the files in the latter may be linked to the pipeline inputs
+        save_nifti(im2save, self._gen_filename('output'))
 
         return runtime
 
+    def orthonormal_basis(self, regressors):
+        """
+        Returns an orthonormal basis for the column space of the regressors,
+        so that np.dot(b, b.T) equals np.dot(r, np.linalg.pinv(r)) (using
+        the same singular value cut-off as np.linalg.pinv)
+        """
+        u, s, _ = np.linalg.svd(regressors, full_matrices=False)
+        cutoff = 1e-15 * np.max(s)
+        return u[:, s > cutoff]
+
     def create_motion_confounds(self, mp, hp, TR=None):
 
         confounds = np.loadtxt(mp)
@@ -190,23 +220,11 @@ class SignalRegression(BaseInterface):
         confounds = self.normalise(
             np.hstack((confounds, np.square(confounds))))
         if hp == 0:
-            confounds = scipy.signal.detrend(confounds, axis=0, type='linear')
+            from scipy.signal import detrend
+            confounds = detrend(confounds, axis=0, type='linear')
         elif hp > 0:
-            im2save = nib.Nifti1Image(
-                np.reshape(confounds.T, (confounds.shape[1], 1, 1,
-                                         confounds.shape[0]), order='F'),
-                affine=np.eye(4))
-            nib.save(im2save, self.inputs.fix_dir+'/mc/mc_par_conf.nii.gz')
-            cmd = (
-                'fslmaths {0}/mc_par_conf.nii.gz -bptf {1} -1 '
-                '{0}/mc_par_conf_hp'.format(self.inputs.fix_dir+'/mc',
-                                            str(0.5*float(hp)/TR)))
-            sp.check_output(cmd, shell=True)
-            confounds_hp = (nib.load(
-                self.inputs.fix_dir+'/mc/mc_par_conf_hp.nii.gz')).get_data()
             confounds = self.normalise(
-                np.reshape(confounds_hp, (confounds.shape[1],
-                                          confounds.shape[0]), order='F').T)
+                bptf_highpass(confounds, 0.5 * float(hp) / TR))
 
         return confounds
 
@@ -219,10 +237,18 @@ class SignalRegression(BaseInterface):
     def _list_outputs(self):
 
         outputs = self._outputs().get()
-        outputs['output'] = (
-            self.inputs.fix_dir+'/filtered_func_data_clean.nii.gz')
+        outputs['output'] = self._gen_filename('output')
         return outputs
 
+    def _gen_filename(self, name):
+        if name == 'output':
+            fname = os.path.join(
+                os.getcwd(), 'filtered_func_data_clean' +
+                nifti_ext(self.inputs.compress))
+        else:
+            assert False
+        return fname
+
 
 class FSLFIXInputSpec(FSLCommandInputSpec):
     _xor_parameters = ('classification', 'regression', 'all')
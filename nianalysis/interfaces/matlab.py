@@ -0,0 +1,246 @@
+"""
+Runs the MATLAB scripts of the nianalysis interfaces in a pool of warm
+MATLAB sessions (via the MATLAB Engine API for Python), so that MATLAB's
+start-up and the scan of the toolbox paths are only paid once per session
+instead of once per node.
+
+The pool is held by the process the nodes are run in, so sessions are
+only reused between nodes run in the same process, i.e. by the
+LinearRunner, which runs every node in the main process. The multi-process
+and cluster runners run each node in a worker process or job of its own,
+where a session would be started for a single script, so the pool is
+disabled by default. It is enabled by setting the
+NIANALYSIS_MATLAB_POOL_SIZE environment variable to the number of sessions
+to keep per process. Only one is needed with the LinearRunner, as more are
+only used by scripts submitted concurrently from different threads.
+
+If the MATLAB engine is not installed, or a session cannot be started or
+dies, the scripts are transparently run with a one-shot `MatlabCommand`
+instead.
+"""
+import os.path
+import io
+import atexit
+import logging
+import threading
+from nipype.interfaces.matlab import MatlabCommand
+
+logger = logging.getLogger('nianalysis')
+
+POOL_SIZE_ENV = 'NIANALYSIS_MATLAB_POOL_SIZE'
+
+QSM_MATLAB_DIR = os.path.abspath(os.path.join(
+    os.path.dirname(__file__), 'resources', 'matlab', 'qsm'))
+
+NODDI_MATLAB_DIR = os.path.abspath(os.path.join(
+    os.path.dirname(__file__), 'resources', 'matlab', 'noddi'))
+
+SCRIPT_FNAME = 'pyscript.m'
+
+
+class MatlabSessionError(Exception):
+    """
+    Raised when a MATLAB session cannot be started or has stopped
+    responding, in which case the script is run with `MatlabCommand` instead
+    """
+
+
+class MatlabSession(object):
+    """
+    A warm MATLAB session, which keeps track of the paths that have been
+    added to it so they are only added (and scanned) once
+    """
+
+    def __init__(self):
+        try:
+            import matlab.engine
+        except ImportError as e:
+            raise MatlabSessionError(
+                "MATLAB engine for Python is not installed ({})".format(e))
+        self._engine_module = matlab.engine
+        try:
+            self.engine = matlab.engine.start_matlab('-nodesktop -nosplash')
+        except matlab.engine.EngineError as e:
+            raise MatlabSessionError(
+                "Could not start MATLAB session ({})".format(e))
+        self.paths = set()
+
+    def add_paths(self, paths):
+        for path in paths:
+            if path not in self.paths:
+                self.engine.addpath(self.engine.genpath(path), nargout=0)
+                self.paths.add(path)
+
+    def run(self, script, paths=(), cwd=None):
+        """
+        Runs the script in the session from the given working directory and
+        returns its stdout and stderr. The script is written to an m-file
+        (as `MatlabCommand` does with mfile=True) and the variables it
+        creates are cleared afterwards.
+        """
+        if cwd is None:
+            cwd = os.getcwd()
+        script_path = os.path.join(cwd, SCRIPT_FNAME)
+        with open(script_path, 'w') as f:
+            f.write(script)
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        try:
+            self.add_paths(paths)
+            self.engine.cd(cwd, nargout=0)
+            try:
+                self.engine.run(script_path, nargout=0, stdout=stdout,
+                                stderr=stderr)
+            finally:
+                self.engine.eval('clear variables; close all force;',
+                                 nargout=0)
+        except self._engine_module.MatlabExecutionError as e:
+            raise RuntimeError(
+                "MATLAB script '{}' failed:\n{}\n{}".format(
+                    script_path, stderr.getvalue(), e))
+        except (self._engine_module.EngineError,
+                self._engine_module.RejectedExecutionError) as e:
+            raise MatlabSessionError(
+                "MATLAB session stopped responding ({})".format(e))
+        return stdout.getvalue(), stderr.getvalue()
+
+    def quit(self):
+        try:
+            self.engine.quit()
+        except Exception:
+            pass
+
+
+class MatlabSessionPool(object):
+    """
+    A thread-safe pool of up to 'size' warm MATLAB sessions, which are
+    started on demand and reused between scripts
+
+    Parameters
+    ----------
+    size : int
+        The maximum number of sessions to keep
+    session_cls : type
+        The class used to start new sessions
+    """
+
+    def __init__(self, size=1, session_cls=MatlabSession):
+        self.size = size
+        self.session_cls = session_cls
+        self._idle = []
+        self._num_sessions = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while not self._idle and self._num_sessions >= self.size:
+                self._condition.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._num_sessions += 1
+        try:
+            return self.session_cls()
+        except Exception:
+            with self._condition:
+                self._num_sessions -= 1
+                self._condition.notify()
+            raise
+
+    def release(self, session, discard=False):
+        with self._condition:
+            if discard:
+                self._num_sessions -= 1
+            else:
+                self._idle.append(session)
+            self._condition.notify()
+        if discard:
+            session.quit()
+
+    def run(self, script, paths=(), cwd=None):
+        session = self.acquire()
+        try:
+            output = session.run(script, paths=paths, cwd=cwd)
+        except MatlabSessionError:
+            self.release(session, discard=True)
+            raise
+        except Exception:
+            self.release(session)
+            raise
+        self.release(session)
+        return output
+
+    def close(self):
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._num_sessions -= len(idle)
+        for session in idle:
+            session.quit()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_pool_disabled = False
+
+
+def session_pool():
+    """
+    Returns the MATLAB session pool of the current process, or None if the
+    pool is disabled (the default, see the module docstring) or MATLAB
+    sessions cannot be started in it
+    """
+    global _pool
+    if _pool_disabled:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            size = int(os.environ.get(POOL_SIZE_ENV, 0))
+            if size < 1:
+                return None
+            _pool = MatlabSessionPool(size)
+            atexit.register(_pool.close)
+    return _pool
+
+
+def run_matlab_script(script, runtime, paths=()):
+    """
+    Runs a MATLAB script body in a warm session of the session pool, falling
+    back to a one-shot `MatlabCommand` if the pool is unavailable
+
+    Parameters
+    ----------
+    script : str
+        The body of the script to run. It should not call 'exit' as that
+        would close the session it is run in.
+    runtime : nipype Bunch
+        The runtime object passed to `_run_interface`
+    paths : list(str)
+        Directories that are added (along with their sub-directories) to the
+        MATLAB path before the script is run
+
+    Returns
+    -------
+    runtime : nipype Bunch
+        The runtime object to return from `_run_interface`
+    """
+    global _pool_disabled
+    pool = session_pool()
+    if pool is not None:
+        try:
+            stdout, stderr = pool.run(script, paths=paths,
+                                      cwd=os.getcwd())
+        except MatlabSessionError as e:
+            logger.warning(
+                "Falling back to one-shot MATLAB processes as a MATLAB "
+                "session could not be used: {}".format(e))
+            # Don't attempt to start sessions in this process again
+            _pool_disabled = True
+        else:
+            runtime.stdout = stdout
+            runtime.stderr = stderr
+            runtime.returncode = 0
+            return runtime
+    script = ''.join("addpath(genpath('{}'));\n".format(p)
+                     for p in paths) + script
+    mlab = MatlabCommand(script=script, mfile=True)
+    result = mlab.run()
+    return result.runtime
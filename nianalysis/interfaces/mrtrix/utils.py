@@ -5,6 +5,7 @@ from nipype.interfaces.base import (
 from nipype.interfaces.mrtrix3.reconst import (
     MRTrix3Base, MRTrix3BaseInputSpec)
 from arcana.utils import split_extension
+from nianalysis.conversion_cache import CachedConversionMixin
 
 
 # =============================================================================
@@ -88,11 +89,25 @@ class MRConvertOutputSpec(TraitedSpec):
     out_file = File(exists=True, desc='Extracted encoding gradients')
 
 
-class MRConvert(MRTrix3Base):
+class MRConvert(CachedConversionMixin, MRTrix3Base):
+    """
+    Conversions of DICOM series are looked up in (and saved to) the
+    conversion cache if it is enabled (see nianalysis.conversion_cache)
+    """
 
     _cmd = 'mrconvert'
     input_spec = MRConvertInputSpec
     output_spec = MRConvertOutputSpec
+    cache_ignore = ('out_file', 'out_ext', 'quiet', 'nthreads')
+
+    def _cache_options(self):
+        options = super(MRConvert, self)._cache_options()
+        # The cached files are linked under their original names
+        options['out_fname'] = os.path.basename(self._gen_outfilename())
+        return options
+
+    def _cache_output_dir(self):
+        return os.path.dirname(self._gen_outfilename())
 
     def _list_outputs(self):
         outputs = self.output_spec().get()
@@ -1,10 +1,11 @@
 import os.path
+from glob import glob
 from nipype.interfaces.base import (
     BaseInterface, File, TraitedSpec, traits, isdefined,
     BaseInterfaceInputSpec)
-from nipype.interfaces.matlab import MatlabCommand
 from arcana.exception import ArcanaError
 from arcana.utils import split_extension
+from nianalysis.interfaces.matlab import run_matlab_script, NODDI_MATLAB_DIR
 
 
 class CreateROIInputSpec(BaseInterfaceInputSpec):
@@ -36,9 +37,7 @@ class CreateROI(BaseInterface):
         script = "CreateROI('{}', '{}', '{}');".format(
             self.inputs.in_file, self.inputs.brain_mask,
             self._gen_outfilename())
-        mlab = MatlabCommand(script=script, mfile=True)
-        result = mlab.run()
-        return result.runtime
+        return run_matlab_script(script, runtime)
 
     def _list_outputs(self):
         outputs = self._outputs().get()
@@ -103,17 +102,19 @@ class BatchNODDIFitting(BaseInterface):
     output_spec = BatchNODDIFittingOutputSpec
 
     def _run_interface(self, runtime):  # @UnusedVariable
-        script = """
+        if self.inputs.nthreads > 1:
+            fit_call = "batch_fitting('{roi}', protocol, noddi, '{out_file}', {nthreads});"  # @IgnorePep8
+        else:
+            # Avoid the overhead of starting a parallel pool for one worker
+            fit_call = "batch_fitting_single('{roi}', protocol, noddi, '{out_file}');"  # @IgnorePep8
+        script = ("""
         protocol = FSL2Protocol('{bvals}', '{bvecs}');
         noddi = MakeModel('{model}');
-        batch_fitting('{roi}', protocol, noddi, '{out_file}', {nthreads});
-        """.format(
+        """ + fit_call).format(
             bvecs=self.inputs.bvecs_file, bvals=self.inputs.bvals_file,
             model=self.inputs.model, roi=self.inputs.roi_file,
             out_file=self._gen_outfilename(), nthreads=self.inputs.nthreads)
-        mlab = MatlabCommand(script=script, mfile=True)
-        result = mlab.run()
-        return result.runtime
+        return run_matlab_script(script, runtime)
 
     def _list_outputs(self):
         outputs = self._outputs().get()
@@ -137,6 +138,97 @@ class BatchNODDIFitting(BaseInterface):
         return out_name
 
 
+class SplitROIInputSpec(BaseInterfaceInputSpec):
+
+    roi_file = File(
+        exists=True, mandatory=True, desc="The ROI file created by CreateROI")
+
+    chunk_size = traits.Int(  # @UndefinedVariable
+        5000, mandatory=False, usedefault=True,
+        desc="The maximum number of voxels in each chunk")
+
+
+class SplitROIOutputSpec(TraitedSpec):
+
+    out_files = traits.List(  # @UndefinedVariable
+        File(exists=True),
+        desc="The ROI chunks, in the order the voxels appear in the ROI")
+
+
+class SplitROI(BaseInterface):
+    """
+    Splits a ROI into chunks of voxels that can be fitted independently by
+    BatchNODDIFitting (e.g. in a map node) and merged with MergeFittedParams
+    """
+
+    input_spec = SplitROIInputSpec
+    output_spec = SplitROIOutputSpec
+
+    def _run_interface(self, runtime):  # @UnusedVariable
+        script = "SplitROI('{roi}', {chunk_size}, '{prefix}');".format(
+            roi=self.inputs.roi_file, chunk_size=self.inputs.chunk_size,
+            prefix=self._out_prefix())
+        return run_matlab_script(script, runtime, paths=[NODDI_MATLAB_DIR])
+
+    def _list_outputs(self):
+        outputs = self._outputs().get()
+        outputs['out_files'] = sorted(glob(self._out_prefix() + '_*.mat'))
+        return outputs
+
+    def _out_prefix(self):
+        base, _ = split_extension(os.path.basename(self.inputs.roi_file))
+        return os.path.join(os.getcwd(), "{}_chunk".format(base))
+
+
+class MergeFittedParamsInputSpec(BaseInterfaceInputSpec):
+
+    in_files = traits.List(  # @UndefinedVariable
+        File(exists=True), mandatory=True,
+        desc=("The parameters fitted by BatchNODDIFitting for each chunk "
+              "created by SplitROI, in the same order"))
+
+    out_file = traits.File(  # @UndefinedVariable
+        genfile=True, hash_files=False,
+        desc="The name of the merged parameters file to be generated")
+
+
+class MergeFittedParamsOutputSpec(TraitedSpec):
+
+    out_file = File(exists=True, desc="The merged fitted parameters")
+
+
+class MergeFittedParams(BaseInterface):
+
+    input_spec = MergeFittedParamsInputSpec
+    output_spec = MergeFittedParamsOutputSpec
+
+    def _run_interface(self, runtime):  # @UnusedVariable
+        script = "MergeFittedParams({{{in_files}}}, '{out_file}');".format(
+            in_files=', '.join("'{}'".format(f)
+                               for f in self.inputs.in_files),
+            out_file=self._gen_outfilename())
+        return run_matlab_script(script, runtime, paths=[NODDI_MATLAB_DIR])
+
+    def _list_outputs(self):
+        outputs = self._outputs().get()
+        outputs['out_file'] = self._gen_outfilename()
+        return outputs
+
+    def _gen_filename(self, name):
+        if name == 'out_file':
+            gen_name = self._gen_outfilename()
+        else:
+            assert False
+        return gen_name
+
+    def _gen_outfilename(self):
+        if isdefined(self.inputs.out_file):
+            out_name = self.inputs.out_file
+        else:
+            out_name = os.path.join(os.getcwd(), "fitted_params.mat")
+        return out_name
+
+
 class SaveParamsAsNIfTIInputSpec(BaseInterfaceInputSpec):
 
     params_file = File(
@@ -194,9 +286,7 @@ class SaveParamsAsNIfTI(BaseInterface):
             params=self.inputs.params_file, roi=self.inputs.roi_file,
             brain_mask=self.inputs.brain_mask_file,
             prefix=self.inputs.output_prefix)
-        mlab = MatlabCommand(script=script, mfile=True)
-        result = mlab.run()
-        return result.runtime
+        return run_matlab_script(script, runtime)
 
     def _list_outputs(self):
         outputs = self._outputs().get()
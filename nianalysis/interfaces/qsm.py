@@ -1,5 +1,4 @@
-from nipype.interfaces.matlab import MatlabCommand
-import nianalysis.interfaces
+from nianalysis.interfaces.matlab import run_matlab_script, QSM_MATLAB_DIR
 from nipype.interfaces.base import (
     TraitedSpec, traits, BaseInterface, BaseInterfaceInputSpec, File, Directory)
 import os
@@ -23,22 +22,15 @@ class Prepare(BaseInterface):
         self.working_dir = os.path.abspath(os.getcwd())
         script = (
             "set_param(0,'CharacterEncoding','UTF-8');\n"
-            "addpath(genpath('{matlab_dir}'));\n"
-            "Prepare_Raw_Channels('{in_dir}', '{filename}', {echo_times}, {num_channels}, '{out_dir}', '{out_file_fe}', '{out_file_le}');\n"
-            "exit;\n").format(
+            "Prepare_Raw_Channels('{in_dir}', '{filename}', {echo_times}, {num_channels}, '{out_dir}', '{out_file_fe}', '{out_file_le}');\n").format(
                 in_dir=self.inputs.in_dir,
                 filename=self.inputs.base_filename,
                 out_dir=self._gen_filename('out_dir'),
                 out_file_fe=self._gen_filename('out_file_fe'),
                 out_file_le=self._gen_filename('out_file_le'),
                 echo_times=self.inputs.echo_times,
-                num_channels=self.inputs.num_channels,
-                matlab_dir=os.path.abspath(os.path.join(
-                    os.path.dirname(nianalysis.interfaces.__file__),
-                    'resources', 'matlab', 'qsm')))
-        mlab = MatlabCommand(script=script, mfile=True)
-        result = mlab.run()
-        return result.runtime
+                num_channels=self.inputs.num_channels)
+        return run_matlab_script(script, runtime, paths=[QSM_MATLAB_DIR])
     
     def _list_outputs(self):
         outputs = self._outputs().get()
@@ -80,18 +72,11 @@ class FillHoles(BaseInterface):
         self.working_dir = os.path.abspath(os.getcwd())
         script = (
             "set_param(0,'CharacterEncoding','UTF-8');\n"
-            "addpath(genpath('{matlab_dir}'));\n"
-            "fillholes('{in_file}', '{out_file}');\n"
-            "exit;\n").format(
+            "fillholes('{in_file}', '{out_file}');\n").format(
                 in_file=self.inputs.in_file,
                 out_file=os.path.join(os.getcwd(),
-                                         self._gen_filename('out_file')),
-                matlab_dir=os.path.abspath(os.path.join(
-                    os.path.dirname(nianalysis.interfaces.__file__),
-                    'resources', 'matlab', 'qsm')))
-        mlab = MatlabCommand(script=script, mfile=True)
-        result = mlab.run()
-        return result.runtime
+                                         self._gen_filename('out_file')))
+        return run_matlab_script(script, runtime, paths=[QSM_MATLAB_DIR])
 
     def _list_outputs(self):
         outputs = self._outputs().get()
@@ -121,19 +106,12 @@ class FitMask(BaseInterface):
         self.working_dir = os.path.abspath(os.getcwd())
         script = (
             "set_param(0,'CharacterEncoding','UTF-8');\n"
-            "addpath(genpath('{matlab_dir}'));\n"
-            "FitMask('{in_file}', '{initial_mask_file}', '{out_file}');\n"
-            "exit;\n").format(
+            "FitMask('{in_file}', '{initial_mask_file}', '{out_file}');\n").format(
                 in_file=self.inputs.in_file,
                 initial_mask_file=self.inputs.initial_mask_file,
                 out_file=os.path.join(os.getcwd(),
-                                         self._gen_filename('out_file')),
-                matlab_dir=os.path.abspath(os.path.join(
-                    os.path.dirname(nianalysis.interfaces.__file__),
-                    'resources', 'matlab', 'qsm')))
-        mlab = MatlabCommand(script=script, mfile=True)
-        result = mlab.run()
-        return result.runtime
+                                         self._gen_filename('out_file')))
+        return run_matlab_script(script, runtime, paths=[QSM_MATLAB_DIR])
 
     def _list_outputs(self):
         outputs = self._outputs().get()
@@ -209,20 +187,13 @@ class STI(BaseInterface):
         self.working_dir = os.path.abspath(os.getcwd())
         script = (
             "set_param(0,'CharacterEncoding','UTF-8');\n"
-            "addpath(genpath('{matlab_dir}'));\n"
-            "QSM('{in_dir}', '{mask_file}', '{out_dir}', {echo_times}, {num_channels});\n"
-            "exit;").format(
+            "QSM('{in_dir}', '{mask_file}', '{out_dir}', {echo_times}, {num_channels});\n").format(
                 in_dir=self.inputs.in_dir,
                 mask_file=self.inputs.mask_file,
                 out_dir=self.working_dir,
                 echo_times=self.inputs.echo_times,
-                num_channels=self.inputs.num_channels,
-                matlab_dir=os.path.abspath(os.path.join(
-                    os.path.dirname(nianalysis.interfaces.__file__),
-                    'resources', 'matlab', 'qsm')))
-        mlab = MatlabCommand(script=script, mfile=True)
-        result = mlab.run()
-        return result.runtime
+                num_channels=self.inputs.num_channels)
+        return run_matlab_script(script, runtime, paths=[QSM_MATLAB_DIR])
 
     def _list_outputs(self):
         outputs = self._outputs().get()
@@ -245,18 +216,11 @@ class STI_SE(BaseInterface):
         self.working_dir = os.path.abspath(os.getcwd())
         script = (
             "set_param(0,'CharacterEncoding','UTF-8');\n"
-            "addpath(genpath('{matlab_dir}'));\n"
-            "QSM_SingleEcho('{in_dir}', '{mask_file}', '{out_dir}');\n"
-            "exit;").format(
+            "QSM_SingleEcho('{in_dir}', '{mask_file}', '{out_dir}');\n").format(
                 in_dir=self.inputs.in_dir,
                 mask_file=self.inputs.mask_file,
-                out_dir=self.working_dir,
-                matlab_dir=os.path.abspath(os.path.join(
-                    os.path.dirname(nianalysis.interfaces.__file__),
-                    'resources', 'matlab', 'qsm')))
-        mlab = MatlabCommand(script=script, mfile=True)
-        result = mlab.run()
-        return result.runtime
+                out_dir=self.working_dir)
+        return run_matlab_script(script, runtime, paths=[QSM_MATLAB_DIR])
 
     def _list_outputs(self):
         outputs = self._outputs().get()
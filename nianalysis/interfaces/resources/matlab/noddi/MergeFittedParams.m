@@ -0,0 +1,19 @@
+function MergeFittedParams(chunkFiles, outputFile)
+% Merges the parameters fitted by batch_fitting for the consecutive chunks
+% of a ROI created by SplitROI into a single file, in the same format as if
+% the whole ROI had been fitted at once. The per-voxel (numeric) variables
+% are concatenated and the remaining ones (e.g. the model) are taken from
+% the first chunk
+
+merged = load(chunkFiles{1});
+names = fieldnames(merged);
+for i = 2:numel(chunkFiles)
+    chunk = load(chunkFiles{i});
+    for j = 1:numel(names)
+        name = names{j};
+        if isnumeric(merged.(name)) || islogical(merged.(name))
+            merged.(name) = cat(1, merged.(name), chunk.(name));
+        end
+    end
+end
+save(outputFile, '-struct', 'merged');
@@ -0,0 +1,18 @@
+function SplitROI(roiFile, chunkSize, outputPrefix)
+% Splits a ROI created by CreateROI into consecutive chunks of at most
+% chunkSize voxels, which are saved to '<outputPrefix>_0001.mat',
+% '<outputPrefix>_0002.mat', etc. so they can be fitted independently with
+% batch_fitting and the fitted parameters merged with MergeFittedParams
+
+roiData = load(roiFile);
+numVoxels = size(roiData.roi, 1);
+numChunks = max(1, ceil(numVoxels / chunkSize));
+for i = 1:numChunks
+    voxels = ((i - 1) * chunkSize + 1):min(i * chunkSize, numVoxels);
+    chunk = roiData;
+    chunk.roi = roiData.roi(voxels, :);
+    if isfield(roiData, 'idx')
+        chunk.idx = roiData.idx(voxels);
+    end
+    save(sprintf('%s_%04d.mat', outputPrefix, i), '-struct', 'chunk');
+end
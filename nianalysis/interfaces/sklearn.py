@@ -1,11 +1,20 @@
 
+from contextlib import contextmanager
 from nipype.interfaces.base import (BaseInterface, BaseInterfaceInputSpec,
-                                    traits, File, TraitedSpec)
+                                    traits, File, TraitedSpec, isdefined)
 import nibabel as nib
 import numpy as np
-from sklearn.decomposition import FastICA as fICA
+from nianalysis.output_policy import save_nifti, nifti_ext, COMPRESS_DESC
 from nipype.utils.filemanip import split_filename
 import os
+import logging
+
+logger = logging.getLogger('nianalysis')
+
+
+@contextmanager
+def nullcontext():
+    yield
 
 
 class FastICAInputSpec(BaseInterfaceInputSpec):
@@ -16,6 +25,21 @@ class FastICAInputSpec(BaseInterfaceInputSpec):
                               mandatory=True)
     ica_type = traits.Str(desc='Type of ICA to run. Possible types are '
                           'spatial (default) and temporal.', default='spatial')
+    mask = File(exists=True, desc=('Mask restricting the voxels included in '
+                                   'the decomposition'))
+    n_pca_components = traits.Int(
+        desc=('Number of principal components to reduce the data to (with '
+              'randomised PCA) before running the ICA. Must be greater than '
+              'or equal to n_components.'))
+    use_float32 = traits.Bool(
+        False, usedefault=True,
+        desc=('Run the decomposition in single rather than double precision '
+              '(halves the memory used, but changes the results slightly)'))
+    random_state = traits.Int(
+        desc='Seed of the random initialisation of the decomposition')
+    n_threads = traits.Int(
+        desc='Number of BLAS/OpenMP threads used for the decomposition')
+    compress = traits.Bool(True, usedefault=True, desc=COMPRESS_DESC)
 
 
 class FastICAOutputSpec(TraitedSpec):
@@ -33,13 +57,23 @@ class FastICA(BaseInterface):
     output_spec = FastICAOutputSpec
 
     def _run_interface(self, runtime):
+        from sklearn.decomposition import FastICA as fICA, PCA
         fname = self.inputs.volume
         img = nib.load(fname)
         comp = self.inputs.n_components
-        data = np.array(img.get_data())
-
-        n_voxels = data.shape[0]*data.shape[1]*data.shape[2]
-        ts = data.reshape(n_voxels, data.shape[3])
+        dtype = np.float32 if self.inputs.use_float32 else np.float64
+        data = np.asanyarray(img.dataobj).astype(dtype, copy=False)
+        vol_shape = data.shape[:3]
+        n_times = data.shape[3]
+
+        if isdefined(self.inputs.mask):
+            mask = np.asanyarray(nib.load(self.inputs.mask).dataobj) > 0
+            ts = data[mask]
+        else:
+            mask = None
+            ts = data.reshape(-1, n_times)
+        del data
+        n_voxels = ts.shape[0]
         _, base, _ = split_filename(fname)
 
         if self.inputs.ica_type == 'spatial':
@@ -49,58 +83,86 @@ class FastICA(BaseInterface):
             ica_input = ts
             outname = 'tICA'
 
-        # Run ICA
-        ica = fICA(n_components=comp)
-        ica.fit(ica_input)
-        S_ = ica.fit_transform(ica_input)
+        # Run ICA (fitting the model only once), optionally on a reduced
+        # set of principal components that are projected back afterwards
+        with self._thread_limit():
+            if isdefined(self.inputs.n_pca_components):
+                pca = PCA(n_components=self.inputs.n_pca_components,
+                          svd_solver='randomized')
+                reduced = pca.fit_transform(ica_input)
+            else:
+                pca = None
+                reduced = ica_input
+            if isdefined(self.inputs.random_state):
+                ica = fICA(n_components=comp,
+                           random_state=self.inputs.random_state)
+            else:
+                ica = fICA(n_components=comp)
+            S_ = ica.fit_transform(reduced)
+            unmixing = ica.components_
+            if pca is not None:
+                unmixing = np.dot(unmixing, pca.components_)
         if self.inputs.ica_type == 'spatial':
-            sm = ica.components_.T[:]
-            tc = S_[:]
+            sm = unmixing.T
+            tc = S_
         else:
-            sm = S_[:]
-            tc = ica.components_.T[:]
-
-        ica_zscore = np.zeros((data.shape[0], data.shape[1],
-                               data.shape[2], self.inputs.n_components))
-        ica_tc = np.zeros((data.shape[3], self.inputs.n_components))
-        for i in range(self.inputs.n_components):
-            dt = sm[:, i]-np.mean(sm[:, i])
-            num = np.mean(dt**3)
-            denom = (np.mean(dt**2))**1.5
-            s = num / denom
-            print(s)
-            if np.sign(s) == -1:
-                print('Flipping sign of component {}'.format(str(i)))
-                sm[:, i] = -1*sm[:, i]
-                tc[:, i] = -1*tc[:, i]
-
-            pc = sm[:, i].reshape(
-                data.shape[0], data.shape[1], data.shape[2])
-
-            vstd = np.linalg.norm(sm[:, i])/np.sqrt(n_voxels-1)
-            if vstd != 0:
-                pc_zscore = pc/vstd
-            else:
-                print ('Not converting to z-scores as division by zero'
-                       ' warning may occur.')
-                pc_zscore = pc
-            ica_zscore[:, :, :, i] = pc_zscore
-            ica_tc[:, i] = tc[:, i]
-
+            sm = S_
+            tc = unmixing.T
+
+        # Flip the components with negative skew so that they are
+        # positively skewed, then convert the spatial maps to z-scores
+        dt = sm - np.mean(sm, axis=0)
+        skew = np.mean(dt ** 3, axis=0) / np.mean(dt ** 2, axis=0) ** 1.5
+        print(skew)
+        flip = np.sign(skew) == -1
+        for i in np.nonzero(flip)[0]:
+            print('Flipping sign of component {}'.format(str(i)))
+        sm[:, flip] *= -1
+        tc[:, flip] *= -1
+        vstd = np.linalg.norm(sm, axis=0) / np.sqrt(n_voxels - 1)
+        if np.any(vstd == 0):
+            print ('Not converting to z-scores components with zero '
+                   'variance as division by zero warning may occur.')
+        sm_zscore = sm / np.where(vstd != 0, vstd, 1)
+
+        if mask is not None:
+            ica_zscore = np.zeros(vol_shape + (comp,), dtype=sm_zscore.dtype)
+            ica_zscore[mask] = sm_zscore
+        else:
+            ica_zscore = sm_zscore.reshape(vol_shape + (comp,))
         im2save = nib.Nifti1Image(ica_zscore, affine=img.affine)
-        tc2save = nib.Nifti1Image(ica_tc, affine=np.eye(4))
-        nib.save(
-            im2save, '{0}_{1}_results_pc{2}_zscore.nii.gz'
-            .format(base, outname, str(self.inputs.n_components)))
-        nib.save(
-            tc2save, '{0}_{1}_timecourse_pc{2}.nii.gz'
-            .format(base, outname, str(self.inputs.n_components)))
+        tc2save = nib.Nifti1Image(
+            tc.reshape(n_times, comp).astype(dtype, copy=False),
+            affine=np.eye(4))
+        ext = nifti_ext(self.inputs.compress)
+        save_nifti(
+            im2save, '{0}_{1}_results_pc{2}_zscore{3}'
+            .format(base, outname, str(self.inputs.n_components), ext))
+        save_nifti(
+            tc2save, '{0}_{1}_timecourse_pc{2}{3}'
+            .format(base, outname, str(self.inputs.n_components), ext))
         np.savetxt(
             '{0}_{1}_mixing_matrix_pc{2}.txt'.format(
                 base, outname, str(self.inputs.n_components)), S_)
 
         return runtime
 
+    def _thread_limit(self):
+        """
+        Returns a context manager limiting the number of threads used by
+        the BLAS and OpenMP libraries to 'n_threads' (if provided)
+        """
+        if not isdefined(self.inputs.n_threads):
+            return nullcontext()
+        try:
+            from threadpoolctl import threadpool_limits
+        except ImportError:
+            logger.warning(
+                "threadpoolctl is not installed so 'n_threads' will be "
+                "ignored by FastICA")
+            return nullcontext()
+        return threadpool_limits(limits=self.inputs.n_threads)
+
     def _list_outputs(self):
         outputs = self._outputs().get()
         fname = self.inputs.volume
@@ -109,12 +171,13 @@ class FastICA(BaseInterface):
         else:
             outname = 'tICA'
         _, base, _ = split_filename(fname)
+        ext = nifti_ext(self.inputs.compress)
         outputs["ica_decomposition"] = os.path.abspath(
-            base+'_{0}_results_pc{1}_zscore.nii.gz'.format(
-                outname, str(self.inputs.n_components)))
+            base+'_{0}_results_pc{1}_zscore{2}'.format(
+                outname, str(self.inputs.n_components), ext))
         outputs["ica_timeseries"] = os.path.abspath(
-            base+'_{0}_timecourse_pc{1}.nii.gz'.format(
-                outname, str(self.inputs.n_components)))
+            base+'_{0}_timecourse_pc{1}{2}'.format(
+                outname, str(self.inputs.n_components), ext))
         outputs["mixing_mat"] = os.path.abspath(
             base+'_{0}_mixing_matrix_pc{1}.txt'.format(
                 outname, str(self.inputs.n_components)))
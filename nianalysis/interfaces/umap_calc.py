@@ -7,9 +7,10 @@ Created on 1 Sep. 2017
 
 import os.path
 from nipype.interfaces.base import (
-    TraitedSpec, BaseInterface, File, isdefined)
+    TraitedSpec, BaseInterface, File, isdefined, traits)
 import nibabel as nib
 import numpy as np
+from nianalysis.output_policy import save_nifti, nifti_ext, COMPRESS_DESC
 
 
 class CoreUmapCalcInputSpec(TraitedSpec):
@@ -23,6 +24,10 @@ class CoreUmapCalcInputSpec(TraitedSpec):
     sute_fix_template = File(
         genfile=True,
         desc='sute fixed map in template space')
+    chunk_slices = traits.Int(
+        16, usedefault=True,
+        desc='number of slices to process at a time')
+    compress = traits.Bool(True, usedefault=True, desc=COMPRESS_DESC)
 
 
 class CoreUmapCalcOutputSpec(TraitedSpec):
@@ -41,59 +46,96 @@ class CoreUmapCalc(BaseInterface):
     output_spec = CoreUmapCalcOutputSpec
 
     def _run_interface(self, runtime):
-        air = nib.load(self.inputs.air__mask)
-        bones = nib.load(self.inputs.bones__mask)
-        ute1 = nib.load(self.inputs.ute1_reg)
-        ute2 = nib.load(self.inputs.ute2_reg)
+        # The files are kept open between the slabs, as otherwise each slab
+        # of a gzipped image is read by decompressing it from the start
+        air = nib.load(self.inputs.air__mask, keep_file_open=True)
+        bones = nib.load(self.inputs.bones__mask, keep_file_open=True)
+        ute1 = nib.load(self.inputs.ute1_reg, keep_file_open=True)
+        ute2 = nib.load(self.inputs.ute2_reg, keep_file_open=True)
+
+        # Both umaps are calculated in a single pass over the images, a slab
+        # of slices at a time, reading each input once and working in place
+        shape = ute1.shape
+        umap = np.empty(shape, dtype=np.float32)
+        umap2 = np.empty(shape, dtype=np.float32)
+        slab = max(1, self.inputs.chunk_slices)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for z0 in range(0, shape[2], slab):
+                sl = (slice(None), slice(None), slice(z0, z0 + slab))
+                self._calc_umaps(
+                    self._load_slab(air, sl), self._load_slab(bones, sl),
+                    self._load_slab(ute1, sl), self._load_slab(ute2, sl),
+                    umap[sl], umap2[sl])
 
-        r2star_map = 1000. * (np.log(np.array(ute1.get_data())) 
-                              - np.log(np.array(ute2.get_data()))) / 2.39
-        nans = np.isnan(r2star_map)
-        r2star_map[nans] = 0
+        save_im = nib.Nifti1Image(umap, affine=ute1.affine)
+        save_nifti(save_im, self._gen_filename('sute_cont_template'))
+        save_im = nib.Nifti1Image(umap2, affine=ute1.affine)
+        save_nifti(save_im, self._gen_filename('sute_fix_template'))
+
+        return runtime
 
-        u_bone = 0.000001351 * (r2star_map**3) - 0.003617 * (r2star_map**2) + 3.841 * r2star_map - 19.46
+    @classmethod
+    def _calc_umaps(cls, air, bones, ute1, ute2, umap, umap2):
+        """
+        Calculates the continuous and fixed umaps for a slab of the inputs,
+        writing them into 'umap' and 'umap2' respectively. The input arrays
+        are overwritten in the process.
+        """
+        r2star_map = np.log(ute1, out=ute1)
+        r2star_map -= np.log(ute2, out=ute2)
+        r2star_map *= 1000. / 2.39
+        r2star_map[np.isnan(r2star_map)] = 0
+
+        # u_bone = 0.000001351 * r2^3 - 0.003617 * r2^2 + 3.841 * r2 - 19.46
+        u_bone = r2star_map * 0.000001351
+        u_bone -= 0.003617
+        u_bone *= r2star_map
+        u_bone += 3.841
+        u_bone *= r2star_map
+        u_bone -= 19.46
+        # The expanded polynomial is undefined (inf - inf) where the R2* is
+        # infinite, so these voxels end up as zeros in the final umaps
+        u_bone[np.isposinf(r2star_map)] = np.nan
         # CONVERSION from HU to PET u values
         # Conversion based on:
         # Carney J P et al. (2006) Med. Phys. 33 976-83
-        
         a = 0.000051
         b = 0.0471
         BP = 1047.
 
-        low = u_bone < BP
-        u_bone[low] = 0.000096 * (1000. + u_bone[low])
         high = u_bone >= BP
-        u_bone[high] = a * (1000. + u_bone[high]) + b
+        u_bone += 1000.
+        u_bone *= np.where(high, a, 0.000096).astype(np.float32)
+        u_bone += high * np.float32(b)
 
-        low_u = u_bone < 0.1134
-        u_bone[low_u] = 0.1134
+        np.maximum(u_bone, 0.1134, out=u_bone)
         # End of conversion
-        
+
         u_soft_fixed = 0.1
         u_air = 0.
+        u_bone2 = 0.151
 
-        umap = 10000. * (u_air * np.array(air.get_data()) +
-                         u_bone * np.array(bones.get_data()) +
-                         (1 - np.array(bones.get_data())) *
-                         (1 - np.array(air.get_data())) * u_soft_fixed)
-
-        nans = np.isnan(umap)
-        umap[nans] = 0
-        save_im = nib.Nifti1Image(umap, affine=ute1.affine)
-        nib.save(save_im, self._gen_filename('sute_cont_template'))
+        # Contribution of the air and soft tissue, which is shared by both
+        # umaps, i.e. u_air * air + (1 - bones) * (1 - air) * u_soft_fixed
+        shared = np.subtract(1, air, out=ute2)
+        shared *= u_soft_fixed
+        shared *= (1 - bones)
+        air *= u_air
+        shared += air
 
-        u_bone2 = 0.151
-        umap2 = 10000. * (u_air * np.array(air.get_data()) +
-                         u_bone2 * np.array(bones.get_data()) +
-                         (1 - np.array(bones.get_data())) *
-                         (1 - np.array(air.get_data())) * u_soft_fixed)
+        np.multiply(u_bone, bones, out=umap)
+        umap += shared
+        umap *= 10000.
+        umap[np.isnan(umap)] = 0
 
-        nans = np.isnan(umap2)
-        umap2[nans] = 0
-        save_im = nib.Nifti1Image(umap2, affine=ute1.affine)
-        nib.save(save_im, self._gen_filename('sute_fix_template'))
+        np.multiply(bones, u_bone2, out=umap2)
+        umap2 += shared
+        umap2 *= 10000.
+        umap2[np.isnan(umap2)] = 0
 
-        return runtime
+    @classmethod
+    def _load_slab(cls, img, sl):
+        return np.array(img.dataobj[sl], dtype=np.float32)
 
     def _list_outputs(self):
         outputs = self._outputs().get()
@@ -116,7 +158,7 @@ class CoreUmapCalc(BaseInterface):
         else:
             sute_cont_template_fname = os.path.join(
                 os.getcwd(),
-                "sute_cont_template.nii.gz")
+                "sute_cont_template" + nifti_ext(self.inputs.compress))
         return sute_cont_template_fname
 
     def _gen_sute_fix_template_fname(self):
@@ -125,5 +167,5 @@ class CoreUmapCalc(BaseInterface):
         else:
             sute_fix_template_fname = os.path.join(
                 os.getcwd(),
-                "sute_fix_template.nii.gz")
+                "sute_fix_template" + nifti_ext(self.inputs.compress))
         return sute_fix_template_fname
@@ -0,0 +1,73 @@
+import os.path
+from nipype.interfaces.base import (
+    BaseInterface, BaseInterfaceInputSpec, TraitedSpec, File)
+from arcana.interfaces.utils import CopyToDir
+from nianalysis.utils import gather, link_or_copy
+from nianalysis.output_policy import gzip_file
+
+
+class GatherToDir(CopyToDir):
+    """
+    Gathers a list of files or directories into a directory, in the same
+    layout as CopyToDir, but hard-linking them (falling back to reflinks and
+    then copies) instead of copying them
+    """
+
+    def _run_interface(self, runtime):
+        dirname = self._gen_outdirname()
+        ext = self.inputs.extension
+        paths = []
+        names = []
+        for i, f in enumerate(self.inputs.in_files):
+            if os.path.isdir(f):
+                out_name = f.split('/')[-1]
+                if ext:
+                    out_name = '{0}_{1}'.format(
+                        out_name, ext+str(i).zfill(3))
+            elif ext == '.dcm':
+                out_name = str(i).zfill(4) + ext
+            else:
+                out_name = os.path.basename(f)
+            paths.append(f)
+            names.append(out_name)
+        gather(paths, dirname, names=names)
+        return runtime
+
+
+class GzipImageInputSpec(BaseInterfaceInputSpec):
+
+    in_file = File(exists=True, mandatory=True,
+                   desc="The uncompressed image to gzip")
+
+
+class GzipImageOutputSpec(TraitedSpec):
+
+    out_file = File(exists=True, desc="The gzipped image")
+
+
+class GzipImage(BaseInterface):
+    """
+    Gzips an uncompressed image according to the output policy (see
+    nianalysis.output_policy), e.g. the output of an FSL interface that is
+    sunk to the repository, so that it is compressed at the configured level
+    (and with pigz if enabled) rather than by the tool that wrote it
+    """
+
+    input_spec = GzipImageInputSpec
+    output_spec = GzipImageOutputSpec
+
+    def _run_interface(self, runtime):
+        # The image is linked into the working directory as gzipping it
+        # replaces the uncompressed file
+        link_or_copy(self.inputs.in_file, self._uncompressed_path())
+        gzip_file(self._uncompressed_path())
+        return runtime
+
+    def _list_outputs(self):
+        outputs = self._outputs().get()
+        outputs['out_file'] = self._uncompressed_path() + '.gz'
+        return outputs
+
+    def _uncompressed_path(self):
+        return os.path.join(os.getcwd(),
+                            os.path.basename(self.inputs.in_file))
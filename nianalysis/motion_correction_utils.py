@@ -1,4 +1,5 @@
 import os.path
+import json
 import pydicom
 import glob
 import shutil
@@ -12,6 +13,207 @@ import datetime as dt
 
 PHASE_IMAGE_TYPE = ['ORIGINAL', 'PRIMARY', 'P', 'ND']
 
+SCAN_METADATA_FNAME = 'scan_metadata.json'
+
+# Directories created in the input directory by previous runs
+WORKING_DIRS = ('work_dir', 'motion_detection_cache')
+
+
+class ScanMetadataCache(object):
+    """
+    The metadata of the scans in a session directory that is used to
+    classify them (series description, image type, resolution, start time,
+    phase encoding, dimensions and b-values), stored in a JSON file next to
+    the scans so the DICOM headers only need to be read (and 'mrinfo' run)
+    once per scan.
+
+    Fields are probed in groups the first time one of them is requested.
+    The entry of a scan is discarded when the modification times or number
+    of the files in its directory change, so only the affected scans are
+    probed again.
+
+    Parameters
+    ----------
+    input_dir : str
+        The session directory containing a sub-directory per scan
+    """
+
+    # The probe each field is obtained from
+    FIELDS = {'series_description': 'header',
+              'image_type': 'header',
+              'resolution': 'header',
+              'sequence_name': 'header',
+              'start_time': 'header_info',
+              'ped': 'header_info',
+              'pe_angle': 'header_info',
+              'dimensions': 'mrinfo',
+              'bvalues': 'mrinfo'}
+
+    def __init__(self, input_dir):
+        self.input_dir = input_dir
+        self.path = os.path.join(input_dir, SCAN_METADATA_FNAME)
+        try:
+            with open(self.path) as f:
+                self._scans = json.load(f)
+        except (IOError, ValueError):
+            self._scans = {}
+
+    def scan_dir(self, scan):
+        return os.path.join(self.input_dir, scan)
+
+    def dicom_files(self, scan):
+        dcm_files = sorted(glob.glob(self.scan_dir(scan) + '/*.dcm'))
+        if not dcm_files:
+            dcm_files = sorted(glob.glob(self.scan_dir(scan) + '/*.IMA'))
+        return dcm_files
+
+    def get(self, scan, field):
+        """
+        Returns a metadata field of the scan, probing the scan if the field
+        isn't cached or the cached entry is out of date
+        """
+        probe = self.FIELDS[field]
+        fingerprint = self._fingerprint(scan)
+        entry = self._scans.get(scan)
+        if entry is None or entry['fingerprint'] != fingerprint:
+            entry = self._scans[scan] = {'fingerprint': fingerprint,
+                                         'probed': []}
+        if probe not in entry['probed']:
+            entry.update(getattr(self, '_probe_' + probe)(scan))
+            entry['probed'].append(probe)
+            self.save()
+        return entry[field]
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self._scans, f, indent=2, sort_keys=True)
+        os.rename(tmp_path, self.path)
+
+    def _fingerprint(self, scan):
+        scan_dir = self.scan_dir(scan)
+        fnames = os.listdir(scan_dir)
+        mtimes = [os.path.getmtime(scan_dir)]
+        mtimes.extend(os.path.getmtime(os.path.join(scan_dir, f))
+                      for f in fnames)
+        return [len(fnames), max(mtimes)]
+
+    def _probe_header(self, scan):
+        dicom = self.dicom_files(scan)[0]
+        hd = pydicom.read_file(dicom)
+        sequence_name = None
+        with open(dicom, 'rb') as f:
+            for line in f:
+                try:
+                    line = line[:-1].decode('utf-8')
+                except UnicodeDecodeError:
+                    continue
+                if 'tSequenceFileName' in line:
+                    sequence_name = line.strip().split('\\')[-1].split('"')[0]
+                    break
+        try:
+            image_type = list(hd['0008', '0008'].value)
+        except KeyError:
+            image_type = None
+        try:
+            resolution = float(hd.PixelSpacing[0])
+        except AttributeError:
+            resolution = None
+        return {'series_description': str(hd.get('SeriesDescription', '')),
+                'image_type': image_type,
+                'resolution': resolution,
+                'sequence_name': sequence_name}
+
+    def _probe_header_info(self, scan):
+        hd_extraction = DicomHeaderInfoExtraction()
+        hd_extraction.inputs.dicom_folder = self.scan_dir(scan)
+        dcm_info = hd_extraction.run()
+        return {'start_time': dcm_info.outputs.start_time,
+                'ped': dcm_info.outputs.ped,
+                'pe_angle': dcm_info.outputs.pe_angle}
+
+    def _probe_mrinfo(self, scan):
+        info = sp.check_output(['mrinfo', self.scan_dir(scan), '-size'])
+        dimensions = [int(d) for d in info.decode('utf-8').split()]
+        try:
+            bvalues = sp.check_output(
+                ['mrinfo', self.scan_dir(scan), '-shell_bvalues'],
+                stderr=sp.STDOUT)
+            bvalues = [float(b) for b in bvalues.decode('utf-8').split()]
+        except (sp.CalledProcessError, ValueError):
+            bvalues = None  # No diffusion scheme in the header
+        return {'dimensions': dimensions, 'bvalues': bvalues}
+
+
+def clear_motion_detection_outputs(session_dir, study_name, spec_names):
+    """
+    Removes the outputs of the session-level motion detection pipelines
+    (mean displacement, framing, etc...) from the session directory of a
+    local repository, so that they are regenerated from the outputs of the
+    scans that have been added to the session when the study is rerun. The
+    outputs of the per-scan pipelines are kept, so only the new scans are
+    processed.
+
+    Parameters
+    ----------
+    session_dir : str
+        The session directory of the local repository
+    study_name : str
+        The name of the motion detection study
+    spec_names : list(str)
+        The names of the outputs to remove
+    """
+    prefixes = [study_name + '_' + n for n in spec_names]
+    for fname in os.listdir(session_dir):
+        if not any(fname == p or fname.startswith(p + '.') for p in prefixes):
+            continue
+        path = os.path.join(session_dir, fname)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+
+def merge_scan_assignment(previous, current):
+    """
+    Merges the classification of the scans of a session made by a previous
+    run with that of the scans now in the session, for incremental runs.
+    The sub-studies of the motion detection study are named by the position
+    of their scan in each class (e.g. 't2_0', 't2_1'), so the reference and
+    the classes of the scans processed by the previous run are kept as they
+    were and the new scans are appended to the end of their class. This
+    keeps the per-scan outputs of the previous run matched to their scans,
+    even if a new scan would now be chosen as the reference.
+
+    Parameters
+    ----------
+    previous : list
+        The reference, reference type, T1s, EPIs, T2s and DWIs chosen by the
+        previous run (see `guess_scan_type`)
+    current : list
+        The same for the scans now in the session
+
+    Returns
+    -------
+    merged : list
+        The reference, reference type, T1s, EPIs, T2s and DWIs to use
+    """
+    ref, ref_type, t1s, epis, t2s, dmris = previous
+    new_ref, new_ref_type, new_t1s, new_epis, new_t2s, new_dmris = current
+    assigned = set([ref] + t1s + epis + t2s + [d[0] for d in dmris])
+    t1s, epis, t2s, dmris = list(t1s), list(epis), list(t2s), list(dmris)
+    if new_ref is not None and new_ref != ref:
+        print(('Keeping the reference chosen by the previous run ({}) '
+               'instead of {}, as the outputs of the scans already '
+               'processed are aligned to it.'.format(ref, new_ref)))
+        if new_ref not in assigned:
+            (t1s if new_ref_type == 't1' else t2s).append(new_ref)
+            assigned.add(new_ref)
+    for scans, new_scans in ((t1s, new_t1s), (epis, new_epis),
+                             (t2s, new_t2s)):
+        scans.extend(s for s in new_scans if s not in assigned)
+    dmris.extend(d for d in new_dmris if d[0] not in assigned)
+    return [ref, ref_type, t1s, epis, t2s, dmris]
 
 # def xnat_motion_detection(xnat_id):
 # 
@@ -33,7 +235,8 @@ def local_motion_detection(input_dir, pet_dir=None, pet_recon=None,
     if not dcm_files:
         scan_description = [f for f in os.listdir(input_dir) if (not
                             f.startswith('.') and os.path.isdir(input_dir+f)
-                            and 'motion_correction_results' not in f)]
+                            and 'motion_correction_results' not in f and
+                            f not in WORKING_DIRS)]
         dcm = False
     else:
         dcm = True
@@ -66,7 +269,9 @@ def local_motion_detection(input_dir, pet_dir=None, pet_recon=None,
             name_scan = name_scan.replace(" ", "_")
             if name_scan in scan_description[-1]:
                 files.append(im)
-            elif name_scan not in scan_description[-1] and copy:
+            elif name_scan not in scan_description[-1]:
+                # Scans added since a previous run are copied into the
+                # existing working directory
                 if (os.path.isdir(
                         working_dir+scan_description[-1]) is False):
                     os.mkdir(working_dir+scan_description[-1])
@@ -74,18 +279,17 @@ def local_motion_detection(input_dir, pet_dir=None, pet_recon=None,
                         shutil.copy(f, working_dir+scan_description[-1])
                 files = [im]
                 scan_description.append(name_scan)
-            elif name_scan not in scan_description[-1] and not copy:
-                files = [im]
-                scan_description.append(name_scan)
-            if i == len(dcm_files)-1 and copy:
+            if i == len(dcm_files)-1:
                 if (os.path.isdir(working_dir+scan_description[-1]) is
                         False):
                     os.mkdir(working_dir+scan_description[-1])
                     for f in files:
                         shutil.copy(f, working_dir+scan_description[-1])
-    elif not dcm and copy:
+    elif not dcm:
         for s in scan_description:
-            shutil.copytree(input_dir+s, working_dir+'/'+s)
+            if not os.path.isdir(working_dir+'/'+s):
+                shutil.copytree(input_dir+s, working_dir+'/'+s)
+    if not dcm and copy:
         if pet_dir is not None:
             shutil.copytree(pet_dir, working_dir+'/pet_data_dir')
         if pet_recon is not None:
@@ -212,24 +416,11 @@ def guess_scan_type(scans, input_dir):
     res_t1 = []
     res_t2 = []
 
+    metadata = ScanMetadataCache(input_dir)
     for scan in scans:
-        sequence_name = None
-        dcm_files = sorted(glob.glob(input_dir+'/'+scan+'/*.dcm'))
-        if not dcm_files:
-            dcm_files = sorted(glob.glob(input_dir+'/'+scan+'/*.IMA'))
-        if not dcm_files:
+        if not metadata.dicom_files(scan):
             continue
-        dicom = dcm_files[0]
-        hd = pydicom.read_file(dicom)
-        with open(dcm_files[0], 'rb') as f:
-            for line in f:
-                try:
-                    line = line[:-1].decode('utf-8')
-                except UnicodeDecodeError:
-                    continue
-                if 'tSequenceFileName' in line:
-                    sequence_name = line.strip().split('\\')[-1].split('"')[0]
-                    break
+        sequence_name = metadata.get(scan, 'sequence_name')
 
         if sequence_name is not None:
             if (('tfl' in sequence_name or
@@ -237,7 +428,7 @@ def guess_scan_type(scans, input_dir):
                     (re.match('.*(t1|T1).*', scan) or
                      re.match('.*(ute|UTE).*', scan))):
                 t1s.append(scan)
-                res_t1.append([scan, float(hd.PixelSpacing[0])])
+                res_t1.append([scan, metadata.get(scan, 'resolution')])
             elif 'bold' in sequence_name or 'asl' in sequence_name:
                 epis.append(scan)
             elif 'diff' in sequence_name:
@@ -245,7 +436,7 @@ def guess_scan_type(scans, input_dir):
             else:
                 t2s.append(scan)
                 if 'gre' not in sequence_name:
-                    res_t2.append([scan, float(hd.PixelSpacing[0])])
+                    res_t2.append([scan, metadata.get(scan, 'resolution')])
     dmris, unused_b0 = dwi_type_assignment(input_dir, dwi_scans)
     if unused_b0:
         print(('The following b0 images have different phase encoding '
@@ -339,27 +530,19 @@ def dwi_type_assignment(input_dir, dmri_images):
     dmris = []
     unused_b0 = []
 
+    metadata = ScanMetadataCache(input_dir)
     for dwi in dmri_images:
-        cmd = 'mrinfo {0}'.format(input_dir+'/'+dwi)
-        info = (sp.check_output(cmd, shell=True)).decode('utf-8')
-        info = info.strip().split('\n')
-        for line in info:
-            if 'Dimensions:' in line:
-                dim = line.split('Dimensions:')[-1].strip().split('x')
-                break
-        hd_extraction = DicomHeaderInfoExtraction()
-        hd_extraction.inputs.dicom_folder = input_dir+'/'+dwi
-        dcm_info = hd_extraction.run()
+        dim = metadata.get(dwi, 'dimensions')
+        pe_angle = metadata.get(dwi, 'pe_angle')
+        ped = metadata.get(dwi, 'ped')
 
-        if dcm_info.outputs.pe_angle and dcm_info.outputs.ped:
+        if pe_angle and ped:
             if len(dim) == 4:
                 main_dwi.append(
-                    [dwi, np.trunc(float(dcm_info.outputs.pe_angle)),
-                     dcm_info.outputs.ped])
+                    [dwi, np.trunc(float(pe_angle)), ped])
             else:
                 b0.append([
-                    dwi, np.trunc(float(dcm_info.outputs.pe_angle)),
-                    dcm_info.outputs.ped])
+                    dwi, np.trunc(float(pe_angle)), ped])
         else:
             print ('Could not find phase encoding information from the'
                    'dwi images header. Distortion correction will not '
@@ -397,25 +580,20 @@ def check_image_type(input_dir, scans):
 
     toremove = []
     nodicom = []
+    metadata = ScanMetadataCache(input_dir)
     for scan in scans:
-        dcm_file = None
+        if not metadata.dicom_files(scan):
+            nodicom.append(scan)
+            continue
         try:
-            dcm_file = sorted(glob.glob(input_dir+'/'+scan+'/*.dcm'))[0]
-        except IndexError:
-            try:
-                dcm_file = sorted(glob.glob(
-                    input_dir+'/'+scan+'/*.IMA'))[0]
-            except IndexError:
-                nodicom.append(scan)
-        if dcm_file is not None:
-            try:
-                hd = pydicom.read_file(dcm_file)
-                im_type = hd['0008', '0008'].value
-                if im_type == PHASE_IMAGE_TYPE:
-                    toremove.append(scan)
-            except:
-                print(('{} does not have the image type in the header. It will'
-                       ' be removed from the analysis'.format(scan)))
+            im_type = metadata.get(scan, 'image_type')
+        except Exception:
+            im_type = None
+        if im_type is None:
+            print(('{} does not have the image type in the header. It will'
+                   ' be removed from the analysis'.format(scan)))
+        elif im_type == PHASE_IMAGE_TYPE:
+            toremove.append(scan)
 
     return toremove, nodicom
 
@@ -424,14 +602,13 @@ def check_image_start_time(input_dir, scans):
 
     start_times = []
     toremove = []
+    metadata = ScanMetadataCache(input_dir)
     for scan in scans:
         try:
 #             scan_name = scan.split('-')[1]
             scan_number = scan.split('-')[0].zfill(3)
-            hd_extraction = DicomHeaderInfoExtraction()
-            hd_extraction.inputs.dicom_folder = input_dir+'/'+scan
-            dcm_info = hd_extraction.run()
-            start_times.append([dcm_info.outputs.start_time, scan_number, scan])
+            start_times.append([metadata.get(scan, 'start_time'), scan_number,
+                                scan])
         except:
             print(('This folder {} seems to not contain DICOM files. It will '
                    'be ingnored.'.format(scan)))
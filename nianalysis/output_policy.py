@@ -0,0 +1,148 @@
+"""
+The policy for how the images written by nianalysis interfaces and
+pipelines are compressed.
+
+Images that are consumed straight away by the next node of a pipeline
+should be written uncompressed (gzipping them is pure CPU overhead), which
+the custom interfaces support through their 'compress' input and the FSL
+interfaces through their 'output_type' input (see `fsl_output_type`).
+Images that are sunk to the repository are gzipped at the level set by the
+NIANALYSIS_GZIP_LEVEL environment variable (default 1, the level NiBabel
+uses). If NIANALYSIS_PARALLEL_GZIP is set to a number of threads greater
+than one and 'pigz' is on the PATH, they are gzipped with pigz instead.
+
+As FSL gzips its outputs itself (ignoring the policy), FSL interfaces whose
+outputs are sunk should also write them uncompressed and be connected to
+the pipeline outputs with `connect_gzipped_output`.
+"""
+import os
+import subprocess
+from contextlib import contextmanager
+from shutil import which
+
+GZIP_LEVEL_ENV = 'NIANALYSIS_GZIP_LEVEL'
+PARALLEL_GZIP_ENV = 'NIANALYSIS_PARALLEL_GZIP'
+
+DEFAULT_GZIP_LEVEL = 1
+
+COMPRESS_DESC = ("Whether to gzip the output image(s). Can be disabled when "
+                 "the output is only consumed by the next node of the "
+                 "pipeline")
+
+
+def gzip_level():
+    return int(os.environ.get(GZIP_LEVEL_ENV, DEFAULT_GZIP_LEVEL))
+
+
+def parallel_gzip_threads():
+    """
+    Returns the number of threads to gzip with using pigz, or 0 if the
+    parallel backend isn't enabled or pigz isn't installed
+    """
+    num_threads = int(os.environ.get(PARALLEL_GZIP_ENV, 0))
+    if num_threads > 1 and which('pigz') is not None:
+        return num_threads
+    return 0
+
+
+def nifti_ext(compress=True):
+    return '.nii.gz' if compress else '.nii'
+
+
+def fsl_output_type(compress=True):
+    "The value of the 'output_type' input of FSL interfaces for the policy"
+    return 'NIFTI_GZ' if compress else 'NIFTI'
+
+
+def connect_gzipped_output(pipeline, spec_name, node, node_output, **kwargs):
+    """
+    Connects an uncompressed image output of a node (e.g. of an FSL interface
+    with an 'output_type' of `fsl_output_type(compress=False)`) to an output
+    of the pipeline, via a node that gzips it according to the policy
+
+    Parameters
+    ----------
+    pipeline : Pipeline
+        The pipeline to connect the output of
+    spec_name : str
+        Name of the study dataset spec to connect to
+    node : nipype.pipeline.BaseNode
+        The node to connect the output from
+    node_output : str
+        Name of the output of the node to connect
+    kwargs : dict
+        Passed on to `create_node` for the gzip node
+
+    Returns
+    -------
+    gzip : Node
+        The gzip node
+    """
+    from nianalysis.interfaces.utils import GzipImage
+    gzip = pipeline.create_node(GzipImage(), name=spec_name + '_gzip',
+                                **kwargs)
+    pipeline.connect(node, node_output, gzip, 'in_file')
+    pipeline.connect_output(spec_name, gzip, 'out_file')
+    return gzip
+
+
+@contextmanager
+def _nibabel_compresslevel(level):
+    from nibabel.openers import Opener
+    orig_level = Opener.default_compresslevel
+    Opener.default_compresslevel = level
+    try:
+        yield
+    finally:
+        Opener.default_compresslevel = orig_level
+
+
+def save_nifti(img, path):
+    """
+    Saves a NiBabel image to the path, gzipping it according to the policy
+    if the path ends in '.gz'
+
+    Returns
+    -------
+    path : str
+        The path the image was saved to
+    """
+    import nibabel as nib
+    if not path.endswith('.gz'):
+        nib.save(img, path)
+        return path
+    num_threads = parallel_gzip_threads()
+    if num_threads:
+        nib.save(img, path[:-3])
+        gzip_file(path[:-3], num_threads=num_threads)
+    else:
+        with _nibabel_compresslevel(gzip_level()):
+            nib.save(img, path)
+    return path
+
+
+def gzip_file(path, num_threads=None):
+    """
+    Gzips a file in place (replacing it with '<path>.gz') according to the
+    policy, e.g. to compress the uncompressed output of an external tool
+    before it is sunk
+
+    Returns
+    -------
+    gz_path : str
+        The path to the gzipped file
+    """
+    if num_threads is None:
+        num_threads = parallel_gzip_threads()
+    level = '-{}'.format(gzip_level())
+    if num_threads:
+        subprocess.check_call(['pigz', '-f', level, '-p', str(num_threads),
+                               path])
+    else:
+        import gzip
+        import shutil
+        with open(path, 'rb') as f_in, gzip.open(
+                path + '.gz', 'wb', compresslevel=gzip_level()) as f_out:
+            shutil.copyfileobj(f_in, f_out, 2 ** 20)
+        os.remove(path)
+    return path + '.gz'
@@ -0,0 +1,294 @@
+"""
+Opt-in resource profiling of the interfaces implemented in nianalysis.
+
+When profiling is enabled (either by calling `enable_profiling` or by
+setting the NIANALYSIS_PROFILE_DIR environment variable before nianalysis is
+imported, which also covers the worker processes of multi-process and
+cluster runners) the wall time, CPU time, peak RSS and bytes read from and
+written to storage of every run of a nianalysis interface are saved as a
+JSON record in the profile directory. The records can then be summarised into a
+per-pipeline report with `write_report` and used to propose updated
+'wall_time' and 'memory' values for `create_node` with `suggest_resources`.
+"""
+import os.path
+import sys
+import json
+import math
+import time
+import uuid
+import errno
+import resource
+from collections import defaultdict
+
+PROFILE_DIR_ENV = 'NIANALYSIS_PROFILE_DIR'
+
+_original_run = None
+
+
+def enable_profiling(profile_dir=None):
+    """
+    Enables the profiling of nianalysis interfaces in the current process
+
+    Parameters
+    ----------
+    profile_dir : str | None
+        The directory to save the profile records to. If None, the value of
+        the NIANALYSIS_PROFILE_DIR environment variable is used. Note that
+        the environment variable is also set so that the setting is
+        inherited by worker processes.
+    """
+    global _original_run
+    from nipype.interfaces.base import BaseInterface
+    if profile_dir is None:
+        profile_dir = os.environ[PROFILE_DIR_ENV]
+    profile_dir = os.path.abspath(profile_dir)
+    try:
+        os.makedirs(profile_dir)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    os.environ[PROFILE_DIR_ENV] = profile_dir
+    if _original_run is not None:
+        return  # Already enabled
+    _original_run = BaseInterface.run
+
+    def run(self, *args, **kwargs):
+        if not type(self).__module__.startswith('nianalysis.'):
+            return _original_run(self, *args, **kwargs)
+        monitor = ResourceMonitor()
+        try:
+            with monitor:
+                return _original_run(self, *args, **kwargs)
+        finally:
+            record = monitor.record
+            record['interface'] = '{}.{}'.format(type(self).__module__,
+                                                 type(self).__name__)
+            record['node_dir'] = os.getcwd()
+            save_record(record,
+                        os.environ.get(PROFILE_DIR_ENV, profile_dir))
+
+    BaseInterface.run = run
+
+
+def disable_profiling():
+    "Disables the profiling of nianalysis interfaces in the current process"
+    global _original_run
+    from nipype.interfaces.base import BaseInterface
+    if _original_run is not None:
+        BaseInterface.run = _original_run
+        _original_run = None
+    os.environ.pop(PROFILE_DIR_ENV, None)
+
+
+class ResourceMonitor(object):
+    """
+    Context manager that measures the resources used by the current process
+    (and the child processes it waits for) within the context
+    """
+
+    def __enter__(self):
+        self._reset_peak_rss()
+        self._usage = resource.getrusage(resource.RUSAGE_SELF)
+        self._child_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        self._io = self._read_io()
+        self._start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        wall_time = time.time() - self._start
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        child_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        io = self._read_io()
+        cpu_time = (
+            (usage.ru_utime - self._usage.ru_utime) +
+            (usage.ru_stime - self._usage.ru_stime) +
+            (child_usage.ru_utime - self._child_usage.ru_utime) +
+            (child_usage.ru_stime - self._child_usage.ru_stime))
+        peak_rss = self._peak_rss(usage)
+        # The peak RSS of children is only available as the maximum over
+        # all children, so it is only included if it has grown
+        if child_usage.ru_maxrss > self._child_usage.ru_maxrss:
+            peak_rss = max(peak_rss, self._to_mb(child_usage.ru_maxrss))
+        self.record = {
+            'start': self._start,
+            'wall_time': wall_time,
+            'cpu_time': cpu_time,
+            'peak_rss_mb': peak_rss,
+            'read_bytes': (io['read_bytes'] - self._io['read_bytes']
+                           if io is not None else None),
+            'write_bytes': (io['write_bytes'] - self._io['write_bytes']
+                            if io is not None else None),
+            'failed': exc_type is not None}
+        return False
+
+    @classmethod
+    def _reset_peak_rss(cls):
+        # Resets the "high water mark" of the RSS on Linux (>= 4.0) so the
+        # peak RSS can be attributed to the monitored code
+        try:
+            with open('/proc/self/clear_refs', 'w') as f:
+                f.write('5')
+        except (IOError, OSError):
+            pass
+
+    @classmethod
+    def _peak_rss(cls, usage):
+        try:
+            with open('/proc/self/status') as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        return int(line.split()[1]) / 1024.0
+        except (IOError, OSError):
+            pass
+        # Not Linux so fall back to the peak RSS over the process lifetime
+        return cls._to_mb(usage.ru_maxrss)
+
+    @classmethod
+    def _read_io(cls):
+        # The bytes the process caused to be read from and written to
+        # storage (as opposed to 'rchar' and 'wchar', which count all bytes
+        # passed to read and write syscalls, including those served from the
+        # page cache or pipes). The kernel adds the counts of child processes
+        # to those of the parent when they are waited for, so the tools run
+        # by command-line interfaces are included. Writes that were cancelled
+        # by truncating dirty pages (e.g. of deleted temporary files) are
+        # subtracted.
+        try:
+            with open('/proc/self/io') as f:
+                io = dict((k, int(v)) for k, v in
+                          (line.split(':') for line in f if ':' in line))
+        except (IOError, OSError):
+            return None
+        io['write_bytes'] -= io.get('cancelled_write_bytes', 0)
+        return io
+
+    @classmethod
+    def _to_mb(cls, maxrss):
+        # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+        return maxrss / (1024.0 ** 2 if sys.platform == 'darwin' else 1024.0)
+
+
+def save_record(record, profile_dir):
+    path = os.path.join(profile_dir, '{}_{}.json'.format(
+        os.path.basename(record['node_dir']), uuid.uuid4().hex))
+    with open(path, 'w') as f:
+        json.dump(record, f)
+
+
+def load_records(profile_dir):
+    "Loads all the profile records saved in the profile directory"
+    records = []
+    for fname in sorted(os.listdir(profile_dir)):
+        if fname.endswith('.json'):
+            with open(os.path.join(profile_dir, fname)) as f:
+                records.append(json.load(f))
+    return records
+
+
+def _pipeline_and_node(node_dir, work_dir=None):
+    # Nodes are run in '<work_dir>/<top-level workflow>/<pipeline>/
+    # _subject_id_<id>/_visit_id_<id>/<node>', where the top-level workflow
+    # is named after all the pipelines run together and there is a
+    # '_<iterable>_<value>' directory for each iterable the node is run
+    # over. Map-node iterations are run in 'mapflow/_<node-name><index>'
+    # sub-directories of the node directory.
+    if os.path.basename(os.path.dirname(node_dir)) == 'mapflow':
+        node_dir = os.path.dirname(os.path.dirname(node_dir))
+    parent = os.path.dirname(node_dir)
+    if work_dir is not None:
+        parts = os.path.relpath(parent, work_dir).split(os.path.sep)
+        pipeline = parts[1] if len(parts) > 1 else parts[0]
+    else:
+        while os.path.basename(parent).startswith('_'):
+            parent = os.path.dirname(parent)
+        pipeline = os.path.basename(parent)
+    return pipeline, os.path.basename(node_dir)
+
+
+def summarise(records, work_dir=None):
+    """
+    Summarises the profile records by pipeline and node
+
+    Parameters
+    ----------
+    records : list(dict)
+        The records loaded by `load_records`
+    work_dir : str | None
+        The work directory of the runner the records were generated with,
+        used to determine the pipeline each node belongs to. If not
+        provided, the pipeline is taken to be the first directory above the
+        node directory that isn't an iterable ('_<iterable>_<value>')
+        directory.
+
+    Returns
+    -------
+    summary : dict(str, dict(str, dict))
+        The maximum and mean of each measurement for each node of each
+        pipeline, along with the number of runs and the interface
+    """
+    grouped = defaultdict(lambda: defaultdict(list))
+    for record in records:
+        if record.get('failed'):
+            continue
+        pipeline, node = _pipeline_and_node(record['node_dir'], work_dir)
+        grouped[pipeline][node].append(record)
+    summary = {}
+    for pipeline, nodes in grouped.items():
+        summary[pipeline] = {}
+        for node, node_records in nodes.items():
+            node_summary = {'interface': node_records[0]['interface'],
+                            'runs': len(node_records)}
+            for key in ('wall_time', 'cpu_time', 'peak_rss_mb', 'read_bytes',
+                        'write_bytes'):
+                vals = [r[key] for r in node_records if r[key] is not None]
+                if vals:
+                    node_summary[key] = {'max': max(vals),
+                                         'mean': sum(vals) / len(vals)}
+            summary[pipeline][node] = node_summary
+    return summary
+
+
+def write_report(profile_dir, out_path, work_dir=None):
+    """
+    Writes a JSON report summarising the resources used by each node of each
+    pipeline profiled in the profile directory (see `summarise`)
+    """
+    summary = summarise(load_records(profile_dir), work_dir=work_dir)
+    with open(out_path, 'w') as f:
+        json.dump(summary, f, indent=2, sort_keys=True)
+    return summary
+
+
+def suggest_resources(summary, wall_time_margin=1.5, memory_margin=1.25,
+                      memory_step=500):
+    """
+    Proposes 'wall_time' (in minutes) and 'memory' (in MB) values to pass to
+    `create_node` for each profiled node, based on the maximum wall time and
+    peak RSS recorded for it
+
+    Parameters
+    ----------
+    summary : dict
+        The summary returned by `summarise` or `write_report`
+    wall_time_margin : float
+        Factor the maximum recorded wall time is multiplied by
+    memory_margin : float
+        Factor the maximum recorded peak RSS is multiplied by
+    memory_step : int
+        The proposed memory is rounded up to a multiple of this (in MB)
+    """
+    suggestions = {}
+    for pipeline, nodes in summary.items():
+        suggestions[pipeline] = {}
+        for node, node_summary in nodes.items():
+            suggestion = {}
+            if 'wall_time' in node_summary:
+                suggestion['wall_time'] = max(1, int(math.ceil(
+                    node_summary['wall_time']['max'] * wall_time_margin /
+                    60.0)))
+            if 'peak_rss_mb' in node_summary:
+                suggestion['memory'] = max(memory_step, int(
+                    math.ceil(node_summary['peak_rss_mb']['max'] *
+                              memory_margin / memory_step) * memory_step))
+            suggestions[pipeline][node] = suggestion
+    return suggestions
@@ -0,0 +1,88 @@
+"""
+A local cache of the transforms computed by registration interfaces, so
+that a registration of the same image to the same template with the same
+parameters (e.g. by sub-studies of a multi-modal study that run the same
+registration of a shared scan, or by reruns after the working directory has
+been cleared) is only computed once.
+
+Entries are keyed by a hash of the contents of the moving and reference
+images (and any other input files such as masks) and the registration
+parameters, and are stored and linked into the working directories of the
+nodes in the same way as the conversion cache (see
+nianalysis.conversion_cache).
+
+The cache is enabled by setting the NIANALYSIS_REGISTRATION_CACHE_DIR
+environment variable to the directory to store it in, and its maximum size
+(in GB, default 50) can be set with NIANALYSIS_REGISTRATION_CACHE_SIZE.
+"""
+import os.path
+import json
+import hashlib
+import logging
+from nianalysis.conversion_cache import cache_from_env, interface_options
+
+logger = logging.getLogger('nianalysis')
+
+CACHE_DIR_ENV = 'NIANALYSIS_REGISTRATION_CACHE_DIR'
+CACHE_SIZE_ENV = 'NIANALYSIS_REGISTRATION_CACHE_SIZE'
+
+
+def registration_cache():
+    """
+    Returns the registration cache configured by the environment, or None
+    if it isn't enabled
+    """
+    return cache_from_env(CACHE_DIR_ENV, CACHE_SIZE_ENV)
+
+
+class CachedRegistrationMixin(object):
+    """
+    Mixin for registration interfaces that write their outputs to the
+    working directory with names starting with a prefix, which looks up the
+    outputs in the registration cache before running the registration and
+    stores them afterwards. The outputs are cached without the prefix so
+    that they can be shared between nodes that use different prefixes.
+
+    Classes using it need to define the name of the input trait holding
+    the prefix ('cache_prefix_input') and of the traits that don't affect
+    the outputs ('cache_ignore').
+    """
+
+    cache_prefix_input = 'out_prefix'
+    cache_ignore = ()
+
+    def _cache_options(self):
+        """
+        The inputs that affect the registration, with the input files
+        replaced by hashes of their contents
+        """
+        return interface_options(
+            self.inputs,
+            ignore=(self.cache_prefix_input,) + tuple(self.cache_ignore),
+            hash_files=True)
+
+    def _run_interface(self, runtime):
+        cache = registration_cache()
+        if cache is None:
+            return super(CachedRegistrationMixin, self)._run_interface(
+                runtime)
+        prefix = os.path.basename(getattr(self.inputs,
+                                          self.cache_prefix_input))
+        options = self._cache_options()
+        key = hashlib.sha1(json.dumps([type(self).__name__, options],
+                                      sort_keys=True).encode()).hexdigest()
+        out_dir = os.getcwd()
+        if cache.fetch(key, out_dir, prefix=prefix) is not None:
+            logger.info("Linked cached registration ({})".format(key))
+            runtime.returncode = 0
+            return runtime
+        before = set(os.listdir(out_dir))
+        runtime = super(CachedRegistrationMixin, self)._run_interface(
+            runtime)
+        if runtime.returncode == 0:
+            fnames = [f for f in sorted(os.listdir(out_dir))
+                      if f not in before and f.startswith(prefix) and
+                      os.path.isfile(os.path.join(out_dir, f))]
+            cache.store(key, [os.path.join(out_dir, f) for f in fnames],
+                        names=[f[len(prefix):] for f in fnames])
+        return runtime
@@ -0,0 +1,212 @@
+"""
+Runners that pass the number of threads requested for each node (the
+'nthreads' argument of `create_node`) on to the tool it runs, via the
+thread-count input of its interface (e.g. 'num_threads' for ANTs and
+'nthreads' for MRtrix) and the environment variables read by ITK, OpenMP,
+MRtrix and the BLAS libraries. Without them each ANTs, FSL and MRtrix tool
+starts a thread per core, so nodes that are run concurrently oversubscribe
+the workstation.
+
+The multi-process runner also schedules the nodes by the threads and memory
+they request, packing as many of them onto the available cores and memory
+as will fit. Nodes created without an 'nthreads' are left to use their
+tools' own threading. The linear runner runs one node at a time, so gives
+each of them all the cores.
+
+As arcana's own runners only use 'nthreads' to reserve cores (e.g. the
+SLURM 'ntasks'), the studies also set the thread-count inputs of the
+interfaces they create with an 'nthreads' to the same number.
+"""
+import logging
+from multiprocessing import cpu_count
+from arcana.node import ArcanaNodeMixin
+from arcana.runner import (
+    LinearRunner as ArcanaLinearRunner,
+    MultiProcRunner as ArcanaMultiProcRunner)
+from nipype.interfaces.base import isdefined
+
+logger = logging.getLogger('nianalysis')
+
+# Environment variables that set the number of threads used by the
+# libraries the ANTs, FSL, MRtrix and AFNI tools are built on
+THREAD_ENV_VARS = ('ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS', 'OMP_NUM_THREADS',
+                   'MRTRIX_NTHREADS', 'OPENBLAS_NUM_THREADS',
+                   'MKL_NUM_THREADS')
+
+# Names of the interface inputs that set the number of threads of a tool
+# (ANTs, MRtrix, FastICA and FreeSurfer's recon-all respectively)
+THREAD_INPUTS = ('num_threads', 'nthreads', 'n_threads', 'openmp')
+
+
+_original_arcana_init = ArcanaNodeMixin._arcana_init
+
+
+def _arcana_init(self, **kwargs):
+    # Records the arcana parameters the node was created with, as arcana
+    # replaces the missing ones with their defaults
+    self.declared_params = frozenset(n for n in self.arcana_params
+                                     if n in kwargs)
+    _original_arcana_init(self, **kwargs)
+
+
+ArcanaNodeMixin._arcana_init = _arcana_init
+
+
+def declared_threads(node):
+    """
+    Returns the number of threads a node was created with, or None if it
+    was created without one
+    """
+    if 'nthreads' not in getattr(node, 'declared_params', ()):
+        return None
+    return node.nthreads
+
+
+def set_node_threads(node, nthreads=None):
+    """
+    Sets the thread-count input (if present) and the threading environment
+    variables of the interface of a node
+
+    Parameters
+    ----------
+    node : Node
+        The node to set the number of threads of
+    nthreads : int | None
+        The number of threads. If None, the 'nthreads' the node was created
+        with is used, and nodes created without one are left unchanged
+    """
+    if nthreads is None:
+        nthreads = declared_threads(node)
+        if nthreads is None:
+            return
+    inputs = node.interface.inputs
+    trait_names = inputs.trait_names()
+    for name in THREAD_INPUTS:
+        if name in trait_names:
+            setattr(inputs, name, nthreads)
+    if 'environ' in trait_names:
+        environ = dict((v, str(nthreads)) for v in THREAD_ENV_VARS)
+        if isdefined(inputs.environ):
+            # Variables set explicitly on the interface take precedence
+            environ.update(inputs.environ)
+        inputs.environ = environ
+
+
+class ThreadBudgetMixin(object):
+    """
+    Sets the number of threads of the nodes of each pipeline before it is
+    connected into the workflow to run
+    """
+
+    def _connect_to_repository(self, pipeline, *args, **kwargs):
+        workflow = pipeline.workflow
+        for name in workflow.list_node_names():
+            self._budget_node(workflow.get_node(name))
+        return super(ThreadBudgetMixin, self)._connect_to_repository(
+            pipeline, *args, **kwargs)
+
+    def _budget_node(self, node):
+        set_node_threads(node)
+
+
+class LinearRunner(ThreadBudgetMixin, ArcanaLinearRunner):
+    """
+    Runs pipelines one node at a time, with each node using all of the
+    cores of the workstation
+
+    Parameters
+    ----------
+    work_dir : str
+        A directory in which to run the nipype workflows
+    num_threads : int
+        The number of threads to give each node (default: all cores)
+    """
+
+    def __init__(self, work_dir, num_threads=None, **kwargs):
+        self._num_threads = num_threads
+        super(LinearRunner, self).__init__(work_dir, **kwargs)
+
+    @property
+    def num_threads(self):
+        if self._num_threads is None:
+            return cpu_count()
+        return self._num_threads
+
+    def _budget_node(self, node):
+        set_node_threads(node, self.num_threads)
+
+
+class MultiProcRunner(ThreadBudgetMixin, ArcanaMultiProcRunner):
+    """
+    Runs pipelines on multiple processes of the local workstation, running
+    as many nodes at once as fit into its cores and memory given the threads
+    and memory each node was created with.
+
+    Parameters
+    ----------
+    work_dir : str
+        A directory in which to run the nipype workflows
+    num_processes : int
+        The number of cores to pack the nodes onto (default: all)
+    memory_gb : float
+        The memory to pack the nodes into in GB (default: 90% of the
+        system memory)
+    """
+
+    def __init__(self, work_dir, num_processes=None, memory_gb=None,
+                 plugin_args=None, **kwargs):
+        if plugin_args is None:
+            plugin_args = {}
+        if memory_gb is not None:
+            plugin_args['memory_gb'] = memory_gb
+        super(MultiProcRunner, self).__init__(
+            work_dir, num_processes=num_processes, plugin_args=plugin_args,
+            **kwargs)
+
+    @property
+    def num_processes(self):
+        return self._plugin.processors
+
+    @property
+    def memory_gb(self):
+        return self._plugin.memory_gb
+
+    def _budget_node(self, node):
+        requested = declared_threads(node)
+        if requested is not None:
+            # Nodes requesting more than is available are run on their own
+            # rather than raising an error
+            nthreads = min(requested, self.num_processes)
+            if nthreads < requested:
+                logger.info("Reducing threads of '{}' node from {} to the {} "
+                            "available".format(node.name, requested,
+                                               nthreads))
+            set_node_threads(node, nthreads)
+            node.n_procs = nthreads
+        memory = getattr(node, 'memory', None)
+        if memory is not None:
+            # NB: Node.mem_gb is a read-only property
+            node._mem_gb = min(memory / 1000.0, self.memory_gb)
+
+
+def local_runner(work_dir, num_processes=1, memory_gb=None, **kwargs):
+    """
+    Returns a runner for the local workstation, which runs the independent
+    pipelines of a study (e.g. those of the sub-studies of a multi-study)
+    concurrently on a pool of processes if more than one is requested.
+
+    Parameters
+    ----------
+    work_dir : str
+        A directory in which to run the nipype workflows
+    num_processes : int | None
+        The number of cores to run the pipelines on. If 1 the pipelines are
+        run one node at a time, and if None all the cores are used
+    memory_gb : float
+        The memory available to the concurrent nodes in GB (default: 90% of
+        the system memory)
+    """
+    if num_processes == 1:
+        return LinearRunner(work_dir, **kwargs)
+    return MultiProcRunner(work_dir, num_processes=num_processes,
+                           memory_gb=memory_gb, **kwargs)
@@ -1,6 +1,7 @@
 from nipype.interfaces import fsl
 from nipype.interfaces.spm.preprocess import Coregister
 from nianalysis.requirement import spm12_req
+from nianalysis.output_policy import fsl_output_type, connect_gzipped_output
 from nianalysis.citation import spm_cite
 from nianalysis.file_format import nifti_format, motion_mats_format,\
     directory_format, nifti_gz_format
@@ -186,12 +187,12 @@ class MRIStudy(Study, metaclass=StudyMetaClass):
         flirt.inputs.dof = self.parameter('flirt_degrees_of_freedom')
         flirt.inputs.cost = self.parameter('flirt_cost_func')
         flirt.inputs.cost_func = self.parameter('flirt_cost_func')
-        flirt.inputs.output_type = 'NIFTI_GZ'
+        flirt.inputs.output_type = fsl_output_type(compress=False)
         # Connect inputs
         pipeline.connect_input(to_reg, flirt, 'in_file')
         pipeline.connect_input(ref, flirt, 'reference')
         # Connect outputs
-        pipeline.connect_output(reg, flirt, 'out_file')
+        connect_gzipped_output(pipeline, reg, flirt, 'out_file')
         pipeline.connect_output(matrix, flirt,
                                 'out_matrix_file')
         return pipeline
@@ -309,7 +310,7 @@ class MRIStudy(Study, metaclass=StudyMetaClass):
         bet = pipeline.create_node(interface=fsl.BET(), name="bet",
                                    requirements=[fsl509_req])
         bet.inputs.mask = True
-        bet.inputs.output_type = 'NIFTI_GZ'
+        bet.inputs.output_type = fsl_output_type(compress=False)
         if self.parameter('bet_robust'):
             bet.inputs.robust = True
         if self.parameter('bet_reduce_bias'):
@@ -319,8 +320,8 @@ class MRIStudy(Study, metaclass=StudyMetaClass):
             'bet_g_threshold')
         # Connect inputs/outputs
         pipeline.connect_input(in_file, bet, 'in_file')
-        pipeline.connect_output('brain', bet, 'out_file')
-        pipeline.connect_output('brain_mask', bet, 'mask_file')
+        connect_gzipped_output(pipeline, 'brain', bet, 'out_file')
+        connect_gzipped_output(pipeline, 'brain_mask', bet, 'mask_file')
         return pipeline
 
     def _optiBET_brain_extraction_pipeline(self, in_file, **kwargs):
@@ -344,7 +345,7 @@ class MRIStudy(Study, metaclass=StudyMetaClass):
         mni_reg = pipeline.create_node(
             AntsRegSyn(num_dimensions=3, transformation='s',
                        out_prefix='T12MNI', num_threads=4), name='T1_reg',
-            wall_time=25, requirements=[ants2_req])
+            wall_time=25, nthreads=4, requirements=[ants2_req])
         mni_reg.inputs.ref_file = self.parameter('MNI_template')
         pipeline.connect_input(in_file, mni_reg, 'input_file')
 
@@ -359,8 +360,8 @@ class MRIStudy(Study, metaclass=StudyMetaClass):
         trans_flags.inputs.in2 = True
 
         apply_trans = pipeline.create_node(
-            ApplyTransforms(), name='ApplyTransform', wall_time=7,
-            memory=24000, requirements=[ants2_req])
+            ApplyTransforms(num_threads=4), name='ApplyTransform',
+            wall_time=7, memory=24000, nthreads=4, requirements=[ants2_req])
         apply_trans.inputs.input_image = self.parameter('MNI_template_mask')
         apply_trans.inputs.interpolation = 'NearestNeighbor'
         apply_trans.inputs.input_image_type = 3
@@ -434,27 +435,27 @@ class MRIStudy(Study, metaclass=StudyMetaClass):
         # Basic reorientation to standard MNI space
         reorient = pipeline.create_node(Reorient2Std(), name='reorient',
                                         requirements=[fsl5_req])
-        reorient.inputs.output_type = 'NIFTI_GZ'
+        reorient.inputs.output_type = fsl_output_type(compress=False)
         reorient_mask = pipeline.create_node(
             Reorient2Std(), name='reorient_mask', requirements=[fsl5_req])
-        reorient_mask.inputs.output_type = 'NIFTI_GZ'
+        reorient_mask.inputs.output_type = fsl_output_type(compress=False)
         reorient_brain = pipeline.create_node(
             Reorient2Std(), name='reorient_brain', requirements=[fsl5_req])
-        reorient_brain.inputs.output_type = 'NIFTI_GZ'
+        reorient_brain.inputs.output_type = fsl_output_type(compress=False)
         # Affine transformation to MNI space
         flirt = pipeline.create_node(interface=FLIRT(), name='flirt',
                                      requirements=[fsl5_req],
                                      wall_time=5)
         flirt.inputs.reference = ref_brain
         flirt.inputs.dof = 12
-        flirt.inputs.output_type = 'NIFTI_GZ'
+        flirt.inputs.output_type = fsl_output_type(compress=False)
         # Nonlinear transformation to MNI space
         fnirt = pipeline.create_node(interface=FNIRT(), name='fnirt',
                                      requirements=[fsl5_req],
                                      wall_time=60)
         fnirt.inputs.ref_file = ref_atlas
         fnirt.inputs.refmask_file = ref_mask
-        fnirt.inputs.output_type = 'NIFTI_GZ'
+        fnirt.inputs.output_type = fsl_output_type(compress=False)
         intensity_model = self.parameter('fnirt_intensity_model')
         if intensity_model is None:
             intensity_model = 'none'
@@ -484,9 +485,10 @@ class MRIStudy(Study, metaclass=StudyMetaClass):
         pipeline.connect_input('brain_mask', reorient_mask, 'in_file')
         pipeline.connect_input('brain', reorient_brain, 'in_file')
         # Connect outputs
-        pipeline.connect_output('coreg_to_atlas', fnirt, 'warped_file')
-        pipeline.connect_output('coreg_to_atlas_coeff', fnirt,
-                                'fieldcoeff_file')
+        connect_gzipped_output(pipeline, 'coreg_to_atlas', fnirt,
+                               'warped_file')
+        connect_gzipped_output(pipeline, 'coreg_to_atlas_coeff', fnirt,
+                               'fieldcoeff_file')
         return pipeline
 
     def _ants_to_atlas_pipeline(self, **kwargs):
@@ -506,7 +508,8 @@ class MRIStudy(Study, metaclass=StudyMetaClass):
         ants_reg = pipeline.create_node(
             AntsRegSyn(num_dimensions=3, transformation='s',
                        out_prefix='Struct2MNI', num_threads=4),
-            name='Struct2MNI_reg', wall_time=25, requirements=[ants2_req])
+            name='Struct2MNI_reg', wall_time=25, nthreads=4,
+            requirements=[ants2_req])
 
         ref_brain = self.parameter('MNI_template_brain')
         ants_reg.inputs.ref_file = ref_brain
@@ -9,6 +9,8 @@ from nianalysis.file_format import (
 from nianalysis.citation import fsl_cite
 from nipype.interfaces import fsl
 from nianalysis.requirement import fsl509_req
+from nianalysis.output_policy import (
+    fsl_output_type, nifti_ext, connect_gzipped_output)
 from arcana.study.base import StudyMetaClass
 from nianalysis.interfaces.custom.motion_correction import (
     MergeListMotionMat, MotionMatCalculation)
@@ -99,10 +101,10 @@ class EPIStudy(MRIStudy, metaclass=StudyMetaClass):
         mcflirt.inputs.ref_vol = 0
         mcflirt.inputs.save_mats = True
         mcflirt.inputs.save_plots = True
-        mcflirt.inputs.output_type = 'NIFTI_GZ'
-        mcflirt.inputs.out_file = 'moco.nii.gz'
+        mcflirt.inputs.output_type = fsl_output_type(compress=False)
+        mcflirt.inputs.out_file = 'moco' + nifti_ext(compress=False)
         pipeline.connect_input('preproc', mcflirt, 'in_file')
-        pipeline.connect_output('moco', mcflirt, 'out_file')
+        connect_gzipped_output(pipeline, 'moco', mcflirt, 'out_file')
         pipeline.connect_output('moco_par', mcflirt, 'par_file')
 
         merge = pipeline.create_node(MergeListMotionMat(), name='merge')
@@ -157,15 +159,19 @@ class EPIStudy(MRIStudy, metaclass=StudyMetaClass):
         reorient_epi_in = pipeline.create_node(
             fsl.utils.Reorient2Std(), name='reorient_epi_in',
             requirements=[fsl509_req])
+        reorient_epi_in.inputs.output_type = fsl_output_type(compress=False)
         pipeline.connect_input('primary', reorient_epi_in, 'in_file')
 
         reorient_epi_opposite = pipeline.create_node(
             fsl.utils.Reorient2Std(), name='reorient_epi_opposite',
             requirements=[fsl509_req])
+        reorient_epi_opposite.inputs.output_type = fsl_output_type(
+            compress=False)
         pipeline.connect_input('reverse_phase', reorient_epi_opposite,
                                'in_file')
         prep_dwi = pipeline.create_node(PrepareDWI(), name='prepare_dwi')
         prep_dwi.inputs.topup = True
+        prep_dwi.inputs.compress = False
         pipeline.connect_input('ped', prep_dwi, 'pe_dir')
         pipeline.connect_input('pe_angle', prep_dwi, 'ped_polarity')
         pipeline.connect(reorient_epi_in, 'out_file', prep_dwi, 'dwi')
@@ -180,6 +186,7 @@ class EPIStudy(MRIStudy, metaclass=StudyMetaClass):
         merge = pipeline.create_node(fsl_merge(), name='fsl_merge',
                                      requirements=[fsl509_req])
         merge.inputs.dimension = 't'
+        merge.inputs.output_type = fsl_output_type(compress=False)
         pipeline.connect(merge_outputs, 'out', merge, 'in_files')
         topup = pipeline.create_node(TOPUP(), name='topup',
                                      requirements=[fsl509_req])
@@ -220,14 +227,17 @@ class EPIStudy(MRIStudy, metaclass=StudyMetaClass):
         reorient_epi_in = pipeline.create_node(
             fsl.utils.Reorient2Std(), name='reorient_epi_in',
             requirements=[fsl509_req])
+        reorient_epi_in.inputs.output_type = fsl_output_type(compress=False)
         pipeline.connect_input('primary', reorient_epi_in, 'in_file')
         fm_mag_reorient = pipeline.create_node(
             fsl.utils.Reorient2Std(), name='reorient_fm_mag',
             requirements=[fsl509_req])
+        fm_mag_reorient.inputs.output_type = fsl_output_type(compress=False)
         pipeline.connect_input('field_map_mag', fm_mag_reorient, 'in_file')
         fm_phase_reorient = pipeline.create_node(
             fsl.utils.Reorient2Std(), name='reorient_fm_phase',
             requirements=[fsl509_req])
+        fm_phase_reorient.inputs.output_type = fsl_output_type(compress=False)
         pipeline.connect_input('field_map_phase', fm_phase_reorient,
                                'in_file')
         bet = pipeline.create_node(BET(), name="bet", wall_time=5,
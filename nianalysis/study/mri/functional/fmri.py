@@ -23,7 +23,8 @@ from arcana.study.multi import (
     MultiStudy, SubStudySpec, MultiStudyMetaClass)
 from arcana.dataset import DatasetMatch
 from nipype.interfaces.afni.preprocess import BlurToFWHM
-from nianalysis.interfaces.custom.fmri import PrepareFIX
+from nianalysis.interfaces.custom.fmri import (
+    PrepareFIX, MIGP, FusedTemporalFilter)
 from nianalysis.interfaces.c3d import ANTs2FSLMatrixConversion
 import logging
 from arcana.exception import ArcanaNameError
@@ -74,7 +75,9 @@ class FunctionalMRIStudy(EPIStudy, metaclass=StudyMetaClass):
 
     add_switch_specs = [
         SwitchSpec('linear_reg_method', 'ants',
-                   choices=('flirt', 'spm', 'ants', 'epireg'))]
+                   choices=('flirt', 'spm', 'ants', 'epireg')),
+        SwitchSpec('rsfmri_filtering_method', 'afni',
+                   choices=('afni', 'fused'))]
 
     def rsfMRI_filtering_pipeline(self, **kwargs):
 
@@ -98,6 +101,21 @@ class FunctionalMRIStudy(EPIStudy, metaclass=StudyMetaClass):
         afni_mc.inputs.oned_file = 'prefiltered_func_data_mcf.par'
         pipeline.connect_input('preproc', afni_mc, 'in_file')
 
+        if self.branch('rsfmri_filtering_method', 'fused'):
+            # Filters, blurs and restores the mean in a single pass
+            filt = pipeline.create_node(
+                FusedTemporalFilter(), name='temporal_filter', wall_time=5,
+                memory=8000)
+            filt.inputs.stopband = (0, 0.01)
+            filt.inputs.polort = 3
+            filt.inputs.blur_fwhm = 3
+            pipeline.connect_input('tr', filt, 'tr')
+            pipeline.connect(afni_mc, 'out_file', filt, 'in_file')
+            pipeline.connect_input('brain_mask', filt, 'mask')
+            pipeline.connect_output('filtered_data', filt, 'out_file')
+            pipeline.connect_output('mc_par', afni_mc, 'oned_file')
+            return pipeline
+
         filt = pipeline.create_node(Tproject(), name='Tproject', wall_time=5,
                                     requirements=[afni_req])
         filt.inputs.stopband = (0, 0.01)
@@ -138,7 +156,7 @@ class FunctionalMRIStudy(EPIStudy, metaclass=StudyMetaClass):
             **kwargs)
 
         mel = pipeline.create_node(MELODIC(), name='melodic_L1', wall_time=15,
-                                   requirements=[fsl5_req])
+                                   nthreads=4, requirements=[fsl5_req])
         mel.inputs.no_bet = True
         pipeline.connect_input('brain_mask', mel, 'mask')
         mel.inputs.bg_threshold = self.parameter('brain_thresh_percent')
@@ -303,8 +321,8 @@ class FunctionalMRIStudy(EPIStudy, metaclass=StudyMetaClass):
         pipeline.connect_input('coreg_matrix', merge_trans, 'in3')
 
         apply_trans = pipeline.create_node(
-            ApplyTransforms(), name='ApplyTransform', wall_time=7,
-            memory=24000, requirements=[ants2_req])
+            ApplyTransforms(num_threads=4), name='ApplyTransform',
+            wall_time=7, memory=24000, nthreads=4, requirements=[ants2_req])
         ref_brain = self.parameter('MNI_template')
         apply_trans.inputs.reference_image = ref_brain
         apply_trans.inputs.interpolation = 'Linear'
@@ -345,7 +363,15 @@ class FunctionalMRIMixin(MultiStudy, metaclass=MultiStudyMetaClass):
         DatasetSpec('train_data', rfile_format, 'fix_training_pipeline',
                     frequency='per_project'),
         DatasetSpec('group_melodic', directory_format,
-                    'group_melodic_pipeline')]
+                    'group_melodic_pipeline', frequency='per_visit'),
+        DatasetSpec('group_pca', nifti_gz_format, 'group_pca_pipeline',
+                    frequency='per_visit')]
+
+    add_parameter_specs = [
+        ParameterSpec('group_pca_dim', 500)]
+
+    add_switch_specs = [
+        SwitchSpec('group_pca_reduction', False)]
 
     def fix_training_pipeline(self, **kwargs):
 
@@ -418,20 +444,56 @@ class FunctionalMRIMixin(MultiStudy, metaclass=MultiStudyMetaClass):
 
         return pipeline
 
+    def group_pca_pipeline(self, **kwargs):
+        """
+        Reduces the smoothed time-series of all subjects to a fixed number
+        of principal components with incremental group PCA (MIGP), which
+        streams in one subject at a time, so that group ICA runs in bounded
+        memory however large the cohort
+        """
+        pipeline = self.create_pipeline(
+            name='group_pca',
+            inputs=[DatasetSpec('smoothed_ts', nifti_gz_format)],
+            outputs=[DatasetSpec('group_pca', nifti_gz_format)],
+            desc=("Incremental group PCA"),
+            version=1,
+            citations=[fsl_cite],
+            **kwargs)
+        migp = pipeline.create_join_subjects_node(
+            MIGP(), joinfield=['in_files'], name='migp', wall_time=240,
+            memory=16000)
+        migp.inputs.dim = self.parameter('group_pca_dim')
+        migp.inputs.mask = self.parameter('MNI_template_mask')
+        pipeline.connect_input('smoothed_ts', migp, 'in_files')
+        pipeline.connect_output('group_pca', migp, 'out_file')
+        return pipeline
+
     def group_melodic_pipeline(self, **kwargs):
 
+        if self.branch('group_pca_reduction'):
+            # The components of the reduced data have no temporal order so
+            # the TR isn't required
+            inputs = [DatasetSpec('group_pca', nifti_gz_format)]
+        else:
+            inputs = [DatasetSpec('smoothed_ts', nifti_gz_format),
+                      FieldSpec('tr', float)]
         pipeline = self.create_pipeline(
             name='group_melodic',
-            inputs=[DatasetSpec('smoothed_ts', nifti_gz_format),
-                    FieldSpec('tr', float)],
+            inputs=inputs,
             outputs=[DatasetSpec('group_melodic', directory_format)],
             desc=("Group ICA"),
             version=1,
             citations=[fsl_cite],
             **kwargs)
-        gica = pipeline.create_join_subjects_node(
-            MELODIC(), joinfield=['in_files'], name='gica',
-            requirements=[fsl510_req], wall_time=7200)
+        if self.branch('group_pca_reduction'):
+            # The subjects have already been reduced to a single image
+            gica = pipeline.create_node(
+                MELODIC(), name='gica', requirements=[fsl510_req],
+                wall_time=720, nthreads=4)
+        else:
+            gica = pipeline.create_join_subjects_node(
+                MELODIC(), joinfield=['in_files'], name='gica',
+                requirements=[fsl510_req], wall_time=7200, nthreads=4)
         gica.inputs.no_bet = True
         gica.inputs.bg_threshold = self.parameter('brain_thresh_percent')
         gica.inputs.bg_image = self.parameter('MNI_template')
@@ -442,8 +504,11 @@ class FunctionalMRIMixin(MultiStudy, metaclass=MultiStudyMetaClass):
         gica.inputs.sep_vn = True
         gica.inputs.mask = self.parameter('MNI_template_mask')
         gica.inputs.out_dir = 'group_melodic.ica'
-        pipeline.connect_input('smoothed_ts', gica, 'in_files')
-        pipeline.connect_input('tr', gica, 'tr_sec')
+        if self.branch('group_pca_reduction'):
+            pipeline.connect_input('group_pca', gica, 'in_files')
+        else:
+            pipeline.connect_input('smoothed_ts', gica, 'in_files')
+            pipeline.connect_input('tr', gica, 'tr_sec')
 
         pipeline.connect_output('group_melodic', gica, 'out_dir')
 
@@ -1,14 +1,18 @@
+import math
 from nipype.interfaces.utility import Merge
 from nipype.interfaces.mrtrix3 import ResponseSD
 from nipype.interfaces.mrtrix3.utils import BrainMask, TensorMetrics
 from nipype.interfaces.mrtrix3.reconst import FitTensor, EstimateFOD
 from nianalysis.interfaces.mrtrix import (
-    DWIPreproc, MRCat, ExtractDWIorB0, MRMath, DWIBiasCorrect, DWIDenoise,
+    DWIPreproc, MRCat, ExtractDWIorB0, DWIBiasCorrect, DWIDenoise,
     MRCalc, DWIIntensityNorm, AverageResponse)
 from nipype.workflows.dmri.fsl.tbss import create_tbss_all
 from nianalysis.interfaces.noddi import (
-    CreateROI, BatchNODDIFitting, SaveParamsAsNIfTI)
+    CreateROI, BatchNODDIFitting, SaveParamsAsNIfTI, SplitROI,
+    MergeFittedParams)
 from nianalysis.interfaces.mrtrix import MRConvert, ExtractFSLGradients
+from nianalysis.interfaces.dti import FitDTI
+from nianalysis.interfaces.custom.dwi import ExtractMeanB0
 from arcana.interfaces.utils import MergeTuple, Chain
 from nipype.interfaces.utility import IdentityInterface
 from nianalysis.citation import (
@@ -38,8 +42,8 @@ class DiffusionStudy(EPIStudy, metaclass=StudyMetaClass):
                     desc="b0 image"),
         DatasetSpec('noise_residual', mrtrix_format, 'preproc_pipeline'),
         DatasetSpec('tensor', nifti_gz_format, 'tensor_pipeline'),
-        DatasetSpec('fa', nifti_gz_format, 'tensor_pipeline'),
-        DatasetSpec('adc', nifti_gz_format, 'tensor_pipeline'),
+        DatasetSpec('fa', nifti_gz_format, 'fa_pipeline'),
+        DatasetSpec('adc', nifti_gz_format, 'fa_pipeline'),
         DatasetSpec('wm_response', text_format, 'response_pipeline'),
         DatasetSpec('gm_response', text_format, 'response_pipeline'),
         DatasetSpec('csf_response', text_format, 'response_pipeline'),
@@ -79,7 +83,8 @@ class DiffusionStudy(EPIStudy, metaclass=StudyMetaClass):
         ParameterSpec('fsl_mask_f', 0.25),
         ParameterSpec('bet_robust', True),
         ParameterSpec('bet_f_threshold', 0.2),
-        ParameterSpec('bet_reduce_bias', False)]
+        ParameterSpec('bet_reduce_bias', False),
+        ParameterSpec('dti_nthreads', 1)]
 
     add_switch_specs = [
         SwitchSpec('preproc_denoise', False),
@@ -89,7 +94,8 @@ class DiffusionStudy(EPIStudy, metaclass=StudyMetaClass):
         SwitchSpec('brain_extract_method', 'mrtrix',
                    ('mrtrix', 'fsl')),
         SwitchSpec('bias_correct_method', 'ants',
-                   choices=('ants', 'fsl'))]
+                   choices=('ants', 'fsl')),
+        SwitchSpec('tensor_backend', 'mrtrix', ('mrtrix', 'numpy'))]
 
     @property
     def multi_tissue(self):
@@ -141,7 +147,9 @@ class DiffusionStudy(EPIStudy, metaclass=StudyMetaClass):
         # Denoise the dwi-scan
         if self.switch('preproc_denoise'):
             # Run denoising
-            denoise = pipeline.create_node(DWIDenoise(), name='denoise',
+            denoise = pipeline.create_node(DWIDenoise(nthreads=4),
+                                           name='denoise',
+                                           nthreads=4,
                                            requirements=[mrtrix3_req])
             denoise.inputs.out_file_ext = '.mif'
             # Calculate residual noise
@@ -152,8 +160,9 @@ class DiffusionStudy(EPIStudy, metaclass=StudyMetaClass):
             subtract.inputs.out_ext = '.mif'
             subtract.inputs.operation = 'subtract'
         dwipreproc = pipeline.create_node(
-            DWIPreproc(), name='dwipreproc',
-            requirements=[mrtrix3_req, fsl509_req], wall_time=60)
+            DWIPreproc(nthreads=4), name='dwipreproc',
+            requirements=[mrtrix3_req, fsl509_req], wall_time=60,
+            nthreads=4)
         dwipreproc.inputs.eddy_parameters = '--data_is_shelled '
         dwipreproc.inputs.no_clean_up = True
         dwipreproc.inputs.out_file_ext = '.nii.gz'
@@ -168,7 +177,7 @@ class DiffusionStudy(EPIStudy, metaclass=StudyMetaClass):
                 ExtractDWIorB0(), name='dwiextract',
                 requirements=[mrtrix3_req])
             dwiextract.inputs.bzero = True
-            dwiextract.inputs.out_ext = '.nii.gz'
+            dwiextract.inputs.out_ext = '.nii'
             # Get first b=0 from dwi b=0 volumes
             mrconvert = pipeline.create_node(MRConvert(), name="mrconvert",
                                              requirements=[mrtrix3_req])
@@ -178,6 +187,7 @@ class DiffusionStudy(EPIStudy, metaclass=StudyMetaClass):
                 MRCat(), name='mrcat', requirements=[mrtrix3_req])
             # Create node to assign the right PED to the diffusion
             prep_dwi = pipeline.create_node(PrepareDWI(), name='prepare_dwi')
+            prep_dwi.inputs.compress = False
             # Create preprocessing node
             dwipreproc.inputs.rpe_pair = True
             if self.parameter('preproc_pe_dir') is not None:
@@ -370,22 +380,43 @@ class DiffusionStudy(EPIStudy, metaclass=StudyMetaClass):
 
     def tensor_pipeline(self, **kwargs):  # @UnusedVariable
         """
-        Fits the apparrent diffusion tensor (DT) to each voxel of the image
+        Fits the apparrent diffusion tensor (DT) to each voxel of the image.
+        With the 'numpy' tensor backend the FA and ADC are calculated by the
+        same node, so this pipeline also generates them (see fa_pipeline).
         """
+        outputs = [DatasetSpec('tensor', nifti_gz_format)]
+        if self.branch('tensor_backend', 'numpy'):
+            outputs.extend([DatasetSpec('fa', nifti_gz_format),
+                            DatasetSpec('adc', nifti_gz_format)])
         pipeline = self.create_pipeline(
             name='tensor',
             inputs=[DatasetSpec('bias_correct', nifti_gz_format),
                     DatasetSpec('grad_dirs', fsl_bvecs_format),
                     DatasetSpec('bvalues', fsl_bvals_format),
                     DatasetSpec('brain_mask', nifti_gz_format)],
-            outputs=[DatasetSpec('tensor', nifti_gz_format)],
+            outputs=outputs,
             desc=("Estimates the apparent diffusion tensor in each "
                   "voxel"),
             version=1,
             citations=[],
             **kwargs)
+        if self.branch('tensor_backend', 'numpy'):
+            nthreads = self.parameter('dti_nthreads')
+            fit = pipeline.create_node(FitDTI(), name='fit_dti',
+                                       nthreads=nthreads, memory=4000)
+            fit.inputs.nthreads = nthreads
+            pipeline.connect_input('bias_correct', fit, 'in_file')
+            pipeline.connect_input('grad_dirs', fit, 'bvecs')
+            pipeline.connect_input('bvalues', fit, 'bvals')
+            pipeline.connect_input('brain_mask', fit, 'in_mask')
+            pipeline.connect_output('tensor', fit, 'tensor')
+            pipeline.connect_output('fa', fit, 'fa')
+            pipeline.connect_output('adc', fit, 'adc')
+            return pipeline
         # Create tensor fit node
-        dwi2tensor = pipeline.create_node(FitTensor(), name='dwi2tensor')
+        dwi2tensor = pipeline.create_node(FitTensor(nthreads=4),
+                                          name='dwi2tensor',
+                                          nthreads=4)
         dwi2tensor.inputs.out_file = 'dti.nii.gz'
         # Gradient merge node
         fsl_grads = pipeline.create_node(MergeTuple(2), name="fsl_grads")
@@ -403,8 +434,13 @@ class DiffusionStudy(EPIStudy, metaclass=StudyMetaClass):
 
     def fa_pipeline(self, **kwargs):  # @UnusedVariable
         """
-        Fits the apparrent diffusion tensor (DT) to each voxel of the image
+        Calculates the FA and ADC from the apparent diffusion tensor (DT).
+        With the 'numpy' tensor backend they are generated by the tensor
+        pipeline, from the same fit as the tensor, instead of being read
+        back from the tensor image.
         """
+        if self.branch('tensor_backend', 'numpy'):
+            return self.tensor_pipeline(**kwargs)
         pipeline = self.create_pipeline(
             name='fa',
             inputs=[DatasetSpec('tensor', nifti_gz_format),
@@ -455,7 +491,9 @@ class DiffusionStudy(EPIStudy, metaclass=StudyMetaClass):
             citations=[mrtrix_cite],
             **kwargs)
         # Create fod fit node
-        response = pipeline.create_node(ResponseSD(), name='response',
+        response = pipeline.create_node(ResponseSD(nthreads=4),
+                                        name='response',
+                                        nthreads=4,
                                         requirements=[mrtrix3_req])
         response.inputs.algorithm = self.switch('response_algorithm')
         # Gradient merge node
@@ -572,7 +610,9 @@ class DiffusionStudy(EPIStudy, metaclass=StudyMetaClass):
             **kwargs)
 
         # Create fod fit node
-        dwi2fod = pipeline.create_node(EstimateFOD(), name='dwi2fod',
+        dwi2fod = pipeline.create_node(EstimateFOD(nthreads=4),
+                                       name='dwi2fod',
+                                       nthreads=4,
                                        requirements=[mrtrix3_req])
         dwi2fod.inputs.algorithm = algorithm
         # Gradient merge node
@@ -635,43 +675,20 @@ class DiffusionStudy(EPIStudy, metaclass=StudyMetaClass):
         pipeline = self.create_pipeline(
             name='extract_b0',
             inputs=[DatasetSpec('bias_correct', nifti_gz_format),
-                    DatasetSpec('grad_dirs', fsl_bvecs_format),
                     DatasetSpec('bvalues', fsl_bvals_format)],
             outputs=[DatasetSpec('b0', nifti_gz_format)],
             desc="Extract b0 image from a DWI study",
             version=1,
-            citations=[mrtrix_cite],
+            citations=[],
             **kwargs)
-        # Gradient merge node
-        fsl_grads = pipeline.create_node(MergeTuple(2), name="fsl_grads")
-        # Extraction node
-        extract_b0s = pipeline.create_node(
-            ExtractDWIorB0(), name='extract_b0s',
-            requirements=[mrtrix3_req])
-        extract_b0s.inputs.bzero = True
-        extract_b0s.inputs.quiet = True
         # FIXME: Need a registration step before the mean
-        # Mean calculation node
-        mean = pipeline.create_node(MRMath(), name="mean",
-                                    requirements=[mrtrix3_req])
-        mean.inputs.axis = 3
-        mean.inputs.operation = 'mean'
-        mean.inputs.quiet = True
-        # Convert to Nifti
-        mrconvert = pipeline.create_node(MRConvert(), name="output_conversion",
-                                         requirements=[mrtrix3_req])
-        mrconvert.inputs.out_ext = '.nii.gz'
-        mrconvert.inputs.quiet = True
+        # Extracts and averages the b0 volumes in a single pass
+        extract_b0 = pipeline.create_node(ExtractMeanB0(), name='extract_b0')
         # Connect inputs
-        pipeline.connect_input('bias_correct', extract_b0s, 'in_file')
-        pipeline.connect_input('grad_dirs', fsl_grads, 'in1')
-        pipeline.connect_input('bvalues', fsl_grads, 'in2')
-        # Connect between nodes
-        pipeline.connect(extract_b0s, 'out_file', mean, 'in_files')
-        pipeline.connect(fsl_grads, 'out', extract_b0s, 'grad_fsl')
-        pipeline.connect(mean, 'out_file', mrconvert, 'in_file')
+        pipeline.connect_input('bias_correct', extract_b0, 'in_file')
+        pipeline.connect_input('bvalues', extract_b0, 'bvals')
         # Connect outputs
-        pipeline.connect_output('b0', mrconvert, 'out_file')
+        pipeline.connect_output('b0', extract_b0, 'out_file')
         pipeline.assert_connected()
         # Check inputs/outputs are connected
         return pipeline
@@ -731,7 +748,8 @@ class NODDIStudy(DiffusionStudy, metaclass=StudyMetaClass):
         DatasetSpec('error_code', nifti_format, 'noddi_fitting_pipeline')]
 
     add_parameter_specs = [ParameterSpec('noddi_model',
-                                   'WatsonSHStickTortIsoV_B0')]
+                                   'WatsonSHStickTortIsoV_B0'),
+                           ParameterSpec('noddi_chunk_size', 5000)]
 
     add_switch_specs = [
         SwitchSpec('single_slice', False)]
@@ -775,17 +793,24 @@ class NODDIStudy(DiffusionStudy, metaclass=StudyMetaClass):
             (for testing)
         noddi_model: Str
             Name of the NODDI model to use for the fitting
-        nthreads: Int
-            Number of processes to use
+        noddi_chunk_size: Int
+            Number of voxels in each chunk of the ROI. The chunks are fitted
+            as independent jobs (so can be spread across a cluster) and
+            merged afterwards. As each chunk is cached in its own map-node
+            directory, a killed or timed-out run only refits the chunks that
+            hadn't finished.
         """
         pipeline_name = 'noddi_fitting'
-        inputs = [DatasetSpec('bias_correct', nifti_gz_format),
+        # The images are requested as uncompressed NIfTI, as required by the
+        # NODDI toolbox, so they are converted in a single step on input
+        inputs = [DatasetSpec('bias_correct', nifti_format),
                   DatasetSpec('grad_dirs', fsl_bvecs_format),
                   DatasetSpec('bvalues', fsl_bvals_format)]
         if self.switch('single_slice'):
-            inputs.append(DatasetSpec('eroded_mask', nifti_gz_format))
+            mask_name = 'eroded_mask'
         else:
-            inputs.append(DatasetSpec('brain_mask', nifti_gz_format))
+            mask_name = 'brain_mask'
+        inputs.append(DatasetSpec(mask_name, nifti_format))
         pipeline = self.create_pipeline(
             name=pipeline_name,
             inputs=inputs,
@@ -803,47 +828,47 @@ class NODDIStudy(DiffusionStudy, metaclass=StudyMetaClass):
                 "performed"),
             citations=[noddi_cite],
             **kwargs)
-        # Create node to unzip the nifti files
-        unzip_bias_correct = pipeline.create_node(
-            MRConvert(), name="unzip_bias_correct",
-            requirements=[mrtrix3_req])
-        unzip_bias_correct.inputs.out_ext = 'nii'
-        unzip_bias_correct.inputs.quiet = True
-        unzip_mask = pipeline.create_node(MRConvert(), name="unzip_mask",
-                                          requirements=[mrtrix3_req])
-        unzip_mask.inputs.out_ext = 'nii'
-        unzip_mask.inputs.quiet = True
         # Create create-roi node
         create_roi = pipeline.create_node(
             CreateROI(), name='create_roi',
             requirements=[noddi_req, matlab2015_req],
             memory=4000)
-        pipeline.connect(unzip_bias_correct, 'out_file', create_roi, 'in_file')
-        pipeline.connect(unzip_mask, 'out_file', create_roi, 'brain_mask')
-        # Create batch-fitting node
-        batch_fit = pipeline.create_node(
-            BatchNODDIFitting(), name="batch_fit",
-            requirements=[noddi_req, matlab2015_req], wall_time=180,
-            memory=8000)
+        # Split the ROI into chunks of voxels to be fitted independently
+        chunk_size = self.parameter('noddi_chunk_size')
+        split_roi = pipeline.create_node(
+            SplitROI(), name='split_roi',
+            requirements=[matlab2015_req], memory=4000)
+        split_roi.inputs.chunk_size = chunk_size
+        pipeline.connect(create_roi, 'out_file', split_roi, 'roi_file')
+        # Create batch-fitting node, the chunks are run as separate jobs so
+        # each chunk is fitted by a single worker. The wall time allows up to
+        # 2 s per voxel, plus half an hour to start MATLAB and load the data
+        batch_fit = pipeline.create_map_node(
+            BatchNODDIFitting(), name="batch_fit", iterfield=['roi_file'],
+            requirements=[noddi_req, matlab2015_req],
+            wall_time=30 + int(math.ceil(chunk_size * 2 / 60.0)),
+            memory=4000)
         batch_fit.inputs.model = self.parameter('noddi_model')
-        batch_fit.inputs.nthreads = self.runner.num_processes
-        pipeline.connect(create_roi, 'out_file', batch_fit, 'roi_file')
+        batch_fit.inputs.nthreads = 1
+        pipeline.connect(split_roi, 'out_files', batch_fit, 'roi_file')
+        # Merge the parameters fitted for each chunk
+        merge_params = pipeline.create_node(
+            MergeFittedParams(), name='merge_params',
+            requirements=[matlab2015_req], memory=4000)
+        pipeline.connect(batch_fit, 'out_file', merge_params, 'in_files')
         # Create output node
         save_params = pipeline.create_node(
             SaveParamsAsNIfTI(), name="save_params",
             requirements=[noddi_req, matlab2015_req],
             memory=4000)
         save_params.inputs.output_prefix = 'params'
-        pipeline.connect(batch_fit, 'out_file', save_params, 'params_file')
+        pipeline.connect(merge_params, 'out_file', save_params,
+                         'params_file')
         pipeline.connect(create_roi, 'out_file', save_params, 'roi_file')
-        pipeline.connect(unzip_mask, 'out_file', save_params,
-                         'brain_mask_file')
         # Connect inputs
-        pipeline.connect_input('bias_correct', unzip_bias_correct, 'in_file')
-        if not pipeline.switch('single_slice'):
-            pipeline.connect_input('eroded_mask', unzip_mask, 'in_file')
-        else:
-            pipeline.connect_input('brain_mask', unzip_mask, 'in_file')
+        pipeline.connect_input('bias_correct', create_roi, 'in_file')
+        pipeline.connect_input(mask_name, create_roi, 'brain_mask')
+        pipeline.connect_input(mask_name, save_params, 'brain_mask_file')
         pipeline.connect_input('grad_dirs', batch_fit, 'bvecs_file')
         pipeline.connect_input('bvalues', batch_fit, 'bvals_file')
         # Connect outputs
@@ -47,9 +47,9 @@ class T1Study(MRIStudy, metaclass=StudyMetaClass):
         # FS ReconAll node
         recon_all = pipeline.create_node(
             interface=ReconAll(), name='recon_all',
-            requirements=[freesurfer_req], wall_time=2000)
+            requirements=[freesurfer_req], wall_time=2000, nthreads=4)
         recon_all.inputs.directive = 'all'
-        recon_all.inputs.openmp = self.runner.num_processes
+        recon_all.inputs.openmp = 4
         # Wrapper around os.path.join
         join = pipeline.create_node(interface=JoinPath(), name='join')
         pipeline.connect(recon_all, 'subjects_dir', join, 'dirname')
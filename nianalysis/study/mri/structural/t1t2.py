@@ -1,4 +1,5 @@
 from nipype.interfaces.fsl import ApplyMask
+from nianalysis.output_policy import fsl_output_type, connect_gzipped_output
 from nianalysis.file_format import (
     nifti_gz_format, freesurfer_recon_all_format, text_matrix_format)
 from arcana.dataset import DatasetSpec
@@ -110,11 +111,11 @@ class T1T2Study(MultiStudy, metaclass=MultiStudyMetaClass):
         # Create apply mask node
         apply_mask = pipeline.create_node(
             ApplyMask(), name='appy_mask', requirements=[fsl5_req])
-        apply_mask.inputs.output_type = 'NIFTI_GZ'
+        apply_mask.inputs.output_type = fsl_output_type(compress=False)
         # Connect inputs
         pipeline.connect_input('t1', apply_mask, 'in_file')
         pipeline.connect_input('brain_mask', apply_mask, 'mask_file')
         # Connect outputs
-        pipeline.connect_output('t1_brain', apply_mask, 'out_file')
+        connect_gzipped_output(pipeline, 't1_brain', apply_mask, 'out_file')
         # Check and return
         return pipeline
@@ -1,4 +1,5 @@
 from nianalysis.requirement import fsl5_req, matlab2015_req
+from nianalysis.output_policy import fsl_output_type, connect_gzipped_output
 from nianalysis.citation import (
     fsl_cite, matlab_cite, sti_cites)
 from nianalysis.file_format import directory_format, nifti_gz_format
@@ -61,7 +62,7 @@ class T2StarStudy(MRIStudy, metaclass=StudyMetaClass):
                                     requirements=[fsl5_req],
                                     wall_time=30, memory=8000)
         mask.inputs.reduce_bias = True
-        mask.inputs.output_type = 'NIFTI_GZ'
+        mask.inputs.output_type = fsl_output_type(compress=False)
         mask.inputs.frac = 0.3
         mask.inputs.mask = True
 
@@ -72,7 +73,7 @@ class T2StarStudy(MRIStudy, metaclass=StudyMetaClass):
 
         # Connect inputs/outputs
         pipeline.connect_input('coils', prepare, 'in_dir')
-        pipeline.connect_output('qsm_mask', mask, 'mask_file')
+        connect_gzipped_output(pipeline, 'qsm_mask', mask, 'mask_file')
         pipeline.connect_output('qsm', qsmrecon, 'qsm')
         pipeline.connect_output('tissue_phase', qsmrecon, 'tissue_phase')
         pipeline.connect_output('tissue_mask', qsmrecon, 'tissue_mask')
@@ -165,7 +166,7 @@ class T2StarStudy(MRIStudy, metaclass=StudyMetaClass):
                                     requirements=[fsl5_req],
                                     wall_time=30, memory=8000)
         mask.inputs.reduce_bias = True
-        mask.inputs.output_type = 'NIFTI_GZ'
+        mask.inputs.output_type = fsl_output_type(compress=False)
         mask.inputs.frac = 0.3
         mask.inputs.mask = True
 
@@ -176,7 +177,7 @@ class T2StarStudy(MRIStudy, metaclass=StudyMetaClass):
 
         # Connect inputs/outputs
         pipeline.connect_input('coils', prepare, 'in_dir')
-        pipeline.connect_output('qsm_mask', mask, 'mask_file')
+        connect_gzipped_output(pipeline, 'qsm_mask', mask, 'mask_file')
         pipeline.connect_output('qsm', qsmrecon, 'qsm')
         pipeline.connect_output('tissue_phase', qsmrecon, 'tissue_phase')
         pipeline.connect_output('tissue_mask', qsmrecon, 'tissue_mask')
@@ -10,6 +10,7 @@ from nipype.interfaces.utility.base import Select
 from nianalysis.interfaces.umap_calc import CoreUmapCalc
 from nianalysis.interfaces.converters import Nii2Dicom
 from nianalysis.interfaces.mrtrix.utils import MRConvert
+from nianalysis.output_policy import fsl_output_type, connect_gzipped_output
 from arcana.interfaces.utils import (
     CopyToDir, ListDir, dicom_fname_sort_key)
 from arcana.study.multi import (
@@ -93,13 +94,15 @@ class UTEStudy(MRIStudy, metaclass=StudyMetaClass):
             citations=(fsl_cite),
             **kwargs)
 
+        # Intermediate images are left uncompressed as gzipping them only
+        # adds time
         echo1_conv = pipeline.create_node(MRConvert(), name='echo1_conv')
-        echo1_conv.inputs.out_ext = '.nii.gz'
+        echo1_conv.inputs.out_ext = '.nii'
 
         pipeline.connect_input('ute_echo1', echo1_conv, 'in_file')
 
         echo2_conv = pipeline.create_node(MRConvert(), name='echo2_conv')
-        echo2_conv.inputs.out_ext = '.nii.gz'
+        echo2_conv.inputs.out_ext = '.nii'
 
         pipeline.connect_input('ute_echo2', echo2_conv, 'in_file')
 
@@ -115,7 +118,7 @@ class UTEStudy(MRIStudy, metaclass=StudyMetaClass):
             'in_file')
 
         registration.inputs.reference = self.template_path
-        registration.inputs.output_type = 'NIFTI_GZ'
+        registration.inputs.output_type = fsl_output_type(compress=False)
         registration.inputs.searchr_x = [-180, 180]
         registration.inputs.searchr_y = [-180, 180]
         registration.inputs.searchr_z = [-180, 180]
@@ -148,17 +151,19 @@ class UTEStudy(MRIStudy, metaclass=StudyMetaClass):
             transform_ute2,
             'in_file')
 
-        transform_ute2.inputs.output_type = 'NIFTI_GZ'
+        transform_ute2.inputs.output_type = fsl_output_type(compress=False)
         transform_ute2.inputs.reference = self.template_path
         transform_ute2.inputs.apply_xfm = True
 
         # Connect outputs
-        pipeline.connect_output('ute1_registered', registration, 'out_file')
+        connect_gzipped_output(pipeline, 'ute1_registered', registration,
+                               'out_file')
         pipeline.connect_output(
             'ute_to_template_mat',
             registration,
             'out_matrix_file')
-        pipeline.connect_output('ute2_registered', transform_ute2, 'out_file')
+        connect_gzipped_output(pipeline, 'ute2_registered', transform_ute2,
+                               'out_file')
         pipeline.connect_output('template_to_ute_mat', convert_mat, 'out_file')
         pipeline.assert_connected()
 
@@ -223,7 +228,7 @@ class UTEStudy(MRIStudy, metaclass=StudyMetaClass):
             Threshold(), name='bones_probabilistic_map_thresholding',
             requirements=[fsl5_req], wall_time=5)
         pipeline.connect(select_bones_pm, 'out', threshold_bones, 'in_file')
-        threshold_bones.inputs.output_type = "NIFTI_GZ"
+        threshold_bones.inputs.output_type = fsl_output_type(compress=False)
         threshold_bones.inputs.direction = 'below'
         threshold_bones.inputs.thresh = 0.2
 
@@ -235,14 +240,14 @@ class UTEStudy(MRIStudy, metaclass=StudyMetaClass):
             'out_file',
             binarize_bones,
             'in_file')
-        binarize_bones.inputs.output_type = "NIFTI_GZ"
+        binarize_bones.inputs.output_type = fsl_output_type(compress=False)
         binarize_bones.inputs.operation = 'bin'
 
         threshold_air = pipeline.create_node(
             Threshold(), name='air_probabilistic_maps_thresholding',
             requirements=[fsl5_req], wall_time=5)
         pipeline.connect(select_air_pm, 'out', threshold_air, 'in_file')
-        threshold_air.inputs.output_type = "NIFTI_GZ"
+        threshold_air.inputs.output_type = fsl_output_type(compress=False)
         threshold_air.inputs.direction = 'below'
         threshold_air.inputs.thresh = 0.1
 
@@ -250,11 +255,12 @@ class UTEStudy(MRIStudy, metaclass=StudyMetaClass):
             UnaryMaths(), name='air_probabilistic_map_binarization',
             requirements=[fsl5_req], wall_time=5)
         pipeline.connect(threshold_air, 'out_file', binarize_air, 'in_file')
-        binarize_air.inputs.output_type = "NIFTI_GZ"
+        binarize_air.inputs.output_type = fsl_output_type(compress=False)
         binarize_air.inputs.operation = 'bin'
 
-        pipeline.connect_output('bones_mask', binarize_bones, 'out_file')
-        pipeline.connect_output('air_mask', binarize_air, 'out_file')
+        connect_gzipped_output(pipeline, 'bones_mask', binarize_bones,
+                               'out_file')
+        connect_gzipped_output(pipeline, 'air_mask', binarize_air, 'out_file')
         pipeline.assert_connected()
 
         return pipeline
@@ -317,12 +323,14 @@ class UTEStudy(MRIStudy, metaclass=StudyMetaClass):
             citations=(matlab_cite),
             **kwargs)
 
+        # Intermediate images are left uncompressed as gzipping them only
+        # adds time
         echo1_conv = pipeline.create_node(MRConvert(), name='echo1_conv')
-        echo1_conv.inputs.out_ext = '.nii.gz'
+        echo1_conv.inputs.out_ext = '.nii'
         pipeline.connect_input('ute_echo1', echo1_conv, 'in_file')
 
         umap_conv = pipeline.create_node(MRConvert(), name='umap_conv')
-        umap_conv.inputs.out_ext = '.nii.gz'
+        umap_conv.inputs.out_ext = '.nii'
         pipeline.connect_input('umap_ute', umap_conv, 'in_file')
 
         zero_template_mask = pipeline.create_node(
@@ -334,7 +342,7 @@ class UTEStudy(MRIStudy, metaclass=StudyMetaClass):
             'in_file')
         zero_template_mask.inputs.operation = "mul"
         zero_template_mask.inputs.operand_value = 0
-        zero_template_mask.inputs.output_type = 'NIFTI_GZ'
+        zero_template_mask.inputs.output_type = fsl_output_type(compress=False)
 
         region_template_mask = pipeline.create_node(
             FLIRT(), name='region_template_mask',
@@ -342,7 +350,8 @@ class UTEStudy(MRIStudy, metaclass=StudyMetaClass):
         region_template_mask.inputs.apply_xfm = True
         region_template_mask.inputs.bgvalue = 1
         region_template_mask.inputs.interp = 'nearestneighbour'
-        region_template_mask.inputs.output_type = 'NIFTI_GZ'
+        region_template_mask.inputs.output_type = fsl_output_type(
+            compress=False)
         pipeline.connect(
             zero_template_mask,
             'out_file',
@@ -361,7 +370,7 @@ class UTEStudy(MRIStudy, metaclass=StudyMetaClass):
                                             requirements=[fsl5_req],
                                             wall_time=3)
         fill_in_umap.inputs.op_string = "-mul %s "
-        fill_in_umap.inputs.output_type = 'NIFTI_GZ'
+        fill_in_umap.inputs.output_type = fsl_output_type(compress=False)
         pipeline.connect(region_template_mask, 'out_file',
                          fill_in_umap, 'in_file')
         pipeline.connect(
@@ -384,7 +393,7 @@ class UTEStudy(MRIStudy, metaclass=StudyMetaClass):
                                'in_file')
         sute_fix_ute_space.inputs.apply_xfm = True
         sute_fix_ute_space.inputs.bgvalue = 0
-        sute_fix_ute_space.inputs.output_type = 'NIFTI_GZ'
+        sute_fix_ute_space.inputs.output_type = fsl_output_type(compress=False)
 
         sute_cont_ute_space = pipeline.create_node(
             FLIRT(), name='sute_cont_ute_space',
@@ -400,7 +409,8 @@ class UTEStudy(MRIStudy, metaclass=StudyMetaClass):
                                'in_file')
         sute_cont_ute_space.inputs.apply_xfm = True
         sute_cont_ute_space.inputs.bgvalue = 0
-        sute_cont_ute_space.inputs.output_type = 'NIFTI_GZ'
+        sute_cont_ute_space.inputs.output_type = fsl_output_type(
+            compress=False)
 
         sute_fix_ute_background = pipeline.create_node(
             MultiImageMaths(), name='sute_fix_ute_background',
@@ -411,7 +421,8 @@ class UTEStudy(MRIStudy, metaclass=StudyMetaClass):
             sute_fix_ute_background,
             'in_file')
         sute_fix_ute_background.inputs.op_string = "-add %s "
-        sute_fix_ute_background.inputs.output_type = 'NIFTI_GZ'
+        sute_fix_ute_background.inputs.output_type = fsl_output_type(
+            compress=False)
         pipeline.connect(
             fill_in_umap,
             'out_file',
@@ -427,7 +438,8 @@ class UTEStudy(MRIStudy, metaclass=StudyMetaClass):
             sute_cont_ute_background,
             'in_file')
         sute_cont_ute_background.inputs.op_string = "-add %s "
-        sute_cont_ute_background.inputs.output_type = 'NIFTI_GZ'
+        sute_cont_ute_background.inputs.output_type = fsl_output_type(
+            compress=False)
         pipeline.connect(
             fill_in_umap,
             'out_file',
@@ -438,6 +450,7 @@ class UTEStudy(MRIStudy, metaclass=StudyMetaClass):
             Smooth(), name='smooth_sute_fix',
             requirements=[fsl5_req], wall_time=5)
         smooth_sute_fix.inputs.sigma = 2.
+        smooth_sute_fix.inputs.output_type = fsl_output_type(compress=False)
         pipeline.connect(
             sute_fix_ute_background,
             'out_file',
@@ -448,16 +461,17 @@ class UTEStudy(MRIStudy, metaclass=StudyMetaClass):
             Smooth(), name='smooth_sute_cont',
             requirements=[fsl5_req], wall_time=5)
         smooth_sute_cont.inputs.sigma = 2.
+        smooth_sute_cont.inputs.output_type = fsl_output_type(compress=False)
         pipeline.connect(
             sute_cont_ute_background,
             'out_file',
             smooth_sute_cont,
             'in_file')
 
-        pipeline.connect_output('sute_fix_ute', smooth_sute_fix,
-                                'smoothed_file')
-        pipeline.connect_output('sute_cont_ute', smooth_sute_cont,
-                                'smoothed_file')
+        connect_gzipped_output(pipeline, 'sute_fix_ute', smooth_sute_fix,
+                               'smoothed_file')
+        connect_gzipped_output(pipeline, 'sute_cont_ute', smooth_sute_cont,
+                               'smoothed_file')
         pipeline.assert_connected()
 
         return pipeline
@@ -15,6 +15,7 @@ from nianalysis.study.mri.structural.t2 import T2Study
 from nipype.interfaces.utility import Merge
 from nianalysis.study.mri.structural.diffusion import DiffusionStudy
 from nianalysis.requirement import fsl509_req, mrtrix3_req, ants2_req
+from nianalysis.output_policy import fsl_output_type
 from arcana.exception import ArcanaNameError
 from arcana.dataset import DatasetMatch
 import logging
@@ -25,7 +26,8 @@ from nianalysis.interfaces.custom.pet import (
 from arcana.parameter import ParameterSpec, SwitchSpec
 import os
 from nianalysis.interfaces.converters import Nii2Dicom
-from arcana.interfaces.utils import CopyToDir, ListDir, dicom_fname_sort_key
+from arcana.interfaces.utils import ListDir, dicom_fname_sort_key
+from nianalysis.interfaces.utils import GatherToDir, GzipImage
 from nipype.interfaces.fsl.preprocess import FLIRT
 import nipype.interfaces.fsl as fsl
 from nipype.interfaces.fsl.utils import ImageMaths
@@ -144,7 +146,18 @@ class MotionDetectionMixin(MultiStudy, metaclass=MultiStudyMetaClass):
                         ParameterSpec('crop_zmin', 20),
                         ParameterSpec('crop_zsize', 100),
                         ParameterSpec('PET2MNI_reg', False),
-                        ParameterSpec('dynamic_pet_mc', False)]
+                        ParameterSpec('dynamic_pet_mc', False),
+                        ParameterSpec('md_records_dir', '')]
+
+    @classmethod
+    def motion_dependent_outputs(cls):
+        """
+        The names of the session-level outputs that are derived from the
+        motion estimates of the scans (i.e. that need to be regenerated when
+        scans are added to the session)
+        """
+        return [s.name for s in cls.add_data_specs
+                if s.derived and s.pipeline_name != 'prepare_pet_pipeline']
 
     def mean_displacement_pipeline(self, **kwargs):
         inputs = [DatasetSpec('ref_brain', nifti_gz_format)]
@@ -214,6 +227,10 @@ class MotionDetectionMixin(MultiStudy, metaclass=MultiStudyMetaClass):
         md = pipeline.create_node(MeanDisplacementCalculation(),
                                   name='scan_time_info')
         md.inputs.input_names = input_names
+        if self.parameter('md_records_dir'):
+            # Only scans that haven't been processed in a previous run are
+            # processed (see clear_motion_detection_outputs)
+            md.inputs.records_dir = self.parameter('md_records_dir')
         pipeline.connect(merge_motion_mats, 'out', md, 'motion_mats')
         pipeline.connect(merge_tr, 'out', md, 'trs')
         pipeline.connect(merge_start_time, 'out', md, 'start_times')
@@ -408,7 +425,7 @@ class MotionDetectionMixin(MultiStudy, metaclass=MultiStudyMetaClass):
 #         nii2dicom.inputs.extension = 'Frame'
         list_dicoms = pipeline.create_node(ListDir(), name='list_dicoms')
         list_dicoms.inputs.sort_key = dicom_fname_sort_key
-        copy2dir = pipeline.create_node(CopyToDir(), name='copy2dir')
+        copy2dir = pipeline.create_node(GatherToDir(), name='copy2dir')
         copy2dir.inputs.extension = 'Frame'
         # Connect nodes
         pipeline.connect(list_niftis, 'files', reorient_niftis, 'niftis')
@@ -513,7 +530,7 @@ class MotionDetectionMixin(MultiStudy, metaclass=MultiStudyMetaClass):
             pipeline.connect_input(
                 dataset.name, merge_inputs, 'in{}'.format(i))
 
-        copy2dir = pipeline.create_node(CopyToDir(), name='copy2dir')
+        copy2dir = pipeline.create_node(GatherToDir(), name='copy2dir')
         pipeline.connect(merge_inputs, 'out', copy2dir, 'in_files')
 
         pipeline.connect_output('motion_detection_output', copy2dir, 'out_dir')
@@ -590,6 +607,8 @@ class MotionDetectionMixin(MultiStudy, metaclass=MultiStudyMetaClass):
                 PetImageMotionCorrection(), name='pet_mc',
                 requirements=[fsl509_req], iterfield=['pet_image',
                                                       'motion_mat'])
+        # Only consumed by the merge/static image generation nodes
+        pet_mc.inputs.compress = False
         pipeline.connect(check_pet, 'pet_images', pet_mc, 'pet_image')
         pipeline.connect(check_pet, 'motion_mats', pet_mc, 'motion_mat')
         pipeline.connect(check_pet, 'pet2ref_mat', pet_mc, 'pet2ref_mat')
@@ -609,6 +628,9 @@ class MotionDetectionMixin(MultiStudy, metaclass=MultiStudyMetaClass):
             merge_no_mc = pipeline.create_node(
                 fsl.Merge(), name='merge_pet_no_mc', requirements=[fsl509_req])
             merge_no_mc.inputs.dimension = 't'
+            # Gzipped by GzipImage nodes below if gathered into the outputs
+            merge_mc.inputs.output_type = fsl_output_type(compress=False)
+            merge_no_mc.inputs.output_type = fsl_output_type(compress=False)
             pipeline.connect(pet_mc, 'pet_mc_image', merge_mc, 'in_files')
             pipeline.connect(pet_mc, 'pet_no_mc_image', merge_no_mc,
                              'in_files')
@@ -616,6 +638,8 @@ class MotionDetectionMixin(MultiStudy, metaclass=MultiStudyMetaClass):
             static_mc = pipeline.create_node(
                 StaticPETImageGeneration(), name='static_mc_generation',
                 requirements=[fsl509_req])
+            # Only gathered into the outputs directly if not cropped
+            static_mc.inputs.compress = StructAlignment
             pipeline.connect(pet_mc, 'pet_mc_image', static_mc,
                              'pet_mc_images')
             pipeline.connect(pet_mc, 'pet_no_mc_image', static_mc,
@@ -625,6 +649,7 @@ class MotionDetectionMixin(MultiStudy, metaclass=MultiStudyMetaClass):
         if not StructAlignment:
             cropping = pipeline.create_node(
                 PETFovCropping(), name='pet_cropping')
+            cropping.inputs.compress = True
             cropping.inputs.x_min = self.parameter('crop_xmin')
             cropping.inputs.x_size = self.parameter('crop_xsize')
             cropping.inputs.y_min = self.parameter('crop_ymin')
@@ -639,6 +664,7 @@ class MotionDetectionMixin(MultiStudy, metaclass=MultiStudyMetaClass):
 
             cropping_no_mc = pipeline.create_node(
                 PETFovCropping(), name='pet_no_mc_cropping')
+            cropping_no_mc.inputs.compress = True
             cropping_no_mc.inputs.x_min = self.parameter('crop_xmin')
             cropping_no_mc.inputs.x_size = self.parameter('crop_xsize')
             cropping_no_mc.inputs.y_min = self.parameter('crop_ymin')
@@ -658,12 +684,14 @@ class MotionDetectionMixin(MultiStudy, metaclass=MultiStudyMetaClass):
                         ImageMaths(), requirements=[fsl509_req],
                         name='PET_temporal_mean')
                     t_mean.inputs.op_string = '-Tmean'
+                    t_mean.inputs.output_type = fsl_output_type(
+                        compress=False)
                     pipeline.connect(cropping, 'pet_cropped', t_mean,
                                      'in_file')
                 reg_tmean2MNI = pipeline.create_node(
                     AntsRegSyn(num_dimensions=3, transformation='s',
                                out_prefix='reg2MNI', num_threads=4),
-                    name='reg2MNI', wall_time=25,
+                    name='reg2MNI', wall_time=25, nthreads=4,
                     requirements=[ants2_req])
                 reg_tmean2MNI.inputs.ref_file = self.parameter(
                     'PET_template_MNI')
@@ -678,8 +706,9 @@ class MotionDetectionMixin(MultiStudy, metaclass=MultiStudyMetaClass):
                     pipeline.connect(reg_tmean2MNI, 'regmat', merge_trans,
                                      'in2')
                     apply_trans = pipeline.create_node(
-                        ApplyTransforms(), name='apply_trans', wall_time=7,
-                        memory=24000, requirements=[ants2_req])
+                        ApplyTransforms(num_threads=4), name='apply_trans',
+                        wall_time=7,
+                        memory=24000, nthreads=4, requirements=[ants2_req])
                     apply_trans.inputs.reference_image = self.parameter(
                         'PET_template_MNI')
                     apply_trans.inputs.interpolation = 'Linear'
@@ -701,9 +730,15 @@ class MotionDetectionMixin(MultiStudy, metaclass=MultiStudyMetaClass):
                              'in3')
         else:
             if dynamic:
-                pipeline.connect(merge_mc, 'merged_file', merge_outputs, 'in2')
-                pipeline.connect(merge_no_mc, 'merged_file', merge_outputs,
-                                 'in3')
+                gzip_mc = pipeline.create_node(GzipImage(),
+                                               name='gzip_pet_mc')
+                gzip_no_mc = pipeline.create_node(GzipImage(),
+                                                  name='gzip_pet_no_mc')
+                pipeline.connect(merge_mc, 'merged_file', gzip_mc, 'in_file')
+                pipeline.connect(merge_no_mc, 'merged_file', gzip_no_mc,
+                                 'in_file')
+                pipeline.connect(gzip_mc, 'out_file', merge_outputs, 'in2')
+                pipeline.connect(gzip_no_mc, 'out_file', merge_outputs, 'in3')
             else:
                 pipeline.connect(static_mc, 'static_mc', merge_outputs, 'in2')
                 pipeline.connect(static_mc, 'static_no_mc', merge_outputs,
@@ -712,7 +747,7 @@ class MotionDetectionMixin(MultiStudy, metaclass=MultiStudyMetaClass):
 #         pipeline.connect(merge_mc_ps, 'merged_file', mcflirt, 'in_file')
 #         mcflirt.inputs.cost = 'normmi'
 
-        copy2dir = pipeline.create_node(CopyToDir(), name='copy2dir')
+        copy2dir = pipeline.create_node(GatherToDir(), name='copy2dir')
         pipeline.connect(merge_outputs, 'out', copy2dir, 'in_files')
         if dynamic:
             pipeline.connect_output('dynamic_motion_correction_results',
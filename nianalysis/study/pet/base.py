@@ -20,6 +20,9 @@ class PETStudy(Study, metaclass=StudyMetaClass):
 
     add_parameter_specs = [ParameterSpec('ica_n_components', 2),
                         ParameterSpec('ica_type', 'spatial'),
+                        ParameterSpec('ica_mask', ''),
+                        ParameterSpec('ica_n_pca_components', 0),
+                        ParameterSpec('ica_use_float32', False),
                         ParameterSpec('norm_transformation', 's'),
                         ParameterSpec('norm_dim', 3),
                         ParameterSpec('norm_template',
@@ -77,9 +80,17 @@ class PETStudy(Study, metaclass=StudyMetaClass):
             citations=[],
             **kwargs)
 
-        ica = pipeline.create_node(FastICA(), name='ICA')
+        ica = pipeline.create_node(FastICA(n_threads=4), name='ICA',
+                                   nthreads=4)
         ica.inputs.n_components = self.parameter('ica_n_components')
         ica.inputs.ica_type = self.parameter('ica_type')
+        ica.inputs.use_float32 = self.parameter('ica_use_float32')
+        # Optional restriction to a mask and PCA reduction before the ICA
+        if self.parameter('ica_mask'):
+            ica.inputs.mask = self.parameter('ica_mask')
+        if self.parameter('ica_n_pca_components'):
+            ica.inputs.n_pca_components = self.parameter(
+                'ica_n_pca_components')
         pipeline.connect_input('registered_volumes', ica, 'volume')
 
         pipeline.connect_output('decomposed_file', ica, 'ica_decomposition')
@@ -102,10 +113,10 @@ class PETStudy(Study, metaclass=StudyMetaClass):
             citations=[],
             **kwargs)
 
-        reg = pipeline.create_node(AntsRegSyn(out_prefix='vol2template'),
-                                   name='ANTs')
+        reg = pipeline.create_node(
+            AntsRegSyn(out_prefix='vol2template', num_threads=4),
+            name='ANTs', nthreads=4)
         reg.inputs.num_dimensions = self.parameter('norm_dim')
-        reg.inputs.num_threads = self.runner.num_processes
         reg.inputs.transformation = self.parameter('norm_transformation')
         reg.inputs.ref_file = self.parameter('norm_template')
         pipeline.connect_input('pet_image', reg, 'input_file')
@@ -72,7 +72,8 @@ class DynamicPETStudy(PETStudy, metaclass=StudyMetaClass):
         pipeline.connect_input('affine_mat', merge_trans, 'in2')
 
         apply_trans = pipeline.create_node(
-            ApplyTransforms(), name='ApplyTransform')
+            ApplyTransforms(num_threads=4), name='ApplyTransform',
+            nthreads=4)
         apply_trans.inputs.reference_image = self.parameter(
             'trans_template')
         apply_trans.inputs.interpolation = 'Linear'
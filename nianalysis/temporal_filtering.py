@@ -0,0 +1,111 @@
+import numpy as np
+
+
+def bptf_highpass(timeseries, hp_sigma):
+    """
+    In-process equivalent of the high-pass half of `fslmaths -bptf`, i.e.
+    FSL's Gaussian-weighted running-line fit, applied to 1D time series
+
+    Parameters
+    ----------
+    timeseries : np.ndarray
+        Time series to filter, with time along the first axis (e.g. a
+        T x N matrix of N confound regressors)
+    hp_sigma : float
+        High-pass filter sigma in volumes, i.e. the same value that is
+        passed as the first argument of `-bptf` (0.5 * cutoff / TR)
+
+    Returns
+    -------
+    filtered : np.ndarray
+        The high-pass filtered time series (float64), with the same shape
+        as the input. As in FSL (>= 5.0.7), the intercept of the local fit
+        at the first time point is added back, so the filtered series are
+        not demeaned.
+    """
+    timeseries = np.asarray(timeseries, dtype=float)
+    mask_size = int(hp_sigma * 3) if hp_sigma > 0 else 0
+    if mask_size <= 0:
+        return timeseries.copy()
+    n_times = timeseries.shape[0]
+    # Offsets between every pair of time points and the truncated Gaussian
+    # weights FSL uses for its local linear fit around each time point
+    dt = np.arange(n_times)[np.newaxis, :] - np.arange(n_times)[:, np.newaxis]
+    weights = np.exp(-0.5 * dt ** 2 / hp_sigma ** 2)
+    weights[np.abs(dt) > mask_size] = 0.0
+    A = np.sum(weights * dt, axis=1)
+    C = np.sum(weights * dt ** 2, axis=1)
+    N = np.sum(weights, axis=1)
+    denom = C * N - A * A
+    flat = timeseries.reshape(n_times, -1)
+    B = np.dot(weights, flat)
+    D = np.dot(weights * dt, flat)
+    valid = denom != 0
+    c = np.zeros_like(flat)
+    c[valid] = ((B[valid] * C[valid, np.newaxis] -
+                 A[valid, np.newaxis] * D[valid]) /
+                denom[valid, np.newaxis])
+    c0 = c[0] if valid[0] else 0.0
+    filtered = np.where(valid[:, np.newaxis], c0 + flat - c, flat)
+    return filtered.reshape(timeseries.shape)
+
+
+def tproject_regressors(n_times, tr, polort=2, stopband=None):
+    """
+    The nuisance regressors AFNI's 3dTproject projects out of each voxel for
+    its '-polort' and '-stopband' options, i.e. the Legendre polynomials up
+    to degree 'polort' and the sines and cosines of the discrete
+    frequencies that fall within the stop band
+
+    Parameters
+    ----------
+    n_times : int
+        Number of time points
+    tr : float
+        The repetition time (s)
+    polort : int
+        The highest degree of the polynomials to remove
+    stopband : tuple(float, float) | None
+        The range of frequencies to remove (Hz)
+
+    Returns
+    -------
+    regressors : np.ndarray
+        T x K matrix of the regressors
+    """
+    x = np.linspace(-1, 1, n_times)
+    regressors = [np.polynomial.legendre.legvander(x, polort)]
+    if stopband is not None:
+        low, high = stopband
+        t = np.arange(n_times)
+        for k in range(1, n_times // 2 + 1):
+            freq = k / (n_times * tr)
+            if low <= freq <= high:
+                angle = 2 * np.pi * k * t / n_times
+                regressors.append(np.cos(angle)[:, np.newaxis])
+                # The sine at the Nyquist frequency is zero
+                if 2 * k != n_times:
+                    regressors.append(np.sin(angle)[:, np.newaxis])
+    return np.hstack(regressors)
+
+
+def project_out(timeseries, regressors, pinv=None):
+    """
+    Returns the residuals of the least-squares fit of the regressors to the
+    time series
+
+    Parameters
+    ----------
+    timeseries : np.ndarray
+        Time series with time along the first axis (T x N)
+    regressors : np.ndarray
+        T x K matrix of the regressors
+    pinv : np.ndarray
+        The pseudo-inverse of the regressors, which can be passed to avoid
+        recomputing it for each chunk of voxels
+    """
+    if pinv is None:
+        pinv = np.linalg.pinv(regressors)
+    pinv = pinv.astype(timeseries.dtype, copy=False)
+    regressors = regressors.astype(timeseries.dtype, copy=False)
+    return timeseries - np.dot(regressors, np.dot(pinv, timeseries))
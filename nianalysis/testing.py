@@ -10,6 +10,9 @@ import filecmp
 from collections import defaultdict
 import warnings
 import logging
+import numpy as np
+import nibabel as nib
+from nibabel.filebasedimages import ImageFileError
 import xnat
 from arcana.repository.xnat import (
     guess_file_format, special_char_re, lower, BUILTIN_XNAT_FIELDS)
@@ -20,7 +23,7 @@ import nianalysis
 from arcana.utils import classproperty
 from arcana.repository.local import (
     LocalRepository, SUMMARY_NAME)
-from arcana.runner import LinearRunner
+from nianalysis.runner import LinearRunner
 from arcana.exception import ArcanaError
 from arcana.node import ArcanaNodeMixin
 from arcana.exception import (
@@ -46,6 +49,10 @@ class BaseTestCase(TestCase):
     SERVER = 'https://mbi-xnat.erc.monash.edu.au'
     XNAT_TEST_PROJECT = 'TEST001'
     REF_SUFFIX = '_REF'
+    # Number of slices of a single-volume image loaded at a time when
+    # comparing images (images with multiple volumes are read a volume at a
+    # time)
+    IMAGE_SLAB_SIZE = 16
 
     # The path to the test directory, which should sit along side the
     # the package directory. Note this will not work when Arcana
@@ -284,42 +291,93 @@ class BaseTestCase(TestCase):
     def assertStatEqual(self, stat, dataset_name, target, study_name,
                         subject=None, visit=None,
                         frequency='per_session'):
+            path = self.output_file_path(
+                dataset_name, study_name, subject=subject, visit=visit,
+                frequency=frequency)
             try:
-                ArcanaNodeMixin.load_module('mrtrix')
-            except ArcanaModulesNotInstalledException:
-                pass
-            val = float(sp.check_output(
-                'mrstats {} -output {}'.format(
-                    self.output_file_path(
-                        dataset_name, study_name,
-                        subject=subject, visit=visit,
-                        frequency=frequency),
-                    stat),
-                shell=True))
-            self.assertEqual(
-                val, target, (
-                    "{} value of '{}' ({}) does not equal target ({}) "
-                    "for subject {} visit {}"
-                    .format(stat, dataset_name, val, target,
-                            subject, visit)))
+                img = nib.load(path, keep_file_open=True)
+            except ImageFileError:
+                # Not a format NiBabel can read so fall back to mrstats
+                vals = self._mrstats(path, stat)
+            else:
+                stats = ImageStatistics.of(
+                    img, statistics=[stat], slab=self.IMAGE_SLAB_SIZE)
+                # Round to the precision the values are printed by mrstats
+                vals = [float('{:.6g}'.format(v)) for v in stats[stat]]
+            for val in vals:
+                self.assertEqual(
+                    val, target, (
+                        "{} value of '{}' ({}) does not equal target ({}) "
+                        "for subject {} visit {}"
+                        .format(stat, dataset_name, val, target,
+                                subject, visit)))
 
     def assertImagesAlmostMatch(self, out, ref, mean_threshold,
                                 stdev_threshold, study_name):
         out_path = self.output_file_path(out, study_name)
         ref_path = self.ref_file_path(ref)
         # Should probably look into ITK fuzzy matching methods
-        cmd = ("mrcalc -quiet {a} {b} -subtract - | mrstats - | "
-               "grep -v channel | awk '{{print $4 \" \" $6}}'"
-               .format(a=out_path, b=ref_path))
-        out = sp.check_output(cmd, shell=True)
-        mean, stdev = (float(x) for x in out.split())
-        self.assertTrue(
-            abs(mean) < mean_threshold and stdev < stdev_threshold,
-            ("Mean ({mean}) or standard deviation ({stdev}) of difference "
-             "between images {a} and {b} differ more than threshold(s) "
-             "({thresh_mean} and {thresh_stdev} respectively)"
-             .format(mean=mean, stdev=stdev, thresh_mean=mean_threshold,
-                     thresh_stdev=stdev_threshold, a=out_path, b=ref_path)))
+        try:
+            out_img = nib.load(out_path, keep_file_open=True)
+            ref_data = self._load_ref_image(ref_path)
+        except ImageFileError:
+            # Not a format NiBabel can read so fall back to MRtrix
+            cmd = ("mrcalc -quiet {a} {b} -subtract - | mrstats - | "
+                   "grep -v channel | awk '{{print $4 \" \" $6}}'"
+                   .format(a=out_path, b=ref_path))
+            out = sp.check_output(cmd, shell=True)
+            means, stdevs = zip(
+                *(tuple(float(x) for x in l.split())
+                  for l in out.decode().strip().split('\n')))
+        else:
+            self.assertEqual(
+                out_img.shape, ref_data.shape,
+                "Dimensions of images {} and {} do not match".format(
+                    out_path, ref_path))
+            stats = ImageStatistics.of_difference(
+                out_img, ref_data, statistics=['mean', 'std'],
+                slab=self.IMAGE_SLAB_SIZE)
+            means, stdevs = stats['mean'], stats['std']
+        for mean, stdev in zip(means, stdevs):
+            self.assertTrue(
+                abs(mean) < mean_threshold and stdev < stdev_threshold,
+                ("Mean ({mean}) or standard deviation ({stdev}) of "
+                 "difference between images {a} and {b} differ more than "
+                 "threshold(s) ({thresh_mean} and {thresh_stdev} "
+                 "respectively)"
+                 .format(mean=mean, stdev=stdev, thresh_mean=mean_threshold,
+                         thresh_stdev=stdev_threshold, a=out_path,
+                         b=ref_path)))
+
+    @classmethod
+    def _load_ref_image(cls, path):
+        """
+        Loads a reference image, which is read a slab at a time as it is
+        compared against. It is cached so subsequent comparisons against it
+        (from the same test class) don't need to reread the slabs
+        """
+        if '_ref_image_cache' not in cls.__dict__:
+            cls._ref_image_cache = {}
+        key = (path, os.path.getmtime(path))
+        try:
+            ref = cls._ref_image_cache[key]
+        except KeyError:
+            ref = cls._ref_image_cache[key] = CachedImageSlabs(path)
+        return ref
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._ref_image_cache = {}
+        super(BaseTestCase, cls).tearDownClass()
+
+    def _mrstats(self, path, stat):
+        try:
+            ArcanaNodeMixin.load_module('mrtrix')
+        except ArcanaModulesNotInstalledException:
+            pass
+        return [float(v) for v in sp.check_output(
+            'mrstats {} -output {}'.format(path, stat),
+            shell=True).split()]
 
     def get_session_dir(self, subject=None, visit=None,
                         frequency='per_session'):
@@ -524,6 +582,166 @@ class TestTestCase(BaseTestCase):
         pass
 
 
+class ImageStatistics(object):
+    """
+    Accumulates the statistics reported by mrstats (mean, median, std, min,
+    max and count) for each volume of an image, while the image is read a
+    volume (or for a single volume, a slab of slices) at a time. As in
+    mrstats, non-finite values are ignored and the standard deviation is the
+    sample standard deviation.
+
+    Parameters
+    ----------
+    n_volumes : int
+        The number of volumes in the image
+    statistics : list(str)
+        The statistics to calculate. Only needed to avoid keeping all the
+        values of the image in memory when the median isn't required
+    """
+
+    STATISTICS = ('mean', 'median', 'std', 'min', 'max', 'count')
+
+    def __init__(self, n_volumes, statistics=STATISTICS):
+        for stat in statistics:
+            if stat not in self.STATISTICS:
+                raise ArcanaError(
+                    "Unrecognised statistic '{}', can be one of '{}'"
+                    .format(stat, "', '".join(self.STATISTICS)))
+        self._statistics = statistics
+        self._count = np.zeros(n_volumes, dtype=np.int64)
+        self._mean = np.zeros(n_volumes)
+        self._m2 = np.zeros(n_volumes)
+        self._min = np.full(n_volumes, np.inf)
+        self._max = np.full(n_volumes, -np.inf)
+        self._values = ([[] for _ in range(n_volumes)]
+                        if 'median' in statistics else None)
+
+    def update(self, slab, volumes=slice(None)):
+        """
+        Adds a slab of the image (i.e. the first three dimensions spatial and
+        the remaining ones indexing the volumes) to the statistics of the
+        given volumes (all of them by default)
+        """
+        volumes = np.arange(len(self._count))[volumes]
+        slab = np.reshape(slab, (-1, len(volumes)), order='F')
+        finite = np.isfinite(slab)
+        count = np.sum(finite, axis=0)
+        zeroed = np.where(finite, slab, 0).astype(float)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.sum(zeroed, axis=0) / count
+        deviations = np.where(finite, zeroed - mean, 0)
+        m2 = np.sum(deviations ** 2, axis=0)
+        # Combine with the statistics of the previous slabs using Chan et
+        # al.'s parallel algorithm
+        prev_count = self._count[volumes]
+        total = prev_count + count
+        nonempty = count > 0
+        delta = mean - self._mean[volumes]
+        self._mean[volumes[nonempty]] += (delta * count / total)[nonempty]
+        self._m2[volumes[nonempty]] += (
+            m2 + delta ** 2 * prev_count * count / total)[nonempty]
+        self._count[volumes] = total
+        self._min[volumes] = np.minimum(
+            self._min[volumes],
+            np.min(np.where(finite, slab, np.inf), axis=0))
+        self._max[volumes] = np.maximum(
+            self._max[volumes],
+            np.max(np.where(finite, slab, -np.inf), axis=0))
+        if self._values is not None:
+            for i, vol, vol_finite in zip(volumes, slab.T, finite.T):
+                self._values[i].append(vol[vol_finite])
+
+    @property
+    def results(self):
+        "The requested statistics, each as an array with a value per volume"
+        with np.errstate(invalid='ignore', divide='ignore'):
+            stats = {
+                'mean': np.where(self._count > 0, self._mean, np.nan),
+                'std': np.sqrt(self._m2 / (self._count - 1)),
+                'min': np.where(self._count > 0, self._min, np.nan),
+                'max': np.where(self._count > 0, self._max, np.nan),
+                'count': self._count}
+        if self._values is not None:
+            stats['median'] = np.array(
+                [np.median(np.concatenate(v)) if len(v) else np.nan
+                 for v in self._values])
+        return dict((s, stats[s]) for s in self._statistics)
+
+    @classmethod
+    def of(cls, img, slab=16, **kwargs):
+        "Calculates the statistics of a NiBabel image a slab at a time"
+        return cls.of_difference(img, None, slab=slab, **kwargs)
+
+    @classmethod
+    def of_difference(cls, img, ref_data, slab=16, **kwargs):
+        """
+        Calculates the statistics of the difference between a NiBabel image
+        and reference data (as 'mrcalc img ref -subtract' would), reading
+        the image a slab at a time. The reference data can be an array or
+        anything indexed the same way, e.g. a CachedImageSlabs
+        """
+        shape = img.shape
+        stats = cls(int(np.prod(shape[3:], dtype=int)), **kwargs)
+        for index, volumes in cls.slabs(shape, slab):
+            data = np.asarray(img.dataobj[index], dtype=np.float32)
+            if ref_data is not None:
+                data = data - ref_data[index]
+            stats.update(data, volumes)
+        return stats.results
+
+    @classmethod
+    def slabs(cls, shape, slab=16):
+        """
+        Yields the index of each slab an image of the given shape is read in,
+        along with the volumes it belongs to. Images with multiple volumes
+        are read a volume at a time, and single volumes 'slab' slices at a
+        time, so that both are read in the order they are stored (which
+        avoids decompressing gzipped images again for each slab)
+        """
+        if len(shape) > 3:
+            vol_shape = shape[3:]
+            for i in range(int(np.prod(vol_shape, dtype=int))):
+                yield ((slice(None),) * 3 +
+                       np.unravel_index(i, vol_shape, order='F'),
+                       slice(i, i + 1))
+        else:
+            n_slices = shape[2] if len(shape) > 2 else 1
+            for z0 in range(0, n_slices, slab):
+                yield ((slice(None), slice(None),
+                        slice(z0, z0 + slab))[:len(shape)], slice(None))
+
+
+class CachedImageSlabs(object):
+    """
+    Reads the slabs of an image as they are indexed, caching them so that
+    subsequent comparisons against the image don't need to reread them
+
+    Parameters
+    ----------
+    path : str
+        Path to the image
+    """
+
+    def __init__(self, path):
+        self._img = nib.load(path, keep_file_open=True)
+        self._slabs = {}
+
+    @property
+    def shape(self):
+        return self._img.shape
+
+    def __getitem__(self, index):
+        # Slices aren't hashable so are keyed by their start and stop
+        key = tuple((i.start, i.stop) if isinstance(i, slice) else i
+                    for i in index)
+        try:
+            data = self._slabs[key]
+        except KeyError:
+            data = self._slabs[key] = np.asarray(self._img.dataobj[index],
+                                                 dtype=np.float32)
+        return data
+
+
 def download_all_datasets(download_dir, server, session_id, overwrite=True,
                           **kwargs):
     with xnat.connect(server, **kwargs) as xnat_login:
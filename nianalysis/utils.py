@@ -1,4 +1,7 @@
 import os.path
+import json
+import shutil
+import tempfile
 from arcana.exception import ArcanaError
 
 
@@ -64,3 +67,175 @@ def get_atlas_path(name, dataset='brain', resolution='1mm'):
         raise ArcanaError("Unrecognised atlas name '{}'"
                               .format(name))
     return os.path.abspath(path)
+
+
+def pyplot():
+    """
+    Imports and returns matplotlib.pyplot, using the non-interactive 'Agg'
+    backend so figures can be saved on nodes without a display. Matplotlib
+    is imported on first use instead of when the interfaces are imported, as
+    the interface modules are imported by every worker process.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plot
+    return plot
+
+
+# ioctl request that clones the extents of a file on copy-on-write
+# file-systems (e.g. Btrfs and XFS)
+FICLONE = 0x40049409
+
+# Methods used to place files, from cheapest to most expensive
+LINK_METHODS = ('symlink', 'hardlink', 'reflink', 'copy')
+
+MANIFEST_SUFFIX = '.manifest.json'
+
+
+def link_or_copy(src, dst, method='hardlink'):
+    """
+    Places a file (or directory tree) at 'dst' that references 'src' without
+    duplicating its contents where possible. Directories are recreated and
+    each of the files within them linked individually, so that new files
+    can be added to 'dst' without modifying 'src'. If a file can't be
+    hard-linked (e.g. it is on a different device or the file-system doesn't
+    support links) it is reflinked (i.e. shares its blocks with 'src' until
+    either is modified) if the file-system supports it, and copied if not.
+
+    Parameters
+    ----------
+    src : str
+        Path to the file or directory to link
+    dst : str
+        Path to create
+    method : str
+        Can be one of 'hardlink', 'symlink' or 'copy'
+
+    Returns
+    -------
+    method : str
+        The method that was used to place the file, or the most expensive
+        method used for the files of a directory
+    """
+    if method not in ('hardlink', 'symlink', 'copy'):
+        raise ArcanaError(
+            "Unrecognised link method '{}', can be one of 'hardlink', "
+            "'symlink' or 'copy'".format(method))
+    if os.path.isdir(src):
+        if not os.path.isdir(dst):
+            os.makedirs(dst)
+        used = [link_or_copy(os.path.join(src, fname),
+                             os.path.join(dst, fname), method=method)
+                for fname in os.listdir(src)]
+        return max(used or [method], key=LINK_METHODS.index)
+    if os.path.lexists(dst):
+        # Files left by a previous run are replaced by unlinking them, never
+        # by writing to them, as they may share their inode with 'src'
+        if os.path.exists(dst) and os.path.samefile(src, dst):
+            return 'symlink' if os.path.islink(dst) else 'hardlink'
+        os.remove(dst)
+    if method == 'hardlink':
+        try:
+            os.link(src, dst)
+            return 'hardlink'
+        except OSError:
+            pass
+        try:
+            reflink(src, dst)
+            return 'reflink'
+        except (OSError, IOError, ImportError):
+            pass
+    elif method == 'symlink':
+        try:
+            os.symlink(os.path.abspath(src), dst)
+            return 'symlink'
+        except OSError:
+            pass
+    shutil.copy2(src, dst)
+    return 'copy'
+
+
+def reflink(src, dst):
+    """
+    Creates a copy-on-write clone of the file 'src' at 'dst', raising an
+    OSError (or ImportError on platforms without fcntl) if the file-system
+    doesn't support it. The clone is created under a temporary name and
+    renamed to 'dst', so an existing file at 'dst' is only replaced once the
+    clone has succeeded and is never written to.
+    """
+    import fcntl
+    dst_dir, dst_name = os.path.split(os.path.abspath(dst))
+    fd, tmp_path = tempfile.mkstemp(dir=dst_dir, prefix='.' + dst_name)
+    try:
+        with open(src, 'rb') as f_src, os.fdopen(fd, 'wb') as f_dst:
+            fcntl.ioctl(f_dst.fileno(), FICLONE, f_src.fileno())
+        shutil.copystat(src, tmp_path)
+        os.rename(tmp_path, dst)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def gather(paths, out_dir, names=None, move=False, method='hardlink'):
+    """
+    Gathers files (or directories) into a directory, linking them where
+    possible (see `link_or_copy`) so that assembling an output directory
+    from the files produced by upstream nodes doesn't duplicate them. What
+    was done for each path is recorded in a JSON manifest saved next to the
+    directory ('<out_dir>.manifest.json'), rather than in it so that the
+    contents of the directory are unchanged.
+
+    Parameters
+    ----------
+    paths : list(str)
+        The paths of the files or directories to gather
+    out_dir : str
+        The directory to gather them into, created if it doesn't exist
+    names : list(str) | None
+        The names to give the paths within the directory. If None their
+        basenames are used
+    move : bool
+        Whether the paths are moved rather than linked, for files created by
+        the interface itself. Moves are renames where the paths are on the
+        same device, and fall back to linking (or copying) and removing the
+        original where they aren't
+    method : str
+        The link method to use (see `link_or_copy`)
+
+    Returns
+    -------
+    out_paths : list(str)
+        The paths of the gathered files within the directory
+    """
+    if names is None:
+        names = [os.path.basename(os.path.normpath(p)) for p in paths]
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    manifest_path = os.path.normpath(out_dir) + MANIFEST_SUFFIX
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (IOError, ValueError):
+        manifest = []
+    out_paths = []
+    for path, name in zip(paths, names):
+        dst = os.path.join(out_dir, name)
+        if move:
+            try:
+                os.rename(path, dst)
+                used = 'rename'
+            except OSError:
+                used = link_or_copy(path, dst, method=method)
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+        else:
+            used = link_or_copy(path, dst, method=method)
+        manifest.append({'src': os.path.abspath(path),
+                         'dst': os.path.abspath(dst), 'method': used})
+        out_paths.append(dst)
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return out_paths
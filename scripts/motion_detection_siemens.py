@@ -7,7 +7,7 @@ from mc_pipeline.utils import (
     guess_scan_type, local_motion_detection, inputs_generation)
 import argparse
 import pickle as pkl
-from arcana.runner.linear import LinearRunner
+from nianalysis.runner import LinearRunner
 
 
 class create_motion_detection:
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""
+Summarises the resource profiles recorded for nianalysis interfaces (see
+nianalysis.profiling) into a per-pipeline JSON report and prints proposed
+'wall_time' and 'memory' values for each node
+"""
+import json
+import argparse
+from nianalysis.profiling import write_report, suggest_resources
+
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument('profile_dir',
+                    help="Directory the profile records were saved in")
+parser.add_argument('out_path', help="Path to save the JSON report to")
+parser.add_argument('--work_dir', default=None,
+                    help=("Work directory of the runner, used to determine "
+                          "the pipeline each node belongs to"))
+parser.add_argument('--wall_time_margin', type=float, default=1.5)
+parser.add_argument('--memory_margin', type=float, default=1.25)
+args = parser.parse_args()
+
+summary = write_report(args.profile_dir, args.out_path,
+                       work_dir=args.work_dir)
+print(json.dumps(
+    suggest_resources(summary, wall_time_margin=args.wall_time_margin,
+                      memory_margin=args.memory_margin),
+    indent=2, sort_keys=True))
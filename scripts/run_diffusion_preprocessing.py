@@ -7,7 +7,7 @@ from nianalysis.file_format import dicom_format
 import logging
 import argparse
 from arcana.dataset.match import DatasetMatch
-from arcana.runner.linear import LinearRunner
+from nianalysis.runner import LinearRunner
 
 
 if __name__ == "__main__":
@@ -1,14 +1,15 @@
 #!/usr/bin/env python3
-from nianalysis.study.multimodal.mrpet import create_motion_correction_class
+from nianalysis.study.multimodal.mrpet import (
+    create_motion_correction_class, MotionDetectionMixin)
 import os.path
 import errno
-# from arcana.runner import MultiProcRunner
 from arcana.repository.local import LocalRepository
 from nianalysis.motion_correction_utils import (
-    guess_scan_type, local_motion_detection, inputs_generation)
+    guess_scan_type, local_motion_detection, inputs_generation,
+    clear_motion_detection_outputs, merge_scan_assignment)
 import argparse
 import pickle as pkl
-from arcana.runner.linear import LinearRunner
+from nianalysis.runner import local_runner
 import shutil
 
 
@@ -40,15 +41,26 @@ class RunMotionCorrection:
             for i, c in enumerate(crop_size):
                 self.parameters['crop_{}size'.format(crop_axes[i])] = c
 
-    def create_motion_correction_inputs(self):
+    def create_motion_correction_inputs(self, incremental=False):
 
         input_dir = self.input_dir
         pet_dir = self.pet_dir
         pet_recon = self.pet_recon
         struct2align = self.struct2align
         cached_inputs = False
+        previous_inputs = None
         cache_input_path = os.path.join(input_dir, 'inputs.pickle')
-        if os.path.isdir(input_dir):
+        # In incremental mode the scans are detected again to pick up those
+        # added since the previous run, and merged into the classification
+        # of the previous run
+        if incremental:
+            try:
+                with open(cache_input_path, 'rb') as f:
+                    previous_inputs = pkl.load(f)[:6]
+            except IOError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+        if os.path.isdir(input_dir) and not incremental:
             try:
                 with open(cache_input_path, 'rb') as f:
                     (ref, ref_type, t1s, epis, t2s, dmris, pd,
@@ -82,13 +94,14 @@ class RunMotionCorrection:
                                            struct2align=struct2align)
             list_inputs = guess_scan_type(scans, input_dir)
             if not list_inputs:
-                ref, ref_type, t1s, epis, t2s, dmris = (
+                list_inputs = list(
                     inputs_generation(scans, input_dir, siemens=True))
-                list_inputs = [ref, ref_type, t1s, epis, t2s, dmris]
             else:
                 print(list_inputs)
-                ref, ref_type, t1s, epis, t2s, dmris = (
-                    list_inputs)
+            if previous_inputs is not None:
+                list_inputs = merge_scan_assignment(previous_inputs,
+                                                    list_inputs)
+            ref, ref_type, t1s, epis, t2s, dmris = list_inputs
             if pet_dir is not None:
                 list_inputs.append(pet_dir)
             else:
@@ -184,6 +197,24 @@ if __name__ == "__main__":
                               "(for example pct umap). Otherwise discrete "
                               "(like UTE-based umap). Default is discrete."),
                         default=False)
+    parser.add_argument('--incremental', action='store_true',
+                        help=("If provided, the results of the scans "
+                              "processed by a previous run on the same "
+                              "input_dir are reused, so that only the scans "
+                              "added to the session since then are processed "
+                              "before the mean displacement and framing are "
+                              "updated. Default is False."), default=False)
+    parser.add_argument('--num_processes', '-np', type=int,
+                        help=("Number of cores to process the scans on. The "
+                              "pipelines of the different scans are run "
+                              "concurrently, as far as the cores and memory "
+                              "allow, before their motion estimates are "
+                              "combined. Default is 1 (one step at a time)."
+                              " Pass 0 to use all the cores."), default=1)
+    parser.add_argument('--memory', '-mem', type=float,
+                        help=("Memory (in GB) available to the concurrent "
+                              "processes. Default is 90%% of the system "
+                              "memory."), default=None)
     args = parser.parse_args()
 
     mc = RunMotionCorrection(
@@ -194,7 +225,8 @@ if __name__ == "__main__":
         crop_coordinates=args.cropping_coordinates, mni_reg=args.mni_reg,
         static_len=args.static_pet_len, pct_umap=args.continuos_umap)
 
-    ref, ref_type, t1s, epis, t2s, dmris = mc.create_motion_correction_inputs()
+    ref, ref_type, t1s, epis, t2s, dmris = mc.create_motion_correction_inputs(
+        incremental=args.incremental)
 
     MotionCorrection, inputs, out_data = create_motion_correction_class(
         'MotionDetection', ref, ref_type, t1s=t1s, t2s=t2s, dmris=dmris,
@@ -214,8 +246,20 @@ if __name__ == "__main__":
         if e.errno != errno.EEXIST:
             raise
 
+    if args.incremental:
+        mc.parameters['md_records_dir'] = os.path.join(WORK_PATH,
+                                                       'md_records')
+        session_dir = os.path.join(args.input_dir, 'work_dir', sub_id,
+                                   session_id)
+        clear_motion_detection_outputs(
+            session_dir, 'MotionCorrection',
+            MotionDetectionMixin.motion_dependent_outputs())
+
     study = MotionCorrection(name='MotionCorrection',
-                             runner=LinearRunner(WORK_PATH),
+                             runner=local_runner(
+                                 WORK_PATH,
+                                 num_processes=(args.num_processes or None),
+                                 memory_gb=args.memory),
                              repository=repository, inputs=inputs,
                              subject_ids=[sub_id], parameters=mc.parameters,
                              visit_ids=[session_id])
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Benchmarks the time taken to import the nianalysis modules that are loaded
+by the CLI scripts and by every nipype worker process (which imports the
+module of the interface it runs).
+
+Each module is imported in a fresh interpreter, 'repeats' times, and the
+median wall time is written to a JSON results file along with the heavy
+optional dependencies that were imported with it (which should only be
+imported when an interface that needs them is run), e.g.
+
+    python test/benchmarks/import_time.py --out results.json
+
+A previous results file can be passed to '--compare' to print the ratio of
+the new import times to the old ones, in which case the script exits with a
+non-zero status if any of them has regressed by more than '--tolerance'.
+"""
+import os.path
+import sys
+import json
+import platform
+import argparse
+import subprocess
+import datetime as dt
+
+MODULES = (
+    'nianalysis',
+    'nianalysis.interfaces.custom.motion_correction',
+    'nianalysis.interfaces.custom.pet',
+    'nianalysis.interfaces.sklearn',
+    'nianalysis.interfaces.fsl',
+    'nianalysis.study.mri.epi',
+    'nianalysis.study.multimodal.mrpet')
+
+# Dependencies that are only needed by a few interfaces and so shouldn't be
+# imported along with the modules
+LAZY_MODULES = ('matplotlib', 'sklearn', 'scipy.ndimage', 'scipy.signal')
+
+package_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..',
+                                            '..'))
+
+IMPORT_SCRIPT = """
+import sys, time, json
+t0 = time.time()
+import {module}
+elapsed = time.time() - t0
+print(json.dumps({{'time': elapsed,
+                  'lazy_imported': [m for m in {lazy!r} if m in sys.modules]
+                  }}))
+"""
+
+
+def time_import(module, lazy_modules=LAZY_MODULES):
+    "Imports the module in a fresh interpreter and returns the time taken"
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        p for p in (package_path, env.get('PYTHONPATH')) if p)
+    output = subprocess.check_output(
+        [sys.executable, '-c', IMPORT_SCRIPT.format(module=module,
+                                                    lazy=lazy_modules)],
+        env=env)
+    return json.loads(output.decode().strip().split('\n')[-1])
+
+
+def benchmark(modules=MODULES, repeats=5):
+    results = []
+    for module in modules:
+        runs = [time_import(module) for _ in range(repeats)]
+        times = sorted(r['time'] for r in runs)
+        results.append({'module': module,
+                        'time': times[len(times) // 2],
+                        'min_time': times[0],
+                        'lazy_imported': runs[0]['lazy_imported']})
+        print('{:<50}{:>8.3f}s {}'.format(
+            module, results[-1]['time'],
+            ', '.join(runs[0]['lazy_imported'])))
+    return results
+
+
+def compare(results, previous, tolerance):
+    """
+    Prints the ratio of new to previous import times and returns whether
+    all of them are within the tolerance
+    """
+    prev = dict((r['module'], r) for r in previous['results'])
+    print('\n{:<50}{:>12}'.format('module', 'time ratio'))
+    passed = True
+    for r in results:
+        try:
+            p = prev[r['module']]
+        except KeyError:
+            continue
+        ratio = r['time'] / max(p['time'], 1e-9)
+        regressed = ratio > 1.0 + tolerance
+        print('{:<50}{:>12.2f}{}'.format(r['module'], ratio,
+                                         ' REGRESSED' if regressed else ''))
+        passed &= not regressed
+    return passed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--modules', nargs='+', default=MODULES,
+                        help="Modules to time the import of")
+    parser.add_argument('--repeats', type=int, default=5,
+                        help="Number of fresh imports to take the median of")
+    parser.add_argument('--out', default='import_time_benchmark.json',
+                        help="Path of the JSON results file")
+    parser.add_argument('--compare', default=None,
+                        help="Results file of a previous run to compare to")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help=("Fractional increase in import time over the "
+                              "previous run that is treated as a regression"))
+    args = parser.parse_args()
+
+    results = benchmark(args.modules, repeats=args.repeats)
+    with open(args.out, 'w') as f:
+        json.dump({'date': dt.datetime.now().isoformat(),
+                   'host': platform.node(),
+                   'platform': platform.platform(),
+                   'python': platform.python_version(),
+                   'results': results}, f, indent=2)
+    failed = [r['module'] for r in results if r['lazy_imported']]
+    if failed:
+        print("\nOptional dependencies imported at module level by: {}"
+              .format(', '.join(failed)))
+    if args.compare is not None:
+        with open(args.compare) as f:
+            if not compare(results, json.load(f), args.tolerance):
+                failed.append('regression')
+    sys.exit(1 if failed else 0)
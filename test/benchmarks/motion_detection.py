@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Benchmarks the pure-Python interfaces of the motion detection chain
+(MeanDisplacementCalculation, MotionFraming, AffineMatAveraging,
+FixedBinning, PetCorrectionFactor and CreateMocoSeries) on synthetic
+sessions of increasing size. No FSL or MRtrix installation is required.
+
+Each interface is run in a fresh process so that the peak resident set size
+(RSS) can be attributed to it, and the wall time and peak RSS of every run
+are written to a JSON results file, e.g.
+
+    python test/benchmarks/motion_detection.py --scales 100 1000 10000 \\
+        --out results.json
+
+A previous results file can be passed to '--compare' to print the ratio of
+the new timings and memory usage to the old ones.
+"""
+import os.path
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import datetime as dt
+import multiprocessing
+import resource
+import numpy as np
+import nibabel as nib
+
+reference_path = os.path.abspath(os.path.join(
+    os.path.dirname(__file__), '..', '..', 'nianalysis', 'reference_data'))
+
+TIME_FORMAT = '%H%M%S.%f'
+
+# The order the interfaces are run in, as the later ones consume the outputs
+# of the earlier ones
+STAGES = ('MeanDisplacementCalculation', 'MotionFraming',
+          'AffineMatAveraging', 'PetCorrectionFactor', 'FixedBinning',
+          'CreateMocoSeries')
+
+
+def random_rigid_matrix(rng, rot_sd=1.0, trans_sd=1.0):
+    "Returns a random rigid-body affine (rotations in degrees, trans in mm)"
+    rx, ry, rz = np.deg2rad(rng.normal(0, rot_sd, 3))
+    Rx = np.array([[1, 0, 0], [0, np.cos(rx), -np.sin(rx)],
+                   [0, np.sin(rx), np.cos(rx)]])
+    Ry = np.array([[np.cos(ry), 0, np.sin(ry)], [0, 1, 0],
+                   [-np.sin(ry), 0, np.cos(ry)]])
+    Rz = np.array([[np.cos(rz), -np.sin(rz), 0],
+                   [np.sin(rz), np.cos(rz), 0], [0, 0, 1]])
+    mat = np.eye(4)
+    mat[:3, :3] = np.dot(Rz, np.dot(Ry, Rx))
+    mat[:3, 3] = rng.normal(0, trans_sd, 3)
+    return mat
+
+
+def generate_session(session_dir, n_scans, n_volumes, seed=0,
+                     start_time='090000.000000', gap=30.0):
+    """
+    Generates a synthetic motion detection session of 'n_scans' scans, each
+    with 'n_volumes' volumes, and returns the inputs of the
+    MeanDisplacementCalculation interface for it
+
+    Each scan directory contains a random rigid motion matrix (and its
+    inverse) per volume, named the way the motion mat pipelines name them,
+    and a small reference image with a blob in it is saved alongside.
+    """
+    rng = np.random.RandomState(seed)
+    os.makedirs(session_dir)
+    ref_path = os.path.join(session_dir, 'reference.nii.gz')
+    grid = np.indices((32, 32, 32)) - np.array([14, 16, 18])[:, None, None,
+                                                            None]
+    blob = np.exp(-np.sum(grid ** 2, axis=0) / 50.0).astype(np.float32)
+    nib.save(nib.Nifti1Image(blob, np.eye(4)), ref_path)
+    inputs = {'motion_mats': [], 'trs': [], 'start_times': [],
+              'real_durations': [], 'input_names': [],
+              'reference': ref_path}
+    scan_start = dt.datetime.strptime(start_time, TIME_FORMAT)
+    for i in range(n_scans):
+        name = 'scan_{}'.format(str(i).zfill(3))
+        scan_dir = os.path.join(session_dir, name)
+        os.mkdir(scan_dir)
+        tr = float(rng.choice([0.5, 0.8, 1.0, 2.0]))
+        for j in range(n_volumes):
+            mat = random_rigid_matrix(rng)
+            base = os.path.join(scan_dir, 'vol{}'.format(str(j).zfill(5)))
+            np.savetxt(base + '_mat.mat', mat)
+            np.savetxt(base + '_inv.mat', np.linalg.inv(mat))
+        duration = tr * n_volumes
+        inputs['motion_mats'].append(scan_dir)
+        inputs['trs'].append(tr)
+        inputs['start_times'].append(scan_start.strftime(TIME_FORMAT))
+        inputs['real_durations'].append(duration)
+        inputs['input_names'].append(name)
+        scan_start += dt.timedelta(seconds=duration + gap)
+    return inputs
+
+
+def stage_inputs(stage, session_inputs, outputs):
+    """
+    Returns the inputs for a stage given the session inputs and the outputs
+    of the previous stages
+    """
+    if stage == 'MeanDisplacementCalculation':
+        return session_inputs
+    md = outputs['MeanDisplacementCalculation']
+    if stage == 'MotionFraming':
+        return {'mean_displacement': md['mean_displacement'],
+                'mean_displacement_consec': md[
+                    'mean_displacement_consecutive'],
+                'start_times': md['start_times'],
+                'motion_threshold': 2.0,
+                'temporal_threshold': 30.0}
+    elif stage == 'AffineMatAveraging':
+        return {'frame_vol_numbers': outputs['MotionFraming'][
+                    'frame_vol_numbers'],
+                'all_mats4average': md['mats4average']}
+    elif stage == 'PetCorrectionFactor':
+        return {'timestamps': outputs['MotionFraming']['timestamps_dir']}
+    elif stage == 'FixedBinning':
+        start_times = np.loadtxt(md['start_times'], dtype=str)
+        first = dt.datetime.strptime(str(start_times[0]), TIME_FORMAT)
+        last = dt.datetime.strptime(str(start_times[-1]), TIME_FORMAT)
+        # Start the PET a minute into the session and stop it a minute
+        # before the end (capped at an hour)
+        pet_duration = int(min(3600, (last - first).total_seconds() - 120))
+        pet_start = first + dt.timedelta(seconds=60)
+        return {'n_frames': 0, 'pet_offset': 0, 'bin_len': 60,
+                'start_times': md['start_times'],
+                'pet_duration': pet_duration,
+                'pet_start_time': pet_start.strftime(TIME_FORMAT),
+                'motion_mats': md['mats4average']}
+    elif stage == 'CreateMocoSeries':
+        return {'moco_template': os.path.join(reference_path,
+                                              'moco_template.IMA'),
+                'motion_par': md['motion_parameters'],
+                'start_times': md['start_times']}
+    else:
+        assert False
+
+
+def peak_rss_mb():
+    "Peak RSS of the current process in MB"
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return maxrss / (1024.0 ** 2 if sys.platform == 'darwin' else 1024.0)
+
+
+def run_stage(stage, inputs, work_dir):
+    """
+    Runs the interface in the given working directory and returns its
+    outputs, wall time and peak RSS. Intended to be run in a fresh process
+    """
+    from nianalysis.interfaces.custom import motion_correction
+    os.makedirs(work_dir)
+    os.chdir(work_dir)
+    interface = getattr(motion_correction, stage)()
+    for name, value in inputs.items():
+        setattr(interface.inputs, name, value)
+    baseline_rss = peak_rss_mb()
+    t0 = time.time()
+    result = interface.run()
+    wall_time = time.time() - t0
+    outputs = dict((k, v) for k, v in result.outputs.get().items()
+                   if isinstance(v, str))
+    return outputs, wall_time, baseline_rss, peak_rss_mb()
+
+
+def benchmark(scales, n_scans, base_dir, stages=STAGES, seed=0):
+    results = []
+    ctx = multiprocessing.get_context('spawn')
+    for n_total in scales:
+        n_volumes = max(1, n_total // n_scans)
+        scale_dir = os.path.join(base_dir, 'vols{}'.format(n_total))
+        session_inputs = generate_session(
+            os.path.join(scale_dir, 'session'), n_scans, n_volumes,
+            seed=seed)
+        outputs = {}
+        for stage in stages:
+            inputs = stage_inputs(stage, session_inputs, outputs)
+            # A new process per run so the peak RSS is that of the stage
+            with ctx.Pool(1) as pool:
+                (outputs[stage], wall_time, baseline_rss,
+                 peak_rss) = pool.apply(
+                     run_stage,
+                     (stage, inputs, os.path.join(scale_dir, stage)))
+            result = {'interface': stage,
+                      'n_scans': n_scans,
+                      'n_volumes': n_scans * n_volumes,
+                      'wall_time': wall_time,
+                      'baseline_rss_mb': baseline_rss,
+                      'peak_rss_mb': peak_rss}
+            print('{interface} ({n_volumes} volumes): {wall_time:.3f} s, '
+                  '{peak_rss_mb:.1f} MB peak RSS'.format(**result))
+            results.append(result)
+    return results
+
+
+def compare(results, previous):
+    "Prints the ratio of new to previous wall times and peak RSS"
+    prev = dict(((r['interface'], r['n_volumes']), r)
+                for r in previous['results'])
+    print('\n{:<30}{:>10}{:>12}{:>12}'.format('interface', 'volumes',
+                                               'time ratio', 'RSS ratio'))
+    for r in results:
+        try:
+            p = prev[(r['interface'], r['n_volumes'])]
+        except KeyError:
+            continue
+        print('{:<30}{:>10}{:>12.2f}{:>12.2f}'.format(
+            r['interface'], r['n_volumes'],
+            r['wall_time'] / max(p['wall_time'], 1e-9),
+            r['peak_rss_mb'] / p['peak_rss_mb']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scales', type=int, nargs='+',
+                        default=[100, 1000, 10000],
+                        help=("Total number of volumes in the synthetic "
+                              "sessions to benchmark"))
+    parser.add_argument('--n_scans', type=int, default=10,
+                        help="Number of scans the volumes are split between")
+    parser.add_argument('--stages', nargs='+', default=STAGES,
+                        choices=STAGES,
+                        help=("Interfaces to benchmark (the ones they "
+                              "depend on are always run)"))
+    parser.add_argument('--out', default='motion_detection_benchmark.json',
+                        help="Path of the JSON results file")
+    parser.add_argument('--compare', default=None,
+                        help="Results file of a previous run to compare to")
+    parser.add_argument('--work_dir', default=None,
+                        help=("Directory to generate the sessions in (a "
+                              "temporary directory is used by default)"))
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    # Always run the stages the requested ones depend on
+    last = max(STAGES.index(s) for s in args.stages)
+    stages = STAGES[:last + 1]
+    work_dir = (args.work_dir if args.work_dir is not None
+                else tempfile.mkdtemp())
+    try:
+        results = benchmark(args.scales, args.n_scans, work_dir,
+                            stages=stages, seed=args.seed)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir)
+    results = [r for r in results if r['interface'] in args.stages]
+    with open(args.out, 'w') as f:
+        json.dump({'date': dt.datetime.now().isoformat(),
+                   'host': platform.node(),
+                   'platform': platform.platform(),
+                   'python': platform.python_version(),
+                   'numpy': np.__version__,
+                   'results': results}, f, indent=2)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
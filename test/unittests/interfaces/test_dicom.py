@@ -0,0 +1,71 @@
+import os
+import os.path
+import shutil
+import tempfile
+from unittest import TestCase
+import pydicom
+from pydicom.dataset import Dataset, FileDataset
+from nianalysis.interfaces.custom.dicom import (
+    list_mode_files, interfile_duration, PetTimeInfo)
+
+INTERFILE = (b'!INTERFILE:=\r\n%comment:=image duration in the comments\r\n'
+             b'image duration (sec):=3600\r\n!END OF INTERFILE:=\r\n')
+
+
+class TestPetTimeInfo(TestCase):
+
+    def setUp(self):
+        self.pet_dir = tempfile.mkdtemp()
+        self.orig_dir = os.getcwd()
+        # The largest list-mode file is in a sub-directory that is visited
+        # before the directory with the smaller one
+        for dname, name, size in (('a', 'LM_00', 100), ('b', 'LM_01', 10),
+                                  ('.hidden', 'LM_02', 1000)):
+            dpath = os.path.join(self.pet_dir, 'raw', dname)
+            os.makedirs(dpath)
+            with open(os.path.join(dpath, name + '.bf'), 'wb') as f:
+                f.write(b'\0' * size)
+            self.write_header(os.path.join(dpath, name + '.dcm'))
+        # A list-mode file without a header, which is skipped
+        with open(os.path.join(self.pet_dir, 'raw', 'a', 'LM_03.bf'),
+                  'wb') as f:
+            f.write(b'\0' * 1000)
+
+    def tearDown(self):
+        os.chdir(self.orig_dir)
+        shutil.rmtree(self.pet_dir)
+
+    def write_header(self, path):
+        file_meta = Dataset()
+        file_meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.128'
+        file_meta.MediaStorageSOPInstanceUID = '1.2.3'
+        file_meta.TransferSyntaxUID = pydicom.uid.ExplicitVRLittleEndian
+        ds = FileDataset(path, {}, file_meta=file_meta, preamble=b'\0' * 128)
+        ds.AcquisitionTime = '101500.000000'
+        ds.add_new((0x0029, 0x1010), 'OB', INTERFILE)
+        ds.is_little_endian = True
+        ds.is_implicit_VR = False
+        ds.save_as(path)
+
+    def test_list_mode_files(self):
+        found = sorted(
+            (os.path.relpath(p, self.pet_dir), size,
+             os.path.relpath(h, self.pet_dir) if h is not None else None)
+            for p, size, h in list_mode_files(self.pet_dir))
+        self.assertEqual(found, [
+            ('raw/a/LM_00.bf', 100, 'raw/a/LM_00.dcm'),
+            ('raw/a/LM_03.bf', None, None),
+            ('raw/b/LM_01.bf', 10, 'raw/b/LM_01.dcm')])
+
+    def test_interfile_duration(self):
+        self.assertEqual(interfile_duration(b'\0\1' + INTERFILE), 3600)
+        self.assertEqual(
+            interfile_duration(b'image duration (sec) := 60\n'), 60)
+        self.assertIsNone(interfile_duration(b'\0\1\2'))
+
+    def test_interface(self):
+        os.chdir(self.pet_dir)
+        result = PetTimeInfo(pet_data_dir=self.pet_dir).run()
+        self.assertEqual(result.outputs.pet_start_time, '101500.000000')
+        self.assertEqual(result.outputs.pet_duration, 3600)
+        self.assertEqual(result.outputs.pet_end_time, '111500.000000')
@@ -0,0 +1,115 @@
+import os
+import os.path
+import shutil
+import tempfile
+from unittest import TestCase
+import numpy as np
+import nibabel as nib
+from nianalysis.interfaces.dti import (
+    bvecs_to_scanner, design_matrix, fit_tensors, tensor_metrics, FitDTI)
+
+
+def random_tensors(rng, n):
+    "Returns random positive-definite tensors as (n, 6) components"
+    tensors = []
+    for _ in range(n):
+        q, _ = np.linalg.qr(rng.normal(size=(3, 3)))
+        evals = rng.uniform(0.1e-3, 2e-3, 3)
+        D = np.dot(q * evals, q.T)
+        tensors.append([D[0, 0], D[1, 1], D[2, 2], D[0, 1], D[0, 2],
+                        D[1, 2]])
+    return np.array(tensors)
+
+
+def scanner_to_bvecs(grads, affine):
+    "Inverse of bvecs_to_scanner, for constructing test data"
+    linear = affine[:3, :3]
+    u, _, vt = np.linalg.svd(linear)
+    bvecs = np.dot(grads, np.dot(u, vt))
+    if np.linalg.det(linear) > 0:
+        bvecs[:, 0] = -bvecs[:, 0]
+    return bvecs
+
+
+def eigen_fa(tensor):
+    Dxx, Dyy, Dzz, Dxy, Dxz, Dyz = tensor
+    evals = np.linalg.eigvalsh(np.array([[Dxx, Dxy, Dxz],
+                                         [Dxy, Dyy, Dyz],
+                                         [Dxz, Dyz, Dzz]]))
+    return (np.sqrt(1.5) * np.linalg.norm(evals - evals.mean()) /
+            np.linalg.norm(evals))
+
+
+class TestFitDTI(TestCase):
+
+    def setUp(self):
+        self.rng = np.random.RandomState(0)
+        bvecs = self.rng.normal(size=(30, 3))
+        self.bvecs = np.vstack((np.zeros((2, 3)), bvecs))
+        self.bvals = np.array([0, 0] + [1000] * 30)
+        self.design = design_matrix(self.bvals, self.bvecs)
+        self.tensors = random_tensors(self.rng, 20)
+        params = np.column_stack((np.full(20, np.log(1000.0)),
+                                  self.tensors))
+        self.signal = np.exp(np.dot(params, self.design.T))
+
+    def test_fit(self):
+        for method in ('ols', 'wls'):
+            params = fit_tensors(self.signal.astype(np.float32),
+                                 self.design, method=method)
+            self.assertTrue(np.allclose(params[:, 1:], self.tensors,
+                                        atol=1e-5), method)
+
+    def test_metrics(self):
+        fa, adc = tensor_metrics(self.tensors)
+        self.assertTrue(np.allclose(fa, [eigen_fa(t) for t in self.tensors]))
+        self.assertTrue(np.allclose(adc, self.tensors[:, :3].mean(axis=1)))
+
+    def test_bvecs_to_scanner(self):
+        grads = self.rng.normal(size=(5, 3))
+        # Radiological (LAS) images keep the voxel x-axis, neurological
+        # (RAS) ones flip it
+        las = np.diag([-2.0, 2.0, 2.5, 1.0])
+        ras = np.diag([2.0, 2.0, 2.5, 1.0])
+        self.assertTrue(np.allclose(bvecs_to_scanner(grads, las),
+                                    grads * [-1, 1, 1]))
+        self.assertTrue(np.allclose(bvecs_to_scanner(grads, ras),
+                                    grads * [-1, 1, 1]))
+        q, _ = np.linalg.qr(self.rng.normal(size=(3, 3)))
+        oblique = np.eye(4)
+        oblique[:3, :3] = q * [1.5, 2.0, 2.5]
+        self.assertTrue(np.allclose(
+            bvecs_to_scanner(scanner_to_bvecs(grads, oblique), oblique),
+            grads))
+
+    def test_interface(self):
+        tmp_dir = tempfile.mkdtemp()
+        orig_dir = os.getcwd()
+        try:
+            os.chdir(tmp_dir)
+            data = np.zeros((4, 5, 2, len(self.bvals)), dtype=np.float32)
+            mask = np.zeros((4, 5, 2), dtype=np.uint8)
+            mask[:, :, 0] = 1
+            data[mask > 0] = self.signal
+            # An oblique image, whose tensor is fitted in the scanner frame
+            q, _ = np.linalg.qr(self.rng.normal(size=(3, 3)))
+            affine = np.eye(4)
+            affine[:3, :3] = q * [1.5, 2.0, 2.5]
+            nib.save(nib.Nifti1Image(data, affine), 'dwi.nii')
+            nib.save(nib.Nifti1Image(mask, affine), 'mask.nii')
+            np.savetxt('bvecs', scanner_to_bvecs(self.bvecs, affine).T)
+            np.savetxt('bvals', self.bvals[None, :])
+            fit = FitDTI(in_file='dwi.nii', bvecs='bvecs', bvals='bvals',
+                         in_mask='mask.nii', chunk_size=7, nthreads=2)
+            outputs = fit.run().outputs
+            tensor = nib.load(outputs.tensor).get_data()
+            self.assertEqual(tensor.shape, (4, 5, 2, 6))
+            self.assertTrue(np.allclose(tensor[mask > 0], self.tensors,
+                                        atol=1e-5))
+            fa = nib.load(outputs.fa).get_data()
+            self.assertTrue(np.allclose(
+                fa[mask > 0], tensor_metrics(self.tensors)[0], atol=1e-3))
+            self.assertTrue(np.all(fa[mask == 0] == 0))
+        finally:
+            os.chdir(orig_dir)
+            shutil.rmtree(tmp_dir)
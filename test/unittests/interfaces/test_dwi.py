@@ -0,0 +1,46 @@
+import os
+import os.path
+import shutil
+import tempfile
+from unittest import TestCase
+import numpy as np
+import nibabel as nib
+from nianalysis.interfaces.custom.dwi import (
+    b0_indices, mean_of_volumes, ExtractMeanB0)
+
+
+class TestExtractMeanB0(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.orig_dir = os.getcwd()
+        os.chdir(self.tmp_dir)
+        rng = np.random.RandomState(0)
+        self.data = rng.uniform(0, 1000, (4, 5, 6, 5)).astype(np.float32)
+        self.affine = np.diag([2.0, 2.0, 2.0, 1.0])
+        nib.save(nib.Nifti1Image(self.data, self.affine), 'dwi.nii.gz')
+        self.bvals = [0, 1000, 5, 1000, 0]
+        np.savetxt('bvals', np.array(self.bvals)[None, :])
+
+    def tearDown(self):
+        os.chdir(self.orig_dir)
+        shutil.rmtree(self.tmp_dir)
+
+    def test_b0_indices(self):
+        self.assertEqual(b0_indices(self.bvals), [0, 2, 4])
+        self.assertEqual(b0_indices(self.bvals, threshold=0), [0, 4])
+
+    def test_mean_of_volumes(self):
+        mean_of_volumes('dwi.nii.gz', [1, 3], 'mean.nii')
+        img = nib.load('mean.nii')
+        self.assertTrue(np.allclose(img.get_data(),
+                                    self.data[..., [1, 3]].mean(axis=3)))
+        self.assertTrue(np.array_equal(img.affine, self.affine))
+
+    def test_interface(self):
+        result = ExtractMeanB0(in_file='dwi.nii.gz', bvals='bvals').run()
+        out_file = result.outputs.out_file
+        self.assertEqual(os.path.basename(out_file), 'dwi_b0.nii.gz')
+        self.assertTrue(np.allclose(nib.load(out_file).get_data(),
+                                    self.data[..., [0, 2, 4]].mean(axis=3),
+                                    rtol=1e-5))
@@ -0,0 +1,102 @@
+import os
+import os.path
+import shutil
+import tempfile
+from unittest import TestCase
+import numpy as np
+import nibabel as nib
+from nianalysis.interfaces.custom.fmri import (
+    migp, MIGP, FusedTemporalFilter)
+from nianalysis.temporal_filtering import tproject_regressors
+
+
+class TestMIGP(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        rng = np.random.RandomState(0)
+        self.shape = (6, 5, 4)
+        n_voxels = np.prod(self.shape)
+        # Subjects sharing the same 3 spatial maps (plus a little noise)
+        maps = rng.normal(size=(3, n_voxels))
+        self.in_files = []
+        self.concatenated = []
+        for i in range(6):
+            ts = (np.dot(rng.normal(size=(20, 3)), maps) +
+                  0.01 * rng.normal(size=(20, n_voxels)))
+            path = os.path.join(self.tmp_dir, 'subj{}.nii'.format(i))
+            nib.save(nib.Nifti1Image(
+                ts.T.reshape(self.shape + (20,)).astype(np.float32),
+                np.eye(4)), path)
+            self.in_files.append(path)
+            ts = ts - ts.mean(axis=0)
+            self.concatenated.append(ts / ts.std(axis=0))
+        self.concatenated = np.vstack(self.concatenated)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_migp(self):
+        reduced, mask = migp(self.in_files, 5)
+        self.assertEqual(reduced.shape, (5, np.prod(self.shape)))
+        self.assertTrue(mask.all())
+        # The dominant singular values (and so the subspace they span)
+        # match those of the full temporal concatenation
+        full_sv = np.linalg.svd(self.concatenated, compute_uv=False)
+        reduced_sv = np.linalg.svd(reduced, compute_uv=False)
+        self.assertTrue(np.allclose(reduced_sv[:3], full_sv[:3], rtol=1e-3))
+
+    def test_interface(self):
+        orig_dir = os.getcwd()
+        os.chdir(self.tmp_dir)
+        try:
+            result = MIGP(in_files=self.in_files, dim=4).run()
+            img = nib.load(result.outputs.out_file)
+            self.assertEqual(img.shape, self.shape + (4,))
+        finally:
+            os.chdir(orig_dir)
+
+
+class TestFusedTemporalFilter(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.orig_dir = os.getcwd()
+        os.chdir(self.tmp_dir)
+        rng = np.random.RandomState(0)
+        self.data = (100 + rng.normal(size=(5, 4, 3, 60))).astype(np.float32)
+        self.mask = np.zeros((5, 4, 3), dtype=np.uint8)
+        self.mask[1:4, 1:3, :] = 1
+        nib.save(nib.Nifti1Image(self.data, np.eye(4)), 'func.nii.gz')
+        nib.save(nib.Nifti1Image(self.mask, np.eye(4)), 'mask.nii.gz')
+
+    def tearDown(self):
+        os.chdir(self.orig_dir)
+        shutil.rmtree(self.tmp_dir)
+
+    def test_filter(self):
+        result = FusedTemporalFilter(
+            in_file='func.nii.gz', mask='mask.nii.gz', tr=2.0, polort=3,
+            stopband=(0, 0.01), chunk_size=5).run()
+        filtered = nib.load(result.outputs.out_file).get_data()
+        mean = self.data.mean(axis=3)
+        regressors = tproject_regressors(60, 2.0, polort=3,
+                                         stopband=(0, 0.01))
+        ts = self.data[self.mask > 0].T.astype(float)
+        beta = np.linalg.lstsq(regressors, ts, rcond=None)[0]
+        expected = (ts - np.dot(regressors, beta)).T
+        self.assertTrue(np.allclose(
+            filtered[self.mask > 0],
+            expected + mean[self.mask > 0][:, np.newaxis], atol=1e-3))
+        # Outside the mask only the mean is restored
+        self.assertTrue(np.allclose(
+            filtered[self.mask == 0],
+            np.repeat(mean[self.mask == 0][:, np.newaxis], 60, axis=1)))
+
+    def test_blur(self):
+        result = FusedTemporalFilter(
+            in_file='func.nii.gz', mask='mask.nii.gz', tr=2.0, polort=2,
+            blur_fwhm=2.0).run()
+        filtered = nib.load(result.outputs.out_file).get_data()
+        self.assertEqual(filtered.shape, self.data.shape)
+        self.assertTrue(np.all(np.isfinite(filtered)))
@@ -0,0 +1,85 @@
+import os
+import threading
+from unittest import TestCase
+from nianalysis.interfaces.matlab import (
+    MatlabSessionPool, MatlabSessionError, session_pool, POOL_SIZE_ENV)
+
+
+class RecordingSession(object):
+    "Stands in for a MATLAB session, recording the scripts run in it"
+
+    started = 0
+
+    def __init__(self):
+        type(self).started += 1
+        self.paths = []
+        self.scripts = []
+        self.closed = False
+
+    def run(self, script, paths=(), cwd=None):  # @UnusedVariable
+        self.paths.extend(p for p in paths if p not in self.paths)
+        if script == 'crash':
+            raise MatlabSessionError('crashed')
+        self.scripts.append(script)
+        return script, ''
+
+    def quit(self):
+        self.closed = True
+
+
+class TestMatlabSessionPool(TestCase):
+
+    def setUp(self):
+        RecordingSession.started = 0
+
+    def test_reuse(self):
+        pool = MatlabSessionPool(2, session_cls=RecordingSession)
+        for i in range(5):
+            stdout, _ = pool.run('script{}'.format(i), paths=['/qsm'])
+            self.assertEqual(stdout, 'script{}'.format(i))
+        # Run sequentially so only one session should have been started
+        self.assertEqual(RecordingSession.started, 1)
+        session = pool.acquire()
+        self.assertEqual(session.paths, ['/qsm'])
+        self.assertEqual(len(session.scripts), 5)
+
+    def test_discard_crashed_session(self):
+        pool = MatlabSessionPool(1, session_cls=RecordingSession)
+        pool.run('script')
+        crashed = pool.acquire()
+        pool.release(crashed)
+        self.assertRaises(MatlabSessionError, pool.run, 'crash')
+        self.assertTrue(crashed.closed)
+        pool.run('script')
+        self.assertEqual(RecordingSession.started, 2)
+
+    def test_size_limit(self):
+        pool = MatlabSessionPool(2, session_cls=RecordingSession)
+        first = pool.acquire()
+        second = pool.acquire()
+        acquired = []
+        thread = threading.Thread(target=lambda: acquired.append(
+            pool.acquire()))
+        thread.start()
+        thread.join(0.1)
+        # Blocks until one of the sessions is released
+        self.assertEqual(acquired, [])
+        pool.release(second)
+        thread.join(1)
+        self.assertEqual(acquired, [second])
+        self.assertEqual(RecordingSession.started, 2)
+        pool.release(first)
+        pool.release(second)
+        pool.close()
+        self.assertTrue(first.closed and second.closed)
+
+
+class TestSessionPoolConfig(TestCase):
+
+    def test_disabled_by_default(self):
+        orig_size = os.environ.pop(POOL_SIZE_ENV, None)
+        try:
+            self.assertIsNone(session_pool())
+        finally:
+            if orig_size is not None:
+                os.environ[POOL_SIZE_ENV] = orig_size
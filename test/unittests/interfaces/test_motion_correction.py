@@ -0,0 +1,97 @@
+import os
+import os.path
+import shutil
+import tempfile
+from unittest import TestCase
+import numpy as np
+import nibabel as nib
+from nianalysis.interfaces.custom.motion_correction import (
+    MeanDisplacementCalculation)
+
+
+class CountingMeanDisplacement(MeanDisplacementCalculation):
+    "Counts the scans whose motion mats are processed"
+
+    processed = []
+
+    def _scan_record(self, name, mats, ref_cog):
+        type(self).processed.append(name)
+        return super(CountingMeanDisplacement, self)._scan_record(
+            name, mats, ref_cog)
+
+
+class TestIncrementalMeanDisplacement(TestCase):
+
+    SCANS = (('t1', '100000.000000', '20', 2.3, 1),
+             ('epi', '100030.500000', '12.0', 2.0, 4),
+             ('t2', '100050.250000', '15', 3.0, 1))
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.orig_dir = os.getcwd()
+        CountingMeanDisplacement.processed = []
+        rng = np.random.RandomState(0)
+        ref = np.zeros((10, 10, 10))
+        ref[2:6, 3:8, 4:7] = 1
+        nib.save(nib.Nifti1Image(ref, np.eye(4)),
+                 os.path.join(self.tmp_dir, 'ref.nii.gz'))
+        for name, _, _, _, n_vols in self.SCANS:
+            mats_dir = os.path.join(self.tmp_dir, name)
+            os.mkdir(mats_dir)
+            for i in range(n_vols):
+                angle = rng.randn() * 0.05
+                mat = np.eye(4)
+                mat[:2, :2] = [[np.cos(angle), -np.sin(angle)],
+                               [np.sin(angle), np.cos(angle)]]
+                mat[:3, 3] = rng.randn(3)
+                base = os.path.join(mats_dir, 'vol{:04d}'.format(i))
+                np.savetxt(base + '_inv.mat', mat)
+                np.savetxt(base + '_mat.mat', np.linalg.inv(mat))
+
+    def tearDown(self):
+        os.chdir(self.orig_dir)
+        shutil.rmtree(self.tmp_dir)
+
+    def run_calculation(self, n_scans, records_dir=None):
+        work_dir = tempfile.mkdtemp(dir=self.tmp_dir)
+        os.chdir(work_dir)
+        scans = self.SCANS[:n_scans]
+        md = CountingMeanDisplacement(
+            motion_mats=[os.path.join(self.tmp_dir, s[0]) for s in scans],
+            start_times=[s[1] for s in scans],
+            real_durations=[s[2] for s in scans],
+            trs=[s[3] for s in scans],
+            input_names=[s[0] for s in scans],
+            reference=os.path.join(self.tmp_dir, 'ref.nii.gz'))
+        if records_dir is not None:
+            md.inputs.records_dir = records_dir
+        md.run()
+        outputs = {}
+        for fname in sorted(os.listdir(work_dir)):
+            with open(os.path.join(work_dir, fname)) as f:
+                outputs[fname] = f.read()
+        return outputs
+
+    def test_incremental(self):
+        records_dir = os.path.join(self.tmp_dir, 'records')
+        self.run_calculation(2, records_dir=records_dir)
+        self.assertEqual(CountingMeanDisplacement.processed, ['t1', 'epi'])
+        incremental = self.run_calculation(3, records_dir=records_dir)
+        self.assertEqual(CountingMeanDisplacement.processed,
+                         ['t1', 'epi', 't2'])
+        full = self.run_calculation(3)
+        self.assertEqual(incremental, full)
+        md = np.loadtxt(full['mean_displacement.txt'].split('\n'))
+        consecutive = np.loadtxt(
+            full['mean_displacement_consecutive.txt'].split('\n'))
+        self.assertEqual(len(md), 6)
+        self.assertEqual(len(consecutive), 5)
+
+    def test_changed_scan(self):
+        records_dir = os.path.join(self.tmp_dir, 'records')
+        self.run_calculation(2, records_dir=records_dir)
+        mat_path = os.path.join(self.tmp_dir, 'epi', 'vol0002_inv.mat')
+        os.utime(mat_path, (0, 0))
+        self.run_calculation(2, records_dir=records_dir)
+        self.assertEqual(CountingMeanDisplacement.processed,
+                         ['t1', 'epi', 'epi'])
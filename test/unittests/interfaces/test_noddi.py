@@ -0,0 +1,45 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase, skipUnless
+import numpy as np
+import scipy.io
+from nianalysis.interfaces.noddi import SplitROI, MergeFittedParams
+
+
+class TestSplitMerge(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.orig_dir = os.getcwd()
+        os.chdir(self.tmp_dir)
+        rng = np.random.RandomState(0)
+        # A ROI in the format created by CreateROI, with a non-numeric field
+        # that should be taken from the first chunk
+        self.roi = rng.uniform(size=(23, 5))
+        self.idx = np.arange(1, 24, dtype=float).reshape(23, 1)
+        scipy.io.savemat('roi.mat', {'roi': self.roi, 'idx': self.idx,
+                                     'model': 'WatsonSHStickTortIsoV_B0'})
+
+    def tearDown(self):
+        os.chdir(self.orig_dir)
+        shutil.rmtree(self.tmp_dir)
+
+    @skipUnless(shutil.which('matlab'), 'MATLAB is not installed')
+    def test_round_trip(self):
+        split = SplitROI(roi_file=os.path.abspath('roi.mat'),
+                         chunk_size=5).run()
+        chunks = split.outputs.out_files
+        self.assertEqual(len(chunks), 5)
+        self.assertEqual(
+            [scipy.io.loadmat(c)['roi'].shape[0] for c in chunks],
+            [5, 5, 5, 5, 3])
+        # Merging the chunks themselves (as if they were the parameters
+        # fitted for each) should restore the original ROI
+        merged = scipy.io.loadmat(MergeFittedParams(
+            in_files=chunks,
+            out_file=os.path.abspath('merged.mat')).run().outputs.out_file)
+        self.assertTrue(np.array_equal(merged['roi'], self.roi))
+        self.assertTrue(np.array_equal(merged['idx'].reshape(self.idx.shape),
+                                       self.idx))
+        self.assertEqual(merged['model'][0], 'WatsonSHStickTortIsoV_B0')
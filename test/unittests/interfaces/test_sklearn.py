@@ -0,0 +1,72 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+import numpy as np
+import nibabel as nib
+from nianalysis.interfaces.sklearn import FastICA
+
+
+def reference_ica(data, n_components, ica_type, random_state):
+    """
+    The decomposition FastICA replaced, which fitted the model twice and
+    flipped and z-scored the components one at a time
+    """
+    from sklearn.decomposition import FastICA as fICA
+    n_voxels = data.shape[0] * data.shape[1] * data.shape[2]
+    ts = data.reshape(n_voxels, data.shape[3])
+    ica_input = ts.T if ica_type == 'spatial' else ts
+    ica = fICA(n_components=n_components, random_state=random_state)
+    ica.fit(ica_input)
+    S_ = ica.fit_transform(ica_input)
+    if ica_type == 'spatial':
+        sm = ica.components_.T[:]
+        tc = S_[:]
+    else:
+        sm = S_[:]
+        tc = ica.components_.T[:]
+    ica_zscore = np.zeros(data.shape[:3] + (n_components,))
+    ica_tc = np.zeros((data.shape[3], n_components))
+    for i in range(n_components):
+        dt = sm[:, i] - np.mean(sm[:, i])
+        if np.sign(np.mean(dt ** 3) / np.mean(dt ** 2) ** 1.5) == -1:
+            sm[:, i] = -1 * sm[:, i]
+            tc[:, i] = -1 * tc[:, i]
+        vstd = np.linalg.norm(sm[:, i]) / np.sqrt(n_voxels - 1)
+        ica_zscore[:, :, :, i] = sm[:, i].reshape(data.shape[:3]) / vstd
+        ica_tc[:, i] = tc[:, i]
+    return ica_zscore, ica_tc, S_
+
+
+class TestFastICA(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.orig_dir = os.getcwd()
+        os.chdir(self.tmp_dir)
+        rng = np.random.RandomState(0)
+        # Mixtures of positively and negatively skewed sources
+        sources = np.column_stack((rng.exponential(size=6 * 5 * 4),
+                                   -rng.exponential(size=6 * 5 * 4),
+                                   rng.uniform(size=6 * 5 * 4)))
+        mixing = rng.normal(size=(3, 12))
+        self.data = np.dot(sources, mixing).reshape(6, 5, 4, 12)
+        nib.save(nib.Nifti1Image(self.data, np.eye(4)), 'volume.nii.gz')
+
+    def tearDown(self):
+        os.chdir(self.orig_dir)
+        shutil.rmtree(self.tmp_dir)
+
+    def test_parity(self):
+        for ica_type in ('spatial', 'temporal'):
+            result = FastICA(volume=os.path.abspath('volume.nii.gz'),
+                             n_components=3, ica_type=ica_type,
+                             random_state=1).run()
+            ref_zscore, ref_tc, ref_mixing = reference_ica(
+                self.data, 3, ica_type, 1)
+            zscore = nib.load(result.outputs.ica_decomposition).get_fdata()
+            tc = nib.load(result.outputs.ica_timeseries).get_fdata()
+            self.assertTrue(np.allclose(zscore, ref_zscore))
+            self.assertTrue(np.allclose(tc.reshape(ref_tc.shape), ref_tc))
+            self.assertTrue(np.allclose(
+                np.loadtxt(result.outputs.mixing_mat), ref_mixing))
@@ -0,0 +1,97 @@
+import os
+import os.path
+import stat
+import shutil
+import tempfile
+from unittest import TestCase
+from nianalysis.conversion_cache import (
+    ConversionCache, CachedConversionMixin)
+
+
+class TestConversionCache(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache = ConversionCache(os.path.join(self.tmp_dir, 'cache'),
+                                     max_size=250)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def make_series(self, name, contents):
+        series_dir = os.path.join(self.tmp_dir, name)
+        os.makedirs(series_dir)
+        for i, content in enumerate(contents):
+            with open(os.path.join(series_dir,
+                                   '{}.dcm'.format(i)), 'w') as f:
+                f.write(content)
+        return series_dir
+
+    def make_output(self, name, size):
+        out_dir = os.path.join(self.tmp_dir, name)
+        os.makedirs(out_dir)
+        path = os.path.join(out_dir, 'converted.nii.gz')
+        with open(path, 'w') as f:
+            f.write('x' * size)
+        return path
+
+    def test_key(self):
+        series = self.make_series('series', ['a', 'b'])
+        copied = os.path.join(self.tmp_dir, 'copied')
+        shutil.copytree(series, copied)
+        key = self.cache.key(series, 'Dcm2niix', {'compression': 'y'})
+        # Independent of the location of the series
+        self.assertEqual(
+            key, self.cache.key(copied, 'Dcm2niix', {'compression': 'y'}))
+        # Dependent on the converter, its options and the contents
+        self.assertNotEqual(
+            key, self.cache.key(series, 'MRConvert', {'compression': 'y'}))
+        self.assertNotEqual(
+            key, self.cache.key(series, 'Dcm2niix', {'compression': 'n'}))
+        different = self.make_series('different', ['a', 'c'])
+        self.assertNotEqual(
+            key, self.cache.key(different, 'Dcm2niix', {'compression': 'y'}))
+
+    def test_store_fetch(self):
+        out_dir = os.path.join(self.tmp_dir, 'node')
+        os.makedirs(out_dir)
+        self.assertIsNone(self.cache.fetch('key', out_dir))
+        converted = self.make_output('converted', 100)
+        self.cache.store('key', [converted])
+        self.assertEqual(self.cache.fetch('key', out_dir),
+                         ['converted.nii.gz'])
+        fetched = os.path.join(out_dir, 'converted.nii.gz')
+        with open(fetched) as f:
+            self.assertEqual(f.read(), 'x' * 100)
+        # Fetching again replaces the previously linked file
+        self.assertEqual(self.cache.fetch('key', out_dir),
+                         ['converted.nii.gz'])
+        # The cached files (and the links to them) can't be modified in
+        # place
+        for path in (converted, fetched,
+                     os.path.join(self.cache.cache_dir, 'key',
+                                  'converted.nii.gz')):
+            self.assertFalse(os.stat(path).st_mode &
+                             (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+    def test_default_output_dir(self):
+        orig_dir = os.getcwd()
+        os.chdir(self.tmp_dir)
+        try:
+            self.assertEqual(CachedConversionMixin()._cache_output_dir(),
+                             os.getcwd())
+        finally:
+            os.chdir(orig_dir)
+
+    def test_evict_least_recently_used(self):
+        for i, key in enumerate(('first', 'second')):
+            self.cache.store(key, [self.make_output(key, 100)])
+            os.utime(os.path.join(self.cache.cache_dir, key), (i, i))
+        out_dir = os.path.join(self.tmp_dir, 'node')
+        os.makedirs(out_dir)
+        # Fetching 'first' makes 'second' the least recently used
+        self.cache.fetch('first', out_dir)
+        self.cache.store('third', [self.make_output('third', 100)])
+        self.assertEqual(sorted(e[0] for e in self.cache.entries()),
+                         ['first', 'third'])
+        self.assertLessEqual(self.cache.size(), 250)
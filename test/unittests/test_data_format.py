@@ -2,11 +2,14 @@ from unittest import TestCase
 from nipype.interfaces.utility import IdentityInterface
 from arcana.testing import BaseTestCase
 from arcana.interfaces.mrtrix import MRConvert
-from arcana.exception import ArcanaModulesNotInstalledException
+from arcana.exception import (
+    ArcanaModulesNotInstalledException, ArcanaNoConverterError)
 from arcana.file_format import (
-    Converter)
+    Converter, FileFormat, IdentityConverter)
 from nianalysis.file_format import (dicom_format, mrtrix_format,
-                                    nifti_gz_format)
+                                    nifti_gz_format, nifti_format,
+                                    MrtrixConverter, PlannedConverter,
+                                    conversion_plan)
 from arcana.requirement import Requirement
 from arcana.node import Node
 from arcana.study.base import Study, StudyMetaClass
@@ -76,3 +79,76 @@ class TestDicom2Niix(BaseTestCase):
                              dicom_format, 't2_tse_tra_p2_448')])
         study.data('output_dataset')[0]
         self.assertDatasetCreated('output_dataset.nii.gz', study.name)
+
+
+class TestConversionPlan(TestCase):
+
+    # Only converts from MRtrix format
+    from_mrtrix_format = FileFormat(
+        name='planner_from_mrtrix', extension='.plan1',
+        converters={'mrtrix': MrtrixConverter})
+    # Converts from either NIfTI or NIfTI.gz
+    from_nifti_format = FileFormat(
+        name='planner_from_nifti', extension='.plan2',
+        converters={'nifti': IdentityConverter,
+                    'nifti_gz': IdentityConverter})
+
+    # Converts from NIfTI.gz through a planned conversion via MRtrix format
+    planned_format = FileFormat(
+        name='planner_planned', extension='.plan3',
+        converters={'mrtrix': MrtrixConverter,
+                    'nifti_gz': PlannedConverter})
+    # Only has a planned converter, which can't be used to plan itself
+    planned_only_format = FileFormat(
+        name='planner_planned_only', extension='.plan4',
+        converters={'nifti': PlannedConverter})
+
+    @classmethod
+    def setUpClass(cls):
+        for file_format in (cls.from_mrtrix_format, cls.from_nifti_format,
+                            cls.planned_format, cls.planned_only_format):
+            FileFormat.register(file_format)
+
+    def test_direct(self):
+        self.assertEqual(conversion_plan(dicom_format, nifti_gz_format),
+                         [(dicom_format, nifti_gz_format,
+                           type(nifti_gz_format.converter_from(
+                               dicom_format)))])
+
+    def test_collapse_mrtrix_steps(self):
+        self.assertEqual(
+            conversion_plan(nifti_gz_format, self.from_mrtrix_format),
+            [(nifti_gz_format, self.from_mrtrix_format, MrtrixConverter)])
+
+    def test_no_gzipped_intermediates(self):
+        self.assertEqual(
+            conversion_plan(mrtrix_format, self.from_nifti_format),
+            [(mrtrix_format, nifti_format, MrtrixConverter),
+             (nifti_format, self.from_nifti_format, IdentityConverter)])
+
+    def test_planned_converters_excluded(self):
+        self.assertEqual(
+            conversion_plan(nifti_gz_format, self.planned_format),
+            [(nifti_gz_format, self.planned_format, MrtrixConverter)])
+        self.assertRaises(ArcanaNoConverterError, conversion_plan,
+                          nifti_format, self.planned_only_format)
+
+    def test_planned_converter_node(self):
+        converter = self.planned_format.converter_from(nifti_gz_format)
+        self.assertIsInstance(converter, PlannedConverter)
+        node, in_field, out_field = converter.get_node('planned')
+        self.assertEqual((in_field, out_field), ('in_file', 'out_file'))
+        # Swap the last step for a non-MRtrix converter to get a workflow
+        self.planned_format._converters['mrtrix'] = IdentityConverter
+        try:
+            converter = self.planned_format.converter_from(nifti_gz_format)
+            self.assertEqual(
+                converter.plan,
+                [(nifti_gz_format, mrtrix_format, MrtrixConverter),
+                 (mrtrix_format, self.planned_format, IdentityConverter)])
+            workflow, in_field, out_field = converter.get_node('planned')
+            self.assertEqual(in_field, 'inputnode.in_file')
+            self.assertEqual(out_field, 'outputnode.out_file')
+            self.assertEqual(len(workflow.list_node_names()), 4)
+        finally:
+            self.planned_format._converters['mrtrix'] = MrtrixConverter
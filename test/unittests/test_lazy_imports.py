@@ -0,0 +1,34 @@
+import os.path
+import sys
+import subprocess
+from unittest import TestCase
+
+package_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..',
+                                            '..'))
+
+# Optional dependencies that should only be imported when an interface that
+# needs them is run, not by every worker process that imports the module
+LAZY_MODULES = ('matplotlib', 'sklearn', 'scipy.ndimage', 'scipy.signal')
+
+INTERFACE_MODULES = ('nianalysis.interfaces.custom.motion_correction',
+                     'nianalysis.interfaces.custom.pet',
+                     'nianalysis.interfaces.sklearn',
+                     'nianalysis.interfaces.fsl')
+
+
+class TestLazyImports(TestCase):
+
+    def test_interface_modules(self):
+        script = ('import sys\n' +
+                  ''.join('import {}\n'.format(m)
+                          for m in INTERFACE_MODULES) +
+                  'print(",".join(m for m in {!r} if m in sys.modules))'
+                  .format(LAZY_MODULES))
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+            p for p in (package_path, env.get('PYTHONPATH')) if p)
+        output = subprocess.check_output([sys.executable, '-c', script],
+                                         env=env)
+        imported = output.decode().strip().split('\n')[-1]
+        self.assertEqual(imported, '',
+                         "Imported at module level: {}".format(imported))
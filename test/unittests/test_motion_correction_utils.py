@@ -0,0 +1,116 @@
+import os
+import os.path
+import shutil
+import tempfile
+from unittest import TestCase
+from nianalysis.motion_correction_utils import (
+    ScanMetadataCache, check_image_type, clear_motion_detection_outputs,
+    merge_scan_assignment)
+
+
+class CountingMetadataCache(ScanMetadataCache):
+    "Stands in for the header probe, counting the scans it is run on"
+
+    probed = []
+
+    def _probe_header(self, scan):
+        type(self).probed.append(scan)
+        image_type = (['ORIGINAL', 'PRIMARY', 'P', 'ND'] if 'phase' in scan
+                      else ['ORIGINAL', 'PRIMARY', 'M', 'ND'])
+        return {'series_description': scan,
+                'image_type': image_type,
+                'resolution': 1.0,
+                'sequence_name': 'tfl'}
+
+
+class TestScanMetadataCache(TestCase):
+
+    def setUp(self):
+        self.session_dir = tempfile.mkdtemp()
+        CountingMetadataCache.probed = []
+        for scan in ('01_t1', '02_phase'):
+            self.make_scan(scan, 2)
+
+    def tearDown(self):
+        shutil.rmtree(self.session_dir)
+
+    def make_scan(self, scan, n_files):
+        scan_dir = os.path.join(self.session_dir, scan)
+        if not os.path.exists(scan_dir):
+            os.mkdir(scan_dir)
+        for i in range(n_files):
+            open(os.path.join(scan_dir, '{}.dcm'.format(i)), 'w').close()
+
+    def test_persisted(self):
+        cache = CountingMetadataCache(self.session_dir)
+        self.assertEqual(cache.get('01_t1', 'resolution'), 1.0)
+        self.assertEqual(cache.get('01_t1', 'sequence_name'), 'tfl')
+        self.assertEqual(CountingMetadataCache.probed, ['01_t1'])
+        # Reloaded from the JSON file
+        cache = CountingMetadataCache(self.session_dir)
+        self.assertEqual(cache.get('01_t1', 'image_type'),
+                         ['ORIGINAL', 'PRIMARY', 'M', 'ND'])
+        self.assertEqual(CountingMetadataCache.probed, ['01_t1'])
+
+    def test_invalidated(self):
+        cache = CountingMetadataCache(self.session_dir)
+        cache.get('01_t1', 'resolution')
+        cache.get('02_phase', 'resolution')
+        self.make_scan('02_phase', 3)
+        cache = CountingMetadataCache(self.session_dir)
+        cache.get('01_t1', 'resolution')
+        cache.get('02_phase', 'resolution')
+        # Only the scan that changed is probed again
+        self.assertEqual(CountingMetadataCache.probed,
+                         ['01_t1', '02_phase', '02_phase'])
+
+    def test_check_image_type(self):
+        os.mkdir(os.path.join(self.session_dir, '03_empty'))
+        CountingMetadataCache(self.session_dir).get('02_phase', 'image_type')
+        CountingMetadataCache(self.session_dir).get('01_t1', 'image_type')
+        phase, no_dicom = check_image_type(
+            self.session_dir, ['01_t1', '02_phase', '03_empty'])
+        self.assertEqual(phase, ['02_phase'])
+        self.assertEqual(no_dicom, ['03_empty'])
+
+
+class TestClearMotionDetectionOutputs(TestCase):
+
+    def setUp(self):
+        self.session_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.session_dir)
+
+    def test_clear(self):
+        for fname in ('MC_mean_displacement.txt', 'MC_timestamps',
+                      'MC_mean_displacement_rc.txt', 'MC_t1_0_motion_mats'):
+            path = os.path.join(self.session_dir, fname)
+            if fname.endswith('.txt'):
+                open(path, 'w').close()
+            else:
+                os.mkdir(path)
+        clear_motion_detection_outputs(
+            self.session_dir, 'MC', ['mean_displacement', 'timestamps'])
+        self.assertEqual(
+            sorted(os.listdir(self.session_dir)),
+            ['MC_mean_displacement_rc.txt', 'MC_t1_0_motion_mats'])
+
+
+class TestMergeScanAssignment(TestCase):
+
+    def test_append_only(self):
+        previous = ['03_t2_1mm', 't2', ['01_t1'], [], ['04_b0_ap'],
+                    [['05_dwi', '0']]]
+        # A new higher resolution T2 would now be chosen as the reference,
+        # with the previous reference and the unused b0 moved after it
+        current = ['06_t2_07mm', 't2', ['01_t1', '07_t1'], ['08_bold'],
+                   ['03_t2_1mm', '09_t2', '04_b0_ap'],
+                   [['05_dwi', '0'], ['10_b0_pa', '-1']]]
+        self.assertEqual(
+            merge_scan_assignment(previous, current),
+            ['03_t2_1mm', 't2', ['01_t1', '07_t1'], ['08_bold'],
+             ['04_b0_ap', '06_t2_07mm', '09_t2'],
+             [['05_dwi', '0'], ['10_b0_pa', '-1']]])
+        # Previous classification is left unchanged
+        self.assertEqual(previous[4], ['04_b0_ap'])
@@ -0,0 +1,75 @@
+import os
+import os.path
+import gzip
+import shutil
+import tempfile
+from unittest import TestCase
+import numpy as np
+import nibabel as nib
+from nianalysis.output_policy import (
+    save_nifti, gzip_file, GZIP_LEVEL_ENV, PARALLEL_GZIP_ENV)
+from nianalysis.interfaces.utils import GzipImage
+
+
+class TestOutputPolicy(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.orig_env = {k: os.environ.get(k)
+                         for k in (GZIP_LEVEL_ENV, PARALLEL_GZIP_ENV)}
+        os.environ.pop(PARALLEL_GZIP_ENV, None)
+        self.img = nib.Nifti1Image(
+            np.arange(4096, dtype=np.float32).reshape(16, 16, 16),
+            np.eye(4))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        for key, value in self.orig_env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+    def test_save_uncompressed(self):
+        path = save_nifti(self.img, os.path.join(self.tmp_dir, 'img.nii'))
+        with open(path, 'rb') as f:
+            self.assertNotEqual(f.read(2), b'\x1f\x8b')
+        self.assertTrue(np.array_equal(nib.load(path).get_data(),
+                                       self.img.get_data()))
+
+    def test_save_compression_level(self):
+        sizes = []
+        for level in ('0', '9'):
+            os.environ[GZIP_LEVEL_ENV] = level
+            path = save_nifti(self.img, os.path.join(
+                self.tmp_dir, 'img{}.nii.gz'.format(level)))
+            self.assertTrue(np.array_equal(nib.load(path).get_data(),
+                                           self.img.get_data()))
+            sizes.append(os.path.getsize(path))
+        self.assertGreater(sizes[0], sizes[1])
+
+    def test_gzip_file(self):
+        path = os.path.join(self.tmp_dir, 'file.txt')
+        with open(path, 'wb') as f:
+            f.write(b'x' * 1000)
+        gz_path = gzip_file(path)
+        self.assertEqual(gz_path, path + '.gz')
+        self.assertFalse(os.path.exists(path))
+        with gzip.open(gz_path, 'rb') as f:
+            self.assertEqual(f.read(), b'x' * 1000)
+
+    def test_gzip_image(self):
+        path = save_nifti(self.img, os.path.join(self.tmp_dir, 'img.nii'))
+        work_dir = os.path.join(self.tmp_dir, 'work')
+        os.mkdir(work_dir)
+        orig_dir = os.getcwd()
+        os.chdir(work_dir)
+        try:
+            out_file = GzipImage(in_file=path).run().outputs.out_file
+        finally:
+            os.chdir(orig_dir)
+        self.assertEqual(out_file, os.path.join(work_dir, 'img.nii.gz'))
+        # The input is left in place for any other nodes that consume it
+        self.assertTrue(os.path.exists(path))
+        self.assertTrue(np.array_equal(nib.load(out_file).get_data(),
+                                       self.img.get_data()))
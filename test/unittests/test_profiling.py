@@ -0,0 +1,86 @@
+import os.path
+import sys
+import shutil
+import tempfile
+import subprocess
+from unittest import TestCase, skipUnless
+from nianalysis.profiling import (
+    ResourceMonitor, save_record, write_report, suggest_resources)
+
+
+class TestProfiling(TestCase):
+
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+        self.work_dir = '/work'
+
+    def tearDown(self):
+        shutil.rmtree(self.profile_dir)
+
+    def record(self, node_dir, wall_time, peak_rss_mb):
+        save_record(
+            {'interface': 'nianalysis.interfaces.a.B', 'failed': False,
+             'node_dir': os.path.join(self.work_dir, node_dir),
+             'wall_time': wall_time, 'cpu_time': wall_time,
+             'peak_rss_mb': peak_rss_mb, 'read_bytes': 10,
+             'write_bytes': None}, self.profile_dir)
+
+    def test_monitor(self):
+        with ResourceMonitor() as monitor:
+            data = bytearray(50 * 1024 ** 2)
+            del data
+        self.assertGreater(monitor.record['wall_time'], 0)
+        self.assertGreaterEqual(monitor.record['peak_rss_mb'], 50)
+        self.assertFalse(monitor.record['failed'])
+
+    @skipUnless(os.path.exists('/proc/self/io'), 'I/O accounting unavailable')
+    def test_monitor_child_io(self):
+        # The bytes written to storage by the tools run as child processes
+        # should be counted
+        path = os.path.join(self.profile_dir, 'out.bin')
+        script = ("import os\n"
+                  "with open({!r}, 'wb') as f:\n"
+                  "    f.write(b'0' * 5 * 1024 ** 2)\n"
+                  "    f.flush()\n"
+                  "    os.fsync(f.fileno())\n").format(path)
+        with ResourceMonitor() as monitor:
+            subprocess.check_call([sys.executable, '-c', script])
+        self.assertGreaterEqual(monitor.record['write_bytes'],
+                                5 * 1024 ** 2)
+
+    def test_report(self):
+        # Nodes are run in '<work_dir>/<top-level workflow>/<pipeline>/
+        # <iterable dirs>/<node>', with the top-level workflow named after
+        # all the pipelines run together
+        top = 'pipeline1_pipeline2'
+        sess1 = '_subject_id_01/_visit_id_1'
+        sess2 = '_subject_id_02/_visit_id_1'
+        self.record(top + '/pipeline1/' + sess1 + '/node1', 30, 1000)
+        self.record(top + '/pipeline1/' + sess2 + '/node1', 90, 3000)
+        self.record(top + '/pipeline1/' + sess1 + '/node2/mapflow/_node20',
+                    700, 100)
+        self.record(top + '/pipeline1/' + sess1 + '/node2/mapflow/_node21',
+                    10, 200)
+        self.record(top + '/pipeline2/_visit_id_1/node1', 1, 1)
+        report_path = os.path.join(self.profile_dir, 'report.txt')
+        # The pipelines should be the same whether or not the work directory
+        # is provided
+        for work_dir in (self.work_dir, None):
+            summary = write_report(self.profile_dir, report_path,
+                                   work_dir=work_dir)
+            self.assertEqual(sorted(summary), ['pipeline1', 'pipeline2'])
+            self.assertEqual(sorted(summary['pipeline1']),
+                             ['node1', 'node2'])
+            node1 = summary['pipeline1']['node1']
+            self.assertEqual(node1['runs'], 2)
+            self.assertEqual(node1['wall_time']['max'], 90)
+            self.assertEqual(node1['peak_rss_mb']['mean'], 2000)
+            self.assertNotIn('write_bytes', node1)
+            self.assertEqual(summary['pipeline1']['node2']['runs'], 2)
+        suggestions = suggest_resources(summary)
+        self.assertEqual(suggestions['pipeline1']['node1'],
+                         {'wall_time': 3, 'memory': 4000})
+        self.assertEqual(suggestions['pipeline1']['node2'],
+                         {'wall_time': 18, 'memory': 500})
+        self.assertEqual(suggestions['pipeline2']['node1'],
+                         {'wall_time': 1, 'memory': 500})
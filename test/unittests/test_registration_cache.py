@@ -0,0 +1,89 @@
+import os
+import os.path
+import shutil
+import tempfile
+from unittest import TestCase
+from nipype.interfaces.base import (
+    BaseInterface, BaseInterfaceInputSpec, TraitedSpec, File, traits)
+from nianalysis.registration_cache import (
+    CachedRegistrationMixin, CACHE_DIR_ENV)
+
+
+class FakeRegistrationInputSpec(BaseInterfaceInputSpec):
+
+    input_file = File(exists=True, mandatory=True)
+    ref_file = File(exists=True, mandatory=True)
+    out_prefix = traits.Str(mandatory=True)
+    num_threads = traits.Int()
+
+
+class FakeRegistrationOutputSpec(TraitedSpec):
+
+    regmat = File(exists=True)
+
+
+class RegisteringBase(object):
+
+    def _run_interface(self, runtime):
+        type(self).runs += 1
+        with open(self.inputs.out_prefix + '_0GenericAffine.mat', 'w') as f:
+            f.write('affine of ' + open(self.inputs.input_file).read())
+        runtime.returncode = 0
+        return runtime
+
+
+class CountingRegistration(CachedRegistrationMixin, RegisteringBase,
+                           BaseInterface):
+
+    input_spec = FakeRegistrationInputSpec
+    output_spec = FakeRegistrationOutputSpec
+    cache_ignore = ('num_threads',)
+    runs = 0
+
+    def _list_outputs(self):
+        outputs = self._outputs().get()
+        outputs['regmat'] = os.path.abspath(
+            self.inputs.out_prefix + '_0GenericAffine.mat')
+        return outputs
+
+
+class TestRegistrationCache(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.orig_dir = os.getcwd()
+        self.orig_env = os.environ.get(CACHE_DIR_ENV)
+        os.environ[CACHE_DIR_ENV] = os.path.join(self.tmp_dir, 'cache')
+        CountingRegistration.runs = 0
+        for name in ('t1', 't1_copy', 'other', 'template'):
+            with open(os.path.join(self.tmp_dir, name + '.nii'), 'w') as f:
+                f.write('other' if name == 'other' else name[:2])
+
+    def tearDown(self):
+        os.chdir(self.orig_dir)
+        if self.orig_env is None:
+            os.environ.pop(CACHE_DIR_ENV)
+        else:
+            os.environ[CACHE_DIR_ENV] = self.orig_env
+        shutil.rmtree(self.tmp_dir)
+
+    def register(self, moving, prefix, num_threads=1):
+        work_dir = tempfile.mkdtemp(dir=self.tmp_dir)
+        os.chdir(work_dir)
+        result = CountingRegistration(
+            input_file=os.path.join(self.tmp_dir, moving + '.nii'),
+            ref_file=os.path.join(self.tmp_dir, 'template.nii'),
+            out_prefix=prefix, num_threads=num_threads).run()
+        with open(result.outputs.regmat) as f:
+            return os.path.basename(result.outputs.regmat), f.read()
+
+    def test_shared_between_nodes(self):
+        self.assertEqual(self.register('t1', 'T12MNI'),
+                         ('T12MNI_0GenericAffine.mat', 'affine of t1'))
+        # Same contents under a different name, prefix and thread count
+        self.assertEqual(self.register('t1_copy', 'brain2MNI',
+                                       num_threads=4),
+                         ('brain2MNI_0GenericAffine.mat', 'affine of t1'))
+        self.assertEqual(CountingRegistration.runs, 1)
+        self.register('other', 'T12MNI')
+        self.assertEqual(CountingRegistration.runs, 2)
@@ -0,0 +1,81 @@
+import tempfile
+import shutil
+from multiprocessing import cpu_count
+from unittest import TestCase
+from arcana.node import Node
+from nipype.interfaces.ants import ApplyTransforms
+from nianalysis.interfaces.ants import AntsRegSyn
+from nianalysis.interfaces.dti import FitDTI
+from nianalysis.interfaces.sklearn import FastICA
+from nianalysis.runner import (
+    set_node_threads, local_runner, LinearRunner, MultiProcRunner,
+    THREAD_ENV_VARS)
+
+
+class TestThreadBudget(TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_set_node_threads(self):
+        reg = Node(AntsRegSyn(out_prefix='reg'), name='reg', nthreads=4)
+        reg.interface.inputs.environ = {'OMP_NUM_THREADS': '2'}
+        set_node_threads(reg)
+        self.assertEqual(reg.interface.inputs.num_threads, 4)
+        environ = reg.interface.inputs.environ
+        self.assertEqual(environ['ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS'], '4')
+        self.assertEqual(environ['OMP_NUM_THREADS'], '2')
+        fit = Node(FitDTI(), name='fit', nthreads=3)
+        set_node_threads(fit)
+        self.assertEqual(fit.interface.inputs.nthreads, 3)
+        ica = Node(FastICA(), name='ica', nthreads=2)
+        set_node_threads(ica)
+        self.assertEqual(ica.interface.inputs.n_threads, 2)
+        # An explicit single thread is passed on even though it matches
+        # arcana's default
+        single = Node(ApplyTransforms(), name='single', nthreads=1)
+        set_node_threads(single)
+        self.assertEqual(single.interface.inputs.num_threads, 1)
+        for var in THREAD_ENV_VARS:
+            self.assertEqual(single.interface.inputs.environ[var], '1')
+        # Nodes created without 'nthreads' are left to their tools' defaults
+        apply_trans = Node(ApplyTransforms(), name='apply_trans')
+        set_node_threads(apply_trans)
+        for var in THREAD_ENV_VARS:
+            self.assertNotIn(var, apply_trans.interface.inputs.environ)
+
+    def test_packing(self):
+        runner = MultiProcRunner(self.work_dir, num_processes=8, memory_gb=16)
+        reg = Node(AntsRegSyn(out_prefix='reg'), name='reg', nthreads=16)
+        apply_trans = Node(ApplyTransforms(), name='apply_trans',
+                           memory=24000)
+        runner._budget_node(reg)
+        runner._budget_node(apply_trans)
+        self.assertEqual(reg.n_procs, 8)
+        self.assertEqual(reg.interface.inputs.num_threads, 8)
+        self.assertEqual(apply_trans.n_procs, 1)
+        self.assertEqual(apply_trans.mem_gb, 16)
+        for var in THREAD_ENV_VARS:
+            self.assertNotIn(var, apply_trans.interface.inputs.environ)
+
+    def test_linear(self):
+        runner = LinearRunner(self.work_dir)
+        self.assertEqual(runner.num_threads, cpu_count())
+        apply_trans = Node(ApplyTransforms(), name='apply_trans')
+        reg = Node(AntsRegSyn(out_prefix='reg'), name='reg', nthreads=4)
+        runner = LinearRunner(self.work_dir, num_threads=6)
+        for node in (apply_trans, reg):
+            runner._budget_node(node)
+            self.assertEqual(node.interface.inputs.num_threads, 6)
+            for var in THREAD_ENV_VARS:
+                self.assertEqual(node.interface.inputs.environ[var], '6')
+
+    def test_local_runner(self):
+        self.assertIsInstance(local_runner(self.work_dir), LinearRunner)
+        runner = local_runner(self.work_dir, num_processes=4, memory_gb=8)
+        self.assertIsInstance(runner, MultiProcRunner)
+        self.assertEqual(runner.num_processes, 4)
+        self.assertEqual(runner.memory_gb, 8)
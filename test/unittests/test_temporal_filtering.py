@@ -0,0 +1,111 @@
+import os.path
+import shutil
+import tempfile
+import subprocess as sp
+from unittest import TestCase, skipUnless
+import numpy as np
+import nibabel as nib
+from nianalysis.temporal_filtering import (
+    bptf_highpass, tproject_regressors, project_out)
+
+
+def reference_bptf_highpass(array, hp_sigma):
+    "Line by line transliteration of the high-pass in FSL's newimagefns.cc"
+    mask_size = int(hp_sigma * 3)
+    out = np.array(array, dtype=float)
+    n = len(array)
+    c0 = 0.0
+    for t in range(n):
+        A = B = C = D = N = 0.0
+        for tt in range(max(t - mask_size, 0), min(t + mask_size, n - 1) + 1):
+            dt = tt - t
+            w = np.exp(-0.5 * dt * dt / (hp_sigma * hp_sigma))
+            A += w * dt
+            B += w * array[tt]
+            C += w * dt * dt
+            D += w * dt * array[tt]
+            N += w
+        denom = C * N - A * A
+        if denom != 0:
+            c = (B * C - A * D) / denom
+            if t == 0:
+                c0 = c
+            out[t] = c0 + array[t] - c
+    return out
+
+
+class TestBPTFHighpass(TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(1)
+        n_times = 150
+        drift = np.linspace(0, 5, n_times)[:, np.newaxis]
+        self.confounds = rng.randn(n_times, 24) + drift
+
+    def test_matches_reference(self):
+        for hp_sigma in (0.4, 2.5, 25.0, 500.0):
+            filtered = bptf_highpass(self.confounds, hp_sigma)
+            for i in range(self.confounds.shape[1]):
+                self.assertTrue(np.allclose(
+                    filtered[:, i],
+                    reference_bptf_highpass(self.confounds[:, i], hp_sigma)))
+
+    def test_no_filter(self):
+        self.assertTrue(np.array_equal(
+            bptf_highpass(self.confounds, -1), self.confounds))
+
+    @skipUnless(shutil.which('fslmaths'), 'FSL is not installed')
+    def test_matches_fslmaths(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            in_path = os.path.join(tmp_dir, 'confounds.nii.gz')
+            out_path = os.path.join(tmp_dir, 'confounds_hp.nii.gz')
+            n_times, n_conf = self.confounds.shape
+            nib.save(nib.Nifti1Image(
+                np.reshape(self.confounds.T, (n_conf, 1, 1, n_times),
+                           order='F').astype(np.float32), affine=np.eye(4)),
+                in_path)
+            hp_sigma = 0.5 * 100.0 / 2.0
+            sp.check_call(['fslmaths', in_path, '-bptf', str(hp_sigma), '-1',
+                           out_path])
+            fsl_filtered = np.reshape(
+                nib.load(out_path).get_data(), (n_conf, n_times),
+                order='F').T
+            self.assertTrue(np.allclose(
+                bptf_highpass(self.confounds.astype(np.float32), hp_sigma),
+                fsl_filtered, atol=1e-4))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+class TestTproject(TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(2)
+        self.n_times = 200
+        self.tr = 2.0
+        t = np.arange(self.n_times)
+        self.signal = rng.randn(self.n_times, 10)
+        # Quadratic drift plus a sinusoid at the lowest discrete frequency
+        # (0.0025 Hz), which falls within the stop band
+        self.timeseries = (
+            self.signal + 0.01 * (t - 100)[:, np.newaxis] ** 2 +
+            5 * np.cos(2 * np.pi * t / self.n_times)[:, np.newaxis])
+
+    def test_regressors(self):
+        regressors = tproject_regressors(self.n_times, self.tr, polort=3,
+                                         stopband=(0, 0.01))
+        # 4 polynomials and a cosine and sine for frequencies 1 to 4
+        self.assertEqual(regressors.shape, (self.n_times, 12))
+        self.assertEqual(np.linalg.matrix_rank(regressors), 12)
+
+    def test_project_out(self):
+        regressors = tproject_regressors(self.n_times, self.tr, polort=3,
+                                         stopband=(0, 0.01))
+        residuals = project_out(self.timeseries, regressors)
+        # The residuals are orthogonal to the regressors and the same as
+        # projecting the regressors out of the signal alone
+        self.assertTrue(np.allclose(np.dot(regressors.T, residuals), 0,
+                                    atol=1e-8))
+        self.assertTrue(np.allclose(residuals,
+                                    project_out(self.signal, regressors)))
@@ -0,0 +1,76 @@
+import os.path
+import shutil
+import tempfile
+import subprocess as sp
+from unittest import TestCase, skipUnless
+import numpy as np
+import nibabel as nib
+from nianalysis.testing import ImageStatistics, CachedImageSlabs
+
+
+class TestImageStatistics(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        rng = np.random.RandomState(1)
+        self.data = rng.randn(10, 12, 37, 3).astype(np.float32)
+        self.data[0, 0, 0, 0] = np.nan
+        self.data[1, 1, 1, 1] = np.inf
+        self.ref = rng.randn(10, 12, 37, 3).astype(np.float32)
+        self.path = os.path.join(self.tmp_dir, 'image.nii.gz')
+        nib.save(nib.Nifti1Image(self.data, np.eye(4)), self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_statistics(self):
+        stats = ImageStatistics.of(nib.load(self.path), slab=5)
+        for i in range(self.data.shape[3]):
+            vol = self.data[..., i].astype(float)
+            vol = vol[np.isfinite(vol)]
+            self.assertAlmostEqual(stats['mean'][i], np.mean(vol))
+            self.assertAlmostEqual(stats['median'][i], np.median(vol))
+            self.assertAlmostEqual(stats['std'][i], np.std(vol, ddof=1))
+            self.assertEqual(stats['min'][i], np.min(vol))
+            self.assertEqual(stats['max'][i], np.max(vol))
+            self.assertEqual(stats['count'][i], len(vol))
+
+    def test_difference(self):
+        stats = ImageStatistics.of_difference(
+            nib.load(self.path), self.ref, statistics=['mean', 'std'],
+            slab=4)
+        self.assertEqual(sorted(stats), ['mean', 'std'])
+        diff = (self.data - self.ref)[..., 2].astype(float)
+        self.assertAlmostEqual(stats['mean'][2], np.mean(diff))
+        self.assertAlmostEqual(stats['std'][2], np.std(diff, ddof=1))
+
+    def test_difference_cached_ref(self):
+        ref_path = os.path.join(self.tmp_dir, 'ref.nii.gz')
+        nib.save(nib.Nifti1Image(self.ref, np.eye(4)), ref_path)
+        ref = CachedImageSlabs(ref_path)
+        expected = ImageStatistics.of_difference(nib.load(self.path),
+                                                 self.ref)
+        for _ in range(2):  # The second time from the cached slabs
+            stats = ImageStatistics.of_difference(
+                nib.load(self.path, keep_file_open=True), ref)
+            for stat in ImageStatistics.STATISTICS:
+                self.assertTrue(np.allclose(stats[stat], expected[stat]))
+
+    def test_single_volume(self):
+        path = os.path.join(self.tmp_dir, 'volume.nii.gz')
+        nib.save(nib.Nifti1Image(self.data[..., 2], np.eye(4)), path)
+        stats = ImageStatistics.of(nib.load(path), slab=5)
+        vol = self.data[..., 2].astype(float)
+        self.assertEqual(len(stats['mean']), 1)
+        self.assertAlmostEqual(stats['mean'][0], np.mean(vol))
+        self.assertAlmostEqual(stats['median'][0], np.median(vol))
+        self.assertAlmostEqual(stats['std'][0], np.std(vol, ddof=1))
+
+    @skipUnless(shutil.which('mrstats'), 'MRtrix is not installed')
+    def test_matches_mrstats(self):
+        stats = ImageStatistics.of(nib.load(self.path))
+        for stat in ImageStatistics.STATISTICS:
+            mrstats = [float(v) for v in sp.check_output(
+                ['mrstats', self.path, '-output', stat]).split()]
+            self.assertTrue(np.allclose(stats[stat], mrstats, rtol=1e-5),
+                            "'{}' doesn't match mrstats".format(stat))
@@ -0,0 +1,103 @@
+import os
+import os.path
+import json
+import shutil
+import tempfile
+from unittest import TestCase
+from nianalysis.utils import gather, reflink, MANIFEST_SUFFIX
+from nianalysis.interfaces.utils import GatherToDir
+
+
+class TestGather(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.orig_dir = os.getcwd()
+        os.chdir(self.tmp_dir)
+        os.mkdir('src')
+        for name in ('a.txt', 'b.txt'):
+            with open(os.path.join('src', name), 'w') as f:
+                f.write(name)
+        os.mkdir('src/frames')
+        with open('src/frames/frame000.nii', 'w') as f:
+            f.write('frame')
+
+    def tearDown(self):
+        os.chdir(self.orig_dir)
+        shutil.rmtree(self.tmp_dir)
+
+    def manifest(self, out_dir):
+        with open(out_dir + MANIFEST_SUFFIX) as f:
+            return json.load(f)
+
+    def test_link(self):
+        out_paths = gather(['src/a.txt', 'src/frames'], 'out',
+                           names=['renamed.txt', 'frames'])
+        self.assertEqual(out_paths, ['out/renamed.txt', 'out/frames'])
+        self.assertTrue(os.path.samefile('src/a.txt', 'out/renamed.txt'))
+        self.assertTrue(os.path.samefile('src/frames/frame000.nii',
+                                         'out/frames/frame000.nii'))
+        self.assertEqual(sorted(os.listdir('out')), ['frames', 'renamed.txt'])
+        self.assertEqual([e['method'] for e in self.manifest('out')],
+                         ['hardlink', 'hardlink'])
+        # Gathering more files into the directory extends the manifest
+        gather(['src/b.txt'], 'out')
+        self.assertEqual(len(self.manifest('out')), 3)
+
+    def test_rerun(self):
+        # Gathering into a directory left by a previous run must leave the
+        # sources intact, whether the existing files are links of them or not
+        gather(['src/a.txt', 'src/frames'], 'out')
+        gather(['src/a.txt', 'src/frames'], 'out')
+        with open('out/b.txt', 'w') as f:
+            f.write('stale')
+        gather(['src/b.txt'], 'out')
+        for name in ('a.txt', 'b.txt'):
+            with open(os.path.join('src', name)) as f:
+                self.assertEqual(f.read(), name)
+            self.assertTrue(os.path.samefile(os.path.join('src', name),
+                                             os.path.join('out', name)))
+        with open('src/frames/frame000.nii') as f:
+            self.assertEqual(f.read(), 'frame')
+
+    def test_reflink_existing(self):
+        os.link('src/a.txt', 'linked.txt')
+        try:
+            reflink('src/a.txt', 'linked.txt')
+        except (OSError, IOError, ImportError):
+            pass  # File-system doesn't support reflinks
+        with open('src/a.txt') as f:
+            self.assertEqual(f.read(), 'a.txt')
+        with open('linked.txt') as f:
+            self.assertEqual(f.read(), 'a.txt')
+        self.assertEqual(
+            [f for f in os.listdir('.') if f.startswith('.linked.txt')], [])
+
+    def test_fallback(self):
+        link = os.link
+
+        def unsupported(src, dst):
+            raise OSError('Links not supported')
+
+        os.link = unsupported
+        try:
+            gather(['src/a.txt'], 'out')
+        finally:
+            os.link = link
+        with open('out/a.txt') as f:
+            self.assertEqual(f.read(), 'a.txt')
+        self.assertIn(self.manifest('out')[0]['method'], ('reflink', 'copy'))
+
+    def test_move(self):
+        gather(['src/a.txt'], 'out', move=True)
+        self.assertFalse(os.path.exists('src/a.txt'))
+        self.assertTrue(os.path.exists('out/a.txt'))
+        self.assertEqual(self.manifest('out')[0]['method'], 'rename')
+
+    def test_gather_to_dir(self):
+        GatherToDir(in_files=[os.path.abspath('src/a.txt'),
+                              os.path.abspath('src/b.txt')],
+                    extension='.dcm').run()
+        self.assertEqual(sorted(os.listdir('store_dir')),
+                         ['0000.dcm', '0001.dcm'])
+        self.assertTrue(os.path.samefile('src/b.txt', 'store_dir/0001.dcm'))